@@ -1,6 +1,7 @@
 import json
 import os
 import io
+import hashlib
 import argparse
 from pathlib import Path
 import pandas as pd
@@ -20,6 +21,9 @@ response = secret_manager_client.access_secret_version(
     request={"name": secret_name})
 secret_value = response.payload.data.decode("UTF-8")
 
+# Directory of the scraper's content-addressed image store (see scraper/image_store.py)
+IMAGE_STORE_DIR_NAME = "image_store"
+
 
 def download_image_from_local(image_path):
     """Loads an image from the local file system."""
@@ -31,6 +35,25 @@ def download_image_from_local(image_path):
     return image_file_io, image_name
 
 
+def file_sha256(image_path):
+    """Content hash of an image; every id of a deduplicated scraped image links to the same bytes."""
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as image_file:
+        for chunk in iter(lambda: image_file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def iter_image_files(images_folder, valid_image_extensions=('.jpg', '.jpeg', '.png')):
+    """Yield the item images under `images_folder`, leaving out the scraper's image_store objects."""
+    for image_file in Path(images_folder).glob('**/*'):
+        if image_file.suffix.lower() not in valid_image_extensions:
+            continue
+        if IMAGE_STORE_DIR_NAME in image_file.relative_to(images_folder).parts[:-1]:
+            continue
+        yield image_file
+
+
 def preprocess_text(text):
     cleaned_text = re.sub(r'(\\u[0-9A-Fa-f]{4}|\\n|\\t)', '', text)
     cleaned_text = re.sub(r'\s+', ' ', cleaned_text).strip()
@@ -105,23 +128,27 @@ def wrapper_function():
     json_data = []
     failed_images = []
 
+    # Caption per image content, so ids sharing an image are captioned once
+    captions_by_hash = {}
+    reused_captions = 0
+
     total_images = 0
     batch_num = 1
 
     # Iterate through images and generate captions
-    image_files = Path(images_folder).glob('**/*')
-    valid_image_extensions = ['.jpg', '.jpeg', '.png']
-
-    for image_file in image_files:
-        if image_file.suffix.lower() not in valid_image_extensions:
-            continue
-
+    for image_file in iter_image_files(images_folder):
         total_images += 1
         print(f"Processing image {total_images}: {image_file.name}")
 
         try:
+            content_hash = file_sha256(image_file)
+            if content_hash in captions_by_hash:
+                json_data.append({'image': image_file.name, 'caption': captions_by_hash[content_hash]})
+                reused_captions += 1
+                continue
             caption, prompt_token, candidate_token, total_token = generate_captions_with_gemini(
                 image_file)
+            captions_by_hash[content_hash] = caption
             csv_data.append({
                 'image_name': image_file.name,
                 'prompt_token_count': prompt_token,
@@ -162,7 +189,8 @@ def wrapper_function():
         json.dump(json_data, json_file, indent=4)
 
     print(
-        f"Total images: {total_images}, successfully processed: {len(csv_data)}, failed: {len(failed_images)}")
+        f"Total images: {total_images}, successfully processed: {len(csv_data)}, "
+        f"reused captions: {reused_captions}, failed: {len(failed_images)}")
 
     print(f"File saved at: {os.path.abspath(output_path)}")
 
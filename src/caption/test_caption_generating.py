@@ -1,7 +1,7 @@
 import pytest
 from io import BytesIO
 from pathlib import Path
-from caption_generating import download_image_from_local
+from caption_generating import download_image_from_local, file_sha256, iter_image_files
 
 def test_download_image_from_local_1(tmp_path):
     # Create a temporary image file
@@ -164,4 +164,17 @@ def test_save_intermediate_results_2(tmp_path):
     # Check failed CSV
     failed_file = tmp_path / "failed_output_batch_2.csv"
     assert failed_file.exists()
-    assert pd.read_csv(failed_file).shape[0] == 2
\ No newline at end of file
+    assert pd.read_csv(failed_file).shape[0] == 2
+
+
+def test_iter_image_files_skips_image_store(tmp_path):
+    (tmp_path / "men").mkdir()
+    (tmp_path / "image_store" / "objects" / "ab").mkdir(parents=True)
+    (tmp_path / "men" / "image_1.jpg").write_bytes(b"same image")
+    (tmp_path / "men" / "image_2.jpg").write_bytes(b"same image")
+    (tmp_path / "men" / "notes.txt").write_bytes(b"not an image")
+    (tmp_path / "image_store" / "objects" / "ab" / "abcd.jpg").write_bytes(b"same image")
+
+    images = sorted(image.name for image in iter_image_files(tmp_path))
+    assert images == ["image_1.jpg", "image_2.jpg"]
+    assert file_sha256(tmp_path / "men" / "image_1.jpg") == file_sha256(tmp_path / "men" / "image_2.jpg")
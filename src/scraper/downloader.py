@@ -0,0 +1,307 @@
+import asyncio
+import os
+import random
+import time
+import uuid
+from collections import defaultdict
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import pandas as pd
+from aiohttp import ClientTimeout
+
+from proxy_pool import PROXY_FAILURE_STATUSES
+
+
+# Statuses worth retrying; 429 and 5xx also mean the host (or proxy) is overloaded
+RETRYABLE_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+
+
+def is_throttle_status(status):
+    return status == 429 or status >= 500
+
+
+def parse_retry_after(value, now=None):
+    """Seconds to wait from a Retry-After header (delay in seconds or an HTTP date), or None."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at - (time.time() if now is None else now))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit for one host that adapts with AIMD: every successful
+    download raises it by 1 / limit (about +1 per round of requests), and a
+    429 or 5xx halves it, at most once per `cooldown` seconds so one burst of
+    throttled responses only counts once. Other error statuses leave it as is.
+    """
+
+    def __init__(self, initial, max_limit, min_limit=1, decrease_factor=0.5, cooldown=1.0, clock=time.monotonic):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+        self.clock = clock
+        self.active = 0
+        self.decreases = 0
+        self._last_decrease = None
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def release(self, success=None):
+        """Release a slot; `success` True grows the limit, False shrinks it, None leaves it."""
+        async with self._condition:
+            self.active -= 1
+            if success:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            elif success is False:
+                now = self.clock()
+                if self._last_decrease is None or now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                    self._last_decrease = now
+                    self.decreases += 1
+            self._condition.notify_all()
+
+
+def iter_download_jobs(urls_df, output_folder, id_col, url_col, bad_urls):
+    """
+    Yield (url, image path, id) for each row of `urls_df`, lazily so the
+    downloader never holds more than its queue. Rows without a URL are
+    recorded in `bad_urls` instead. A missing id or URL column reads as None.
+    """
+    missing = [None] * len(urls_df)
+    item_ids = urls_df[id_col] if id_col in urls_df else missing
+    urls = urls_df[url_col] if url_col in urls_df else missing
+    for i, (item_id, url) in enumerate(zip(item_ids, urls)):
+        if pd.notna(url) and url:
+            yield url, os.path.join(output_folder, f"image_{item_id}.jpg"), item_id
+        else:
+            print(f"URL missing in row {i + 1}")
+            bad_urls.append({'url': 'Missing', 'id': item_id, 'error': 'No URL provided'})
+
+
+class StreamingDownloader:
+    """
+    Downloads images with a fixed pool of `max_concurrency` workers fed from a
+    bounded queue. Requests to one image host are limited by an AdaptiveLimiter
+    that starts at `per_host_initial` and ranges up to `per_host_limit`.
+
+    Timeouts, connection errors and retryable statuses are retried up to
+    `max_retries` times, after the Retry-After delay when the response gives
+    one and otherwise after an exponential backoff with full jitter. A
+    waiting retry does not hold a host slot.
+
+    With a `proxy_pool`, each attempt goes through the pool's least loaded
+    proxy session and reports back whether the proxy worked and how long the
+    response took; otherwise every request uses `proxy_url`.
+
+    Responses are streamed to disk in `chunk_size` pieces, with file I/O run
+    off the event loop, into a temporary file that is renamed into place once
+    complete, so an interrupted scrape never leaves truncated images behind.
+
+    With an `image_store` (an image_store.ImageStore), a completed download is
+    added to the store and the image path becomes a link to the stored object,
+    so an image already stored under another id is kept once. An image URL
+    the store has seen before is linked without being fetched again.
+    """
+
+    def __init__(self, session, max_concurrency=64, per_host_limit=30, chunk_size=64 * 1024,
+                 proxy_url=None, timeout=600, per_host_initial=8, max_retries=4, backoff_seconds=1.0,
+                 max_backoff_seconds=60.0, proxy_pool=None, image_store=None, sleep=asyncio.sleep,
+                 clock=time.monotonic):
+        self.session = session
+        self.max_concurrency = max_concurrency
+        self.per_host_limit = per_host_limit
+        self.per_host_initial = per_host_initial
+        self.chunk_size = chunk_size
+        self.proxy_url = proxy_url
+        self.proxy_pool = proxy_pool
+        self.image_store = image_store
+        self.timeout = ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.sleep = sleep
+        self.clock = clock
+        # Requests all go through the proxy, so the connector's per-host limit only sees
+        # the proxy; the image hosts are limited here
+        self._host_limiters = defaultdict(
+            lambda: AdaptiveLimiter(self.per_host_initial, self.per_host_limit, clock=self.clock))
+        self.bad_urls = []
+        self.downloaded = 0
+        self.skipped = 0
+        self.deduplicated = 0
+        self.duplicates = 0
+        self.bytes_written = 0
+        self.retries = 0
+        self.throttled = 0
+        self._started = None
+
+    @classmethod
+    def from_env(cls, session, proxy_url=None, proxy_pool=None, image_store=None):
+        return cls(
+            session,
+            max_concurrency=int(os.getenv('DOWNLOAD_CONCURRENCY', 64)),
+            per_host_limit=int(os.getenv('DOWNLOAD_PER_HOST_LIMIT', 30)),
+            chunk_size=int(os.getenv('DOWNLOAD_CHUNK_SIZE', 64 * 1024)),
+            proxy_url=proxy_url,
+            proxy_pool=proxy_pool,
+            image_store=image_store,
+            timeout=float(os.getenv('DOWNLOAD_TIMEOUT', 600)),
+            per_host_initial=int(os.getenv('DOWNLOAD_PER_HOST_INITIAL', 8)),
+            max_retries=int(os.getenv('DOWNLOAD_MAX_RETRIES', 4)),
+            backoff_seconds=float(os.getenv('DOWNLOAD_BACKOFF_SECONDS', 1)),
+            max_backoff_seconds=float(os.getenv('DOWNLOAD_MAX_BACKOFF_SECONDS', 60)),
+        )
+
+    async def run(self, jobs):
+        """Download every (url, path, id) job. Returns the list of failed downloads."""
+        self._started = self.clock()
+        queue = asyncio.Queue(maxsize=2 * self.max_concurrency)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.max_concurrency)]
+        try:
+            for job in jobs:
+                await queue.put(job)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return self.bad_urls
+
+    async def _worker(self, queue):
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            # One failing job must not take its worker down; run() would then wait on a full queue
+            try:
+                await self.download(*job)
+            except Exception as e:
+                url, image_name, item_id = job
+                print(f"Failed to download {url} as {image_name}: {e}")
+                self.bad_urls.append({'url': url, 'id': item_id, 'error': str(e) or type(e).__name__})
+
+    async def download(self, url, image_name, item_id):
+        # Check if the image already exists locally to skip downloading
+        if os.path.exists(image_name):
+            self.skipped += 1
+            return
+        known_hash = self.image_store.hash_for_url(url) if self.image_store is not None else None
+        if known_hash is not None:
+            await asyncio.to_thread(self._link_known, item_id, url, known_hash, image_name)
+            self.deduplicated += 1
+            return
+
+        limiter = self._host_limiters[urlsplit(url).netloc]
+        for attempt in range(self.max_retries + 1):
+            error, retryable, retry_after = await self._attempt(url, image_name, item_id, limiter)
+            if error is None:
+                return
+            if not retryable or attempt == self.max_retries:
+                break
+            self.retries += 1
+            if retry_after is None:
+                retry_after = random.uniform(0, self.backoff_seconds * 2 ** attempt)
+            await self.sleep(min(retry_after, self.max_backoff_seconds))
+
+        # Log the failed download
+        print(f"Failed to download {url} as {image_name}: {error}")
+        self.bad_urls.append({'url': url, 'id': item_id, 'error': error})
+
+    async def _attempt(self, url, image_name, item_id, limiter):
+        """One download attempt. Returns (error or None, retryable, Retry-After seconds or None)."""
+        tmp_name = f"{image_name}.{uuid.uuid4().hex}.part"
+        await limiter.acquire()
+        success = None
+        proxy, proxy_ok, latency = None, False, None
+        started = self.clock()
+        try:
+            proxy = self.proxy_pool.acquire() if self.proxy_pool is not None else None
+            proxy_url = proxy.url if proxy is not None else self.proxy_url
+            async with self.session.get(url, proxy=proxy_url, timeout=self.timeout) as response:
+                latency = self.clock() - started
+                proxy_ok = response.status not in PROXY_FAILURE_STATUSES
+                if response.status != 200:
+                    # Client errors such as a 404 say nothing about the host's capacity
+                    if is_throttle_status(response.status):
+                        success = False
+                        self.throttled += 1
+                    error = f'Failed with status code {response.status}'
+                    if response.status not in RETRYABLE_STATUSES:
+                        return error, False, None
+                    return error, True, parse_retry_after(response.headers.get('Retry-After'))
+                size = await self._stream_to_file(response, tmp_name)
+            if self.image_store is None:
+                await asyncio.to_thread(os.replace, tmp_name, image_name)
+            elif await asyncio.to_thread(self._store, item_id, url, tmp_name, image_name) == "duplicate":
+                self.duplicates += 1
+            success = True
+            self.downloaded += 1
+            self.bytes_written += size
+            return None, False, None
+        except Exception as e:
+            proxy_ok = False
+            await asyncio.to_thread(self._remove, tmp_name)
+            return str(e) or type(e).__name__, True, None
+        finally:
+            await limiter.release(success)
+            if proxy is not None:
+                await self.proxy_pool.release(
+                    proxy, proxy_ok, latency if latency is not None else self.clock() - started)
+
+    async def _stream_to_file(self, response, path):
+        f = await asyncio.to_thread(open, path, 'wb')
+        size = 0
+        try:
+            async for chunk in response.content.iter_chunked(self.chunk_size):
+                await asyncio.to_thread(f.write, chunk)
+                size += len(chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        return size
+
+    def _store(self, item_id, url, tmp_name, image_name):
+        content_hash, status = self.image_store.add_file(item_id, tmp_name, url)
+        self.image_store.link(content_hash, image_name)
+        return status
+
+    def _link_known(self, item_id, url, content_hash, image_name):
+        self.image_store.add_known(item_id, content_hash, url)
+        self.image_store.link(content_hash, image_name)
+
+    @staticmethod
+    def _remove(path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def stats(self):
+        elapsed = self.clock() - self._started if self._started is not None else 0.0
+        return {
+            'downloaded': self.downloaded,
+            'skipped': self.skipped,
+            'deduplicated': self.deduplicated,
+            'duplicates': self.duplicates,
+            'failed': len(self.bad_urls),
+            'retries': self.retries,
+            'throttled': self.throttled,
+            'bytes_written': self.bytes_written,
+            'downloads_per_minute': round(60 * self.downloaded / elapsed, 1) if elapsed else 0.0,
+            'host_limits': {host: round(limiter.limit, 2) for host, limiter in self._host_limiters.items()},
+            'proxy_pool': self.proxy_pool.stats() if self.proxy_pool is not None else None,
+            'image_store': self.image_store.stats() if self.image_store is not None else None,
+        }
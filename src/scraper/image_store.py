@@ -0,0 +1,199 @@
+"""
+Content-addressed store for scraped images, shared by every output folder:
+
+    <root>/objects/<sha256[:2]>/<sha256>.jpg   one file per distinct image
+    <root>/index.jsonl                         append-only journal, one line per item id:
+                                               {"id", "sha256", "url", "phash", "near_duplicate_of"}
+
+An item whose image is byte-identical to a stored one is recorded against the
+stored object instead of adding a new one. The per-item `image_{id}.jpg`
+files are hard links to the objects, so duplicates take no extra space and
+downstream steps (captioning, vectorized_db_init) see identical bytes for
+every id of the same image and only process it once.
+
+An image whose perceptual hash is within `near_duplicate_distance` bits of a
+stored one is still stored as its own object, and the closest match is only
+recorded as `near_duplicate_of`. The hash is grayscale, so colourways of one
+product photo look alike to it and must not share an object.
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+
+from PIL import Image
+
+STORE_DIR_NAME = "image_store"
+INDEX_FILE = "index.jsonl"
+HASH_BITS = 64
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def perceptual_hash(path):
+    """
+    64-bit difference hash (dHash): the image shrunk to 9x8 grayscale, one bit
+    per pair of horizontally adjacent pixels. Resizing and recompression leave
+    it (nearly) unchanged. Returns None for files PIL cannot read.
+    """
+    try:
+        with Image.open(path) as image:
+            image.draft('L', (64, 64))
+            pixels = image.convert('L').resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    except Exception:
+        return None
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class ImageStore:
+    """
+    See the module docstring. Near-duplicate lookups split each perceptual
+    hash into `near_duplicate_distance + 1` bands: two hashes within that
+    distance agree on at least one whole band, so only hashes sharing a band
+    are compared. A negative distance turns near-duplicate detection off.
+
+    Safe to call from several threads (the downloader runs it off the event loop).
+    """
+
+    def __init__(self, root, near_duplicate_distance=4):
+        self.root = root
+        self.near_duplicate_distance = near_duplicate_distance
+        self.ids = {}      # item id -> sha256 of its object
+        self.urls = {}     # image URL -> sha256 of its object
+        self.objects = set()
+        self.phashes = {}  # sha256 -> perceptual hash
+        self.near_duplicate_of = {}  # sha256 -> sha256 of the closest earlier object
+        self.duplicates = 0
+        self.near_duplicates = 0
+        self._lock = threading.Lock()
+        bands = near_duplicate_distance + 1 if near_duplicate_distance >= 0 else 0
+        self._band_bounds = [(HASH_BITS * i // bands, HASH_BITS * (i + 1) // bands) for i in range(bands)]
+        self._bands = [{} for _ in range(bands)]
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._load()
+
+    @classmethod
+    def from_env(cls, images_folder):
+        """None when IMAGE_STORE=false; the store lives in IMAGE_STORE_DIR, by default under `images_folder`."""
+        if os.getenv('IMAGE_STORE', 'true').lower() != 'true':
+            return None
+        return cls(
+            os.getenv('IMAGE_STORE_DIR') or os.path.join(images_folder, STORE_DIR_NAME),
+            near_duplicate_distance=int(os.getenv('IMAGE_NEAR_DUPLICATE_DISTANCE', 4)),
+        )
+
+    def _load(self):
+        index_path = os.path.join(self.root, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        with open(index_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                phash = int(entry['phash'], 16) if entry.get('phash') is not None else None
+                self._remember(entry['id'], entry['sha256'], entry.get('url'), phash,
+                               entry.get('near_duplicate_of'))
+
+    def _remember(self, item_id, sha256, url, phash, near_duplicate_of=None):
+        self.ids[item_id] = sha256
+        self.objects.add(sha256)
+        if near_duplicate_of is not None:
+            self.near_duplicate_of[sha256] = near_duplicate_of
+        if url:
+            self.urls[url] = sha256
+        if phash is not None and sha256 not in self.phashes:
+            self.phashes[sha256] = phash
+            for band, (start, end) in zip(self._bands, self._band_bounds):
+                band.setdefault(self._band_value(phash, start, end), []).append(sha256)
+
+    @staticmethod
+    def _band_value(phash, start, end):
+        return (phash >> start) & ((1 << (end - start)) - 1)
+
+    def _find_near_duplicate(self, phash):
+        best, best_distance = None, None
+        for band, (start, end) in zip(self._bands, self._band_bounds):
+            for candidate in band.get(self._band_value(phash, start, end), ()):
+                distance = hamming_distance(phash, self.phashes[candidate])
+                if distance <= self.near_duplicate_distance and (best is None or distance < best_distance):
+                    best, best_distance = candidate, distance
+        return best
+
+    def object_path(self, sha256):
+        return os.path.join(self.root, "objects", sha256[:2], f"{sha256}.jpg")
+
+    def hash_for_url(self, url):
+        return self.urls.get(url)
+
+    def add_file(self, item_id, path, url=None):
+        """
+        Store the image at `path` for `item_id`, taking ownership of the file
+        (it is moved into the store or deleted). Returns (sha256 of the object
+        the id now points to, "new", "duplicate" or "near_duplicate"). A
+        near-duplicate is stored as a new object like any other new image.
+        """
+        sha256 = file_sha256(path)
+        phash = perceptual_hash(path)
+        near = None
+        with self._lock:
+            if sha256 in self.objects or os.path.exists(self.object_path(sha256)):
+                status = "duplicate"
+                self.duplicates += 1
+                os.remove(path)
+            else:
+                near = self._find_near_duplicate(phash) if phash is not None else None
+                status = "new" if near is None else "near_duplicate"
+                if near is not None:
+                    self.near_duplicates += 1
+                os.makedirs(os.path.dirname(self.object_path(sha256)), exist_ok=True)
+                os.replace(path, self.object_path(sha256))
+            self._record(item_id, sha256, url, phash, near)
+        return sha256, status
+
+    def add_known(self, item_id, sha256, url=None):
+        """Point `item_id` at an object already in the store, e.g. for an image URL seen before."""
+        with self._lock:
+            self.duplicates += 1
+            self._record(item_id, sha256, url, self.phashes.get(sha256))
+
+    def _record(self, item_id, sha256, url, phash, near_duplicate_of=None):
+        item_id = str(item_id)
+        self._remember(item_id, sha256, url, phash, near_duplicate_of)
+        with open(os.path.join(self.root, INDEX_FILE), 'a') as f:
+            f.write(json.dumps({'id': item_id, 'sha256': sha256, 'url': url,
+                                'phash': f"{phash:016x}" if phash is not None else None,
+                                'near_duplicate_of': near_duplicate_of}) + "\n")
+
+    def link(self, sha256, dest):
+        """Materialize an object at `dest` as a hard link (a copy across filesystems), replacing any file there."""
+        tmp_dest = f"{dest}.{uuid.uuid4().hex}.part"
+        try:
+            os.link(self.object_path(sha256), tmp_dest)
+        except OSError:
+            shutil.copyfile(self.object_path(sha256), tmp_dest)
+        os.replace(tmp_dest, dest)
+
+    def stats(self):
+        return {
+            'objects': len(self.objects),
+            'ids': len(self.ids),
+            'duplicates': self.duplicates,
+            'near_duplicates': self.near_duplicates,
+        }
@@ -0,0 +1,119 @@
+import asyncio
+import os
+import uuid
+
+# Responses that say more about the exit node than about the image: the proxy
+# failing, or the image host blocking or throttling this IP
+PROXY_FAILURE_STATUSES = {403, 407, 429, 500, 502, 503, 504}
+
+
+class Proxy:
+    """One proxy session (a sticky exit node) and its health counters."""
+
+    def __init__(self, url, session_id):
+        self.url = url
+        self.session_id = session_id
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency = None  # exponentially weighted moving average, seconds
+
+    def as_dict(self):
+        return {
+            "session_id": self.session_id,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_latency_ms": round(1000 * self.latency, 1) if self.latency is not None else None,
+        }
+
+
+class ProxyPool:
+    """
+    Spreads downloads over `size` proxy sessions instead of a single proxy URL.
+
+    `new_url(session_id)` returns the proxy URL of a session, e.g. Apify's
+    ProxyConfiguration.new_url, where each session id pins its own exit IP.
+    Each request goes to the session with the fewest requests in flight
+    (then the lowest latency). A session is evicted and replaced by a fresh
+    one after `max_consecutive_failures` failures in a row, or once its
+    average latency exceeds `max_latency` seconds over at least
+    `min_samples` requests.
+    """
+
+    def __init__(self, new_url, size=8, max_consecutive_failures=3, max_latency=30.0, min_samples=5,
+                 latency_weight=0.2):
+        self.new_url = new_url
+        self.size = size
+        self.max_consecutive_failures = max_consecutive_failures
+        self.max_latency = max_latency
+        self.min_samples = min_samples
+        self.latency_weight = latency_weight
+        self.proxies = []
+        self.evictions = 0
+        # Serializes refills, so releases finishing together do not overfill the pool
+        self._refill_lock = asyncio.Lock()
+
+    @classmethod
+    def from_env(cls, new_url):
+        return cls(
+            new_url,
+            size=int(os.getenv('PROXY_POOL_SIZE', 8)),
+            max_consecutive_failures=int(os.getenv('PROXY_MAX_CONSECUTIVE_FAILURES', 3)),
+            max_latency=float(os.getenv('PROXY_MAX_LATENCY', 30)),
+        )
+
+    async def _new_proxy(self):
+        # Apify session ids are limited to 50 alphanumeric, '.', '_' or '~' characters
+        session_id = f"scraper_{uuid.uuid4().hex[:16]}"
+        return Proxy(await self.new_url(session_id=session_id), session_id)
+
+    async def start(self):
+        while len(self.proxies) < self.size:
+            self.proxies.append(await self._new_proxy())
+        return self
+
+    def acquire(self):
+        """Pick the least loaded proxy and count a request on it."""
+        if not self.proxies:
+            raise RuntimeError("No proxies available")
+        proxy = min(self.proxies, key=lambda p: (p.in_flight, p.latency or 0.0))
+        proxy.in_flight += 1
+        proxy.requests += 1
+        return proxy
+
+    async def release(self, proxy, ok, latency=None):
+        """Record a finished request on `proxy`, replacing the proxy if it is no longer healthy."""
+        proxy.in_flight -= 1
+        if ok:
+            proxy.consecutive_failures = 0
+        else:
+            proxy.failures += 1
+            proxy.consecutive_failures += 1
+        if latency is not None:
+            proxy.latency = latency if proxy.latency is None else (
+                self.latency_weight * latency + (1 - self.latency_weight) * proxy.latency)
+
+        slow = proxy.requests >= self.min_samples and proxy.latency is not None and proxy.latency > self.max_latency
+        if (proxy.consecutive_failures >= self.max_consecutive_failures or slow) and proxy in self.proxies:
+            self.proxies.remove(proxy)
+            self.evictions += 1
+            reason = "slow" if slow else "failing"
+            print(f"Evicting {reason} proxy session {proxy.session_id}: {proxy.as_dict()}")
+        if len(self.proxies) < self.size:
+            async with self._refill_lock:
+                # Another release may have refilled the pool while this one waited
+                if len(self.proxies) < self.size:
+                    try:
+                        self.proxies.append(await self._new_proxy())
+                    except Exception as e:
+                        # The pool runs smaller until a later request manages to open a replacement
+                        print(f"Could not open a replacement proxy session: {e}")
+
+    def stats(self):
+        return {
+            "size": len(self.proxies),
+            "evictions": self.evictions,
+            "proxies": [proxy.as_dict() for proxy in self.proxies],
+        }
@@ -1,8 +1,6 @@
 
 from apify_client import ApifyClient
 import pandas as pd
-from io import StringIO
-import requests
 from dotenv import load_dotenv
 import os
 import sys
@@ -10,7 +8,10 @@ import aiohttp
 import asyncio
 from google.cloud import secretmanager
 from apify import Actor
-from aiohttp import ClientTimeout
+from downloader import StreamingDownloader, iter_download_jobs
+from image_store import ImageStore
+from proxy_pool import ProxyPool
+from seed_export import export_dataset_to_parquet, load_items_seed
 
 # Load the .env file
 load_dotenv()
@@ -21,6 +22,8 @@ images_folder = os.getenv('SCRAPED_RAW_IMAGES')
 
 men_file_name = os.getenv('MEN_FILE_NAME')
 women_file_name = os.getenv('WOMEN_FILE_NAME')
+# Start URL crawled by the Apify Actor to produce the men's seed; when unset, an existing seed is used
+men_seed_url = os.getenv('MEN_SEED_URL')
 
 id_col_name = os.getenv('COLUMN_ID_NAME')
 image_url_col = os.getenv('URL_IMAGE')
@@ -28,6 +31,8 @@ bad_urls_men_file_name = os.getenv('BAD_URLS_MEN')
 bad_urls_women_file_name = os.getenv('BAD_URLS_WOMEN')
 
 scrape_data = os.getenv('SCRAP_IMAGES')
+# Only retry the downloads recorded in the bad-URL CSV of an earlier run
+rerun_bad_urls = os.getenv('RERUN_BAD_URLS', 'false').lower() == 'true'
 
 # Initialize the ApifyClient with your API token
 client = secretmanager.SecretManagerServiceClient()
@@ -42,7 +47,11 @@ os.environ['APIFY_TOKEN'] = secret_value
 num_items_to_download = int(os.getenv('MAX_ITEMS'))
 
 
-def get_items_seed(url):
+def get_items_seed(url, output_path):
+    """
+    Crawl `url` with the Apify Actor and stream the resulting dataset into a
+    Parquet seed at `output_path` (see seed_export). Returns the number of items.
+    """
     # Prepare the Actor input for each page
     run_input = {
         "startUrls": [{"url": url}],
@@ -60,90 +69,39 @@ def get_items_seed(url):
 
     dataset_id = run["defaultDatasetId"]
 
-    # Fetch and print Actor results from the run's dataset (if there are any)
-    # for item in client.dataset(run["defaultDatasetId"]).iterate_items():
-    #     print(item)
-    # Fetch Actor results from the run's dataset
-    # all_items.append(item)
-    # API URL to get the dataset in CSV format
-    api_url = f"https://api.apify.com/v2/datasets/{dataset_id}/items?format=csv"
-
-    # Fetch the CSV file
-    response = requests.get(api_url)
-
-    # Decode the byte string to UTF-8 and remove BOM
-    # The 'utf-8-sig' will handle the BOM
-    decoded_data = response.content.decode('utf-8-sig')
-
-    # Use StringIO to treat the decoded string as a file-like object
-    csv_data = StringIO(decoded_data)
-    df = pd.read_csv(csv_data)
-    return df
-
-# Function to asynchronously download a single image using Apify proxy
-async def download_image(session, url, image_name, bad_urls, id, proxy_url):
-    # Check if the image already exists locally to skip downloading
-    if os.path.exists(image_name):
-        print(f"{image_name} already exists, skipping download.")
-        return
-
-    try:
-        # Fetch the image using Apify's proxy service
-        async with session.get(url, proxy=proxy_url, timeout=ClientTimeout(total=600)) as response:
-            if response.status == 200:
-                # Save the image
-                with open(image_name, 'wb') as f:
-                    f.write(await response.read())
-                print(f"Photo successfully downloaded as {image_name}")
-            else:
-                # Log the failed download
-                print(
-                    f"Failed to download {image_name}. Status code: {response.status}")
-                bad_urls.append(
-                    {'url': url, 'id': id, 'error': f'Failed with status code {response.status}'})
-    except Exception as e:
-        # Log any exceptions
-        print(f"Error downloading {url}: {e}")
-        bad_urls.append({'url': url, 'id': id, 'error': str(e)})
+    # The CSV export is fetched page by page and written in chunks, keeping only SEED_COLUMNS
+    items = export_dataset_to_parquet(
+        dataset_id, output_path, token=secret_value,
+        page_size=int(os.getenv('SEED_PAGE_SIZE', 50000)),
+        chunk_rows=int(os.getenv('SEED_CHUNK_ROWS', 10000)),
+    )
+    print(f"Saved {items} items from dataset {dataset_id} to {output_path}")
+    return items
 
 # Function to download multiple images asynchronously and return a DataFrame of failed downloads
 async def download_images(urls_df, output_folder):
     # Ensure the output folder exists
     os.makedirs(output_folder, exist_ok=True)
-    bad_urls = []  # List to store information about failed downloads
 
     # Set up Apify proxy configuration to use residential proxies
     async with Actor:
         proxy_configuration = await Actor.create_proxy_configuration(
             groups=['RESIDENTIAL']  # Use Apify's residential proxies
         )
-        proxy_url = await proxy_configuration.new_url()  # Get the proxy URL
-        proxies = {
-            'http': proxy_url,
-            'https': proxy_url,
-        }
-
-        # Create an aiohttp session with a limited connection pool
-        # Limit to 30 concurrent connections per host
-        connector = aiohttp.TCPConnector(limit_per_host=30)
+        # Downloads rotate over PROXY_POOL_SIZE proxy sessions, each with its own exit IP
+        proxy_pool = await ProxyPool.from_env(proxy_configuration.new_url).start()
+
+        # The downloader's worker pool caps concurrency globally and per image host
+        # (DOWNLOAD_CONCURRENCY, DOWNLOAD_PER_HOST_LIMIT), so the connector itself is unbounded
+        connector = aiohttp.TCPConnector(limit=0)
         async with aiohttp.ClientSession(connector=connector) as session:
-            tasks = []
-            for i, row in urls_df.iterrows():
-                url = row.get(image_url_col)
-                if url:
-                    # Construct the image name based on the id column
-                    image_name = os.path.join(
-                        output_folder, f"image_{row.get(id_col_name)}.jpg")
-                    # Schedule the download task, passing the proxy_url
-                    tasks.append(download_image(
-                        session, url, image_name, bad_urls, row.get(id_col_name), proxy_url))
-                else:
-                    print(f"URL missing in row {i + 1}")
-                    bad_urls.append({'url': 'Missing', 'id': row.get(
-                        id_col_name), 'error': 'No URL provided'})
-
-            # Await the completion of all tasks
-            await asyncio.gather(*tasks)
+            # Images are kept once per content in a store shared by the men's and women's folders
+            image_store = ImageStore.from_env(images_folder)
+            downloader = StreamingDownloader.from_env(session, proxy_pool=proxy_pool, image_store=image_store)
+            # Rows are turned into jobs as the queue drains; rows without a URL go straight to bad_urls
+            jobs = iter_download_jobs(urls_df, output_folder, id_col_name, image_url_col, downloader.bad_urls)
+            bad_urls = await downloader.run(jobs)
+            print(f"Download stats: {downloader.stats()}")
 
     # Convert bad_urls list to a Pandas DataFrame and return it
     if bad_urls:
@@ -154,14 +112,37 @@ async def download_images(urls_df, output_folder):
         # Return an empty DataFrame if no errors
         return pd.DataFrame(columns=['url', 'id', 'error'])
 
+def load_bad_urls(bad_urls_path):
+    """
+    Read a saved bad-URL CSV back as download rows (id and image URL columns).
+    Returns (rows to retry, rows that had no URL to begin with).
+    """
+    bad_urls_df = pd.read_csv(bad_urls_path)
+    missing = bad_urls_df['url'].isna() | (bad_urls_df['url'] == 'Missing')
+    retry_df = bad_urls_df[~missing].drop_duplicates('id')
+    return (pd.DataFrame({id_col_name: retry_df['id'], image_url_col: retry_df['url']}),
+            bad_urls_df[missing])
+
+
 if __name__ == '__main__':
     try:
-        df_men = pd.read_csv(os.path.join(meta_data_folder, men_file_name))
-        bad_image_metadata_men = asyncio.run(download_images(
-            df_men, os.path.join(images_folder, os.path.splitext(men_file_name)[0])))
+        bad_urls_men_path = os.path.join(meta_data_folder, bad_urls_men_file_name)
+        output_folder_men = os.path.join(images_folder, os.path.splitext(men_file_name)[0])
+        if rerun_bad_urls:
+            df_men, missing_men = load_bad_urls(bad_urls_men_path)
+            print(f"Retrying {len(df_men)} failed downloads from {bad_urls_men_path}")
+            bad_image_metadata_men = pd.concat(
+                [missing_men, asyncio.run(download_images(df_men, output_folder_men))], ignore_index=True)
+        else:
+            seed_men_path = os.path.join(meta_data_folder, men_file_name)
+            if men_seed_url:
+                get_items_seed(men_seed_url, seed_men_path)
+            # Only the id and image URL columns are read from the seed
+            df_men = load_items_seed(seed_men_path, columns=[id_col_name, image_url_col])
+            bad_image_metadata_men = asyncio.run(download_images(df_men, output_folder_men))
         print("Images saved for men")
-        bad_image_metadata_men.to_csv(os.path.join(
-            meta_data_folder, bad_urls_men_file_name), index=False)
+        # The CSV is rewritten with what is still missing, ready for the next rerun
+        bad_image_metadata_men.to_csv(bad_urls_men_path, index=False)
 
         print("Images files were saved")
         sys.exit(0)
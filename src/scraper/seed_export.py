@@ -0,0 +1,102 @@
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import requests
+
+APIFY_API_URL = "https://api.apify.com/v2"
+
+# The item fields the pipeline reads, as flattened by Apify's CSV export: the scraper
+# needs the id and image URL, vectorized_db_init the rest (see its METADATA_COLUMNS)
+SEED_COLUMNS = (
+    "source/id",
+    "medias/0/url",
+    "medias/0/alt",
+    "categories/0",
+    "categories/1",
+    "categories/2",
+    "brand",
+    "source/crawlUrl",
+)
+
+
+def write_csv_chunks(csv_file, writer, columns, chunk_rows):
+    """
+    Parse `csv_file` `chunk_rows` rows at a time, keeping only `columns` (as
+    strings; columns missing from the file are null) and appending each chunk
+    to the ParquetWriter. Returns the number of rows written.
+    """
+    try:
+        # 'utf-8-sig' drops the BOM Apify puts at the start of CSV exports
+        chunks = pd.read_csv(csv_file, encoding="utf-8-sig", usecols=lambda column: column in columns,
+                             dtype=str, chunksize=chunk_rows)
+    except pd.errors.EmptyDataError:
+        return 0
+    rows = 0
+    with chunks:
+        for chunk in chunks:
+            arrays = [
+                pa.array(chunk[column], type=pa.string(), from_pandas=True) if column in chunk
+                else pa.nulls(len(chunk), type=pa.string())
+                for column in columns
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=writer.schema))
+            rows += len(chunk)
+    return rows
+
+
+def export_dataset_to_parquet(dataset_id, path, token=None, columns=SEED_COLUMNS, page_size=50000,
+                              chunk_rows=10000, api_url=APIFY_API_URL, session=None, timeout=300):
+    """
+    Write the items of an Apify dataset to a Parquet file at `path`, keeping only `columns`.
+
+    The dataset is read `page_size` items at a time with the CSV export's
+    offset/limit. Each page is streamed and parsed `chunk_rows` rows at a
+    time, so memory stays bounded by a chunk rather than the dataset. Only the
+    top-level fields behind `columns` are requested. The file is written
+    under a temporary name and renamed into place once complete. Returns the
+    number of rows written.
+    """
+    session = session or requests.Session()
+    headers = {"Authorization": f"Bearer {token}"} if token else {}
+    fields = ",".join(dict.fromkeys(column.split("/")[0] for column in columns))
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    tmp_path = f"{path}.part"
+    rows = 0
+    try:
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            offset = 0
+            while True:
+                params = {"format": "csv", "fields": fields, "offset": offset, "limit": page_size}
+                with session.get(f"{api_url}/datasets/{dataset_id}/items", params=params, headers=headers,
+                                 stream=True, timeout=timeout) as response:
+                    response.raise_for_status()
+                    # Let urllib3 undo any gzip transfer encoding while streaming
+                    response.raw.decode_content = True
+                    page_rows = write_csv_chunks(response.raw, writer, columns, chunk_rows)
+                rows += page_rows
+                offset += page_size
+                if page_rows < page_size:
+                    break
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, path)
+    return rows
+
+
+def load_items_seed(path, columns=None):
+    """
+    Load a seed written by export_dataset_to_parquet, reading only `columns`.
+    CSV seeds from older runs are read too: a missing `<name>.parquet` falls
+    back to `<name>.csv` until the seed is exported again.
+    """
+    csv_path = f"{os.path.splitext(path)[0]}.csv"
+    if path.endswith(".parquet") and not os.path.exists(path) and os.path.exists(csv_path):
+        print(f"{path} not found, reading the CSV seed {csv_path}; set the seed URL to export a Parquet seed")
+        path = csv_path
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, columns=columns)
+    return pd.read_csv(path, usecols=columns)
@@ -0,0 +1,245 @@
+import asyncio
+import os
+
+import aiohttp
+import pandas as pd
+import pytest
+from aiohttp import web
+
+from downloader import AdaptiveLimiter, StreamingDownloader, iter_download_jobs, parse_retry_after
+from image_store import ImageStore
+
+IMAGE_BYTES = bytes(range(256)) * 1024  # 256 KiB, several chunks
+
+
+@pytest.fixture
+async def image_server():
+    """Local image host that records how many requests it serves at once."""
+    state = {"active": 0, "peak": 0, "flaky_calls": 0}
+
+    async def image(request):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(0.01)
+            name = request.match_info["name"]
+            if name == "missing.jpg":
+                return web.Response(status=404)
+            if name == "flaky.jpg":
+                state["flaky_calls"] += 1
+                if state["flaky_calls"] == 1:
+                    return web.Response(status=429, headers={"Retry-After": "2"})
+                if state["flaky_calls"] == 2:
+                    return web.Response(status=503)
+            response = web.StreamResponse()
+            response.content_length = len(IMAGE_BYTES)
+            await response.prepare(request)
+            if name == "truncated.jpg":
+                # Send half the body, then drop the connection
+                await response.write(IMAGE_BYTES[:len(IMAGE_BYTES) // 2])
+                request.transport.close()
+                return response
+            await response.write(IMAGE_BYTES)
+            return response
+        finally:
+            state["active"] -= 1
+
+    app = web.Application()
+    app.router.add_get("/{name}", image)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    yield f"http://127.0.0.1:{port}", state
+    await runner.cleanup()
+
+
+async def test_streaming_downloader(image_server, tmp_path):
+    base_url, state = image_server
+    urls_df = pd.DataFrame({
+        "id": list(range(20)) + [20, 21, 22],
+        "url": [f"{base_url}/{i}.jpg" for i in range(20)]
+               + [f"{base_url}/missing.jpg", None, f"{base_url}/truncated.jpg"],
+    })
+    # An image from an earlier run is not downloaded again
+    (tmp_path / "image_0.jpg").write_bytes(b"existing")
+
+    async with aiohttp.ClientSession() as session:
+        downloader = StreamingDownloader(session, max_concurrency=8, per_host_limit=3, chunk_size=16 * 1024,
+                                         max_retries=2, backoff_seconds=0.01)
+        jobs = iter_download_jobs(urls_df, str(tmp_path), "id", "url", downloader.bad_urls)
+        bad_urls = await downloader.run(jobs)
+
+    assert state["peak"] <= 3
+    assert (tmp_path / "image_0.jpg").read_bytes() == b"existing"
+    for i in range(1, 20):
+        assert (tmp_path / f"image_{i}.jpg").read_bytes() == IMAGE_BYTES
+    # Failed downloads leave neither a truncated image nor a temporary file
+    assert not (tmp_path / "image_22.jpg").exists()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+    assert sorted(bad["id"] for bad in bad_urls) == [20, 21, 22]
+    stats = downloader.stats()
+    assert (stats["downloaded"], stats["skipped"], stats["failed"]) == (19, 1, 3)
+    assert stats["bytes_written"] == 19 * len(IMAGE_BYTES)
+    # The truncated download is retried; the 404 is not
+    assert stats["retries"] == 2
+
+
+async def test_retries_honour_retry_after_and_shrink_host_limit(image_server, tmp_path):
+    base_url, state = image_server
+    delays = []
+
+    async def sleep(seconds):
+        delays.append(seconds)
+
+    async with aiohttp.ClientSession() as session:
+        downloader = StreamingDownloader(session, max_concurrency=4, per_host_limit=8, per_host_initial=8,
+                                         backoff_seconds=0.5, sleep=sleep)
+        await downloader.run([(f"{base_url}/flaky.jpg", str(tmp_path / "image_1.jpg"), 1)])
+
+    assert (tmp_path / "image_1.jpg").read_bytes() == IMAGE_BYTES
+    assert state["flaky_calls"] == 3
+    # 429 with Retry-After waits as told; the 503 falls back to jittered backoff (up to 0.5 * 2)
+    assert delays[0] == 2.0
+    assert 0 <= delays[1] <= 1.0
+    stats = downloader.stats()
+    assert stats["retries"] == 2
+    assert stats["throttled"] == 2
+    assert stats["failed"] == 0
+    # Halved once (the 503 came within the cooldown), then grown by the success
+    assert list(stats["host_limits"].values())[0] == pytest.approx(4.25)
+
+
+async def test_client_errors_leave_host_limit_unchanged(image_server, tmp_path):
+    base_url, _ = image_server
+
+    async with aiohttp.ClientSession() as session:
+        downloader = StreamingDownloader(session, max_concurrency=2, per_host_limit=8, per_host_initial=2)
+        jobs = [(f"{base_url}/missing.jpg", str(tmp_path / f"image_{i}.jpg"), i) for i in range(6)]
+        bad_urls = await downloader.run(jobs)
+
+    assert len(bad_urls) == 6
+    stats = downloader.stats()
+    # Dead URLs neither grow nor shrink the concurrency against their host
+    assert list(stats["host_limits"].values())[0] == 2
+    assert stats["throttled"] == 0
+
+
+async def test_downloads_are_deduplicated_through_image_store(image_server, tmp_path):
+    base_url, _ = image_server
+    store = ImageStore(str(tmp_path / "image_store"))
+    jobs = [
+        (f"{base_url}/a.jpg", str(tmp_path / "image_1.jpg"), 1),
+        (f"{base_url}/b.jpg", str(tmp_path / "image_2.jpg"), 2),  # same bytes under another URL
+    ]
+
+    async with aiohttp.ClientSession() as session:
+        downloader = StreamingDownloader(session, max_concurrency=1, image_store=store)
+        await downloader.run(jobs)
+        # A URL the store already holds is linked without a request
+        await downloader.run([(f"{base_url}/a.jpg", str(tmp_path / "image_3.jpg"), 3)])
+
+    stats = downloader.stats()
+    assert stats["downloaded"] == 2
+    assert stats["duplicates"] == 1
+    assert stats["deduplicated"] == 1
+    assert stats["image_store"]["objects"] == 1
+    inodes = {os.stat(tmp_path / f"image_{i}.jpg").st_ino for i in (1, 2, 3)}
+    assert len(inodes) == 1
+    assert (tmp_path / "image_3.jpg").read_bytes() == IMAGE_BYTES
+    assert set(ImageStore(str(tmp_path / "image_store")).ids) == {"1", "2", "3"}
+
+
+async def test_failing_job_does_not_stop_the_workers(image_server, tmp_path):
+    base_url, _ = image_server
+    store = ImageStore(str(tmp_path / "image_store"))
+
+    def broken_link(content_hash, dest):
+        raise OSError("disk full")
+
+    async with aiohttp.ClientSession() as session:
+        downloader = StreamingDownloader(session, max_concurrency=1, image_store=store)
+        await downloader.run([(f"{base_url}/a.jpg", str(tmp_path / "image_1.jpg"), 1)])
+        store.link = broken_link
+        # Every job fails in the only worker; the run must still finish
+        jobs = [(f"{base_url}/a.jpg", str(tmp_path / f"image_{i}.jpg"), i) for i in range(2, 8)]
+        bad_urls = await asyncio.wait_for(downloader.run(jobs), timeout=5)
+
+    assert [bad["id"] for bad in bad_urls] == list(range(2, 8))
+    assert bad_urls[0]["error"] == "disk full"
+
+
+def test_iter_download_jobs_tolerates_missing_columns(tmp_path):
+    bad_urls = []
+    urls_df = pd.DataFrame({"id": [1, 2], "image_url": ["https://img/1.jpg", None]})
+
+    jobs = list(iter_download_jobs(urls_df, str(tmp_path), "source/id", "image_url", bad_urls))
+    assert jobs == [("https://img/1.jpg", os.path.join(str(tmp_path), "image_None.jpg"), None)]
+
+    assert list(iter_download_jobs(urls_df, str(tmp_path), "id", "medias/0/url", bad_urls)) == []
+    assert [bad["id"] for bad in bad_urls] == [None, 1, 2]
+
+
+async def test_adaptive_limiter_aimd():
+    now = [0.0]
+    limiter = AdaptiveLimiter(initial=4, max_limit=5, cooldown=1.0, clock=lambda: now[0])
+
+    for _ in range(10):
+        await limiter.acquire()
+        await limiter.release(success=True)
+    assert limiter.limit == 5
+
+    await limiter.acquire()
+    await limiter.release(success=False)
+    await limiter.acquire()
+    await limiter.release(success=False)
+    assert limiter.limit == 2.5
+    now[0] = 2.0
+    for _ in range(3):
+        await limiter.acquire()
+        await limiter.release(success=False)
+    assert limiter.limit == 1.25
+    assert limiter.decreases == 2
+
+    # At the limit, a further acquire waits for a release
+    await limiter.acquire()
+    waiter = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    await limiter.release()
+    await waiter
+    assert limiter.active == 1
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("7") == 7.0
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", now=1445412470) == pytest.approx(10.0)
+
+
+async def test_download_queue_is_bounded(tmp_path):
+    """Jobs are pulled from the iterator only as workers free up."""
+    pulled = []
+
+    def jobs():
+        for i in range(100):
+            pulled.append(i)
+            yield f"http://example.invalid/{i}.jpg", str(tmp_path / f"image_{i}.jpg"), i
+
+    release = asyncio.Event()
+
+    class BlockedDownloader(StreamingDownloader):
+        async def download(self, url, image_name, item_id):
+            await release.wait()
+
+    downloader = BlockedDownloader(session=None, max_concurrency=2)
+    run = asyncio.create_task(downloader.run(jobs()))
+    await asyncio.sleep(0.05)
+    # Two jobs in the workers, four queued, one waiting to be queued
+    assert len(pulled) <= 2 + 2 * 2 + 1
+    release.set()
+    await run
+    assert len(pulled) == 100
@@ -0,0 +1,70 @@
+import os
+
+from PIL import Image, ImageDraw
+
+from image_store import ImageStore, hamming_distance, perceptual_hash
+
+
+def make_image(path, size=(256, 256), shapes=((40, 40, 120, 200),), quality=90, colour=(20, 60, 160)):
+    image = Image.new("RGB", size, (230, 230, 230))
+    draw = ImageDraw.Draw(image)
+    scale_x, scale_y = size[0] / 256, size[1] / 256
+    for x0, y0, x1, y1 in shapes:
+        draw.rectangle((x0 * scale_x, y0 * scale_y, x1 * scale_x, y1 * scale_y), fill=colour)
+    image.save(path, quality=quality)
+    return path
+
+
+def test_perceptual_hash_tolerates_resizing(tmp_path):
+    original = perceptual_hash(make_image(tmp_path / "a.jpg"))
+    resized = perceptual_hash(make_image(tmp_path / "b.jpg", size=(180, 180), quality=60))
+    other = perceptual_hash(make_image(tmp_path / "c.jpg", shapes=((150, 10, 250, 90), (10, 180, 90, 250))))
+
+    assert hamming_distance(original, resized) <= 4
+    assert hamming_distance(original, other) > 10
+    (tmp_path / "d.jpg").write_bytes(b"not an image")
+    assert perceptual_hash(tmp_path / "d.jpg") is None
+
+
+def test_image_store_keeps_exact_duplicates_once(tmp_path):
+    store = ImageStore(str(tmp_path / "store"))
+
+    first, status = store.add_file(1, str(make_image(tmp_path / "1.jpg")), url="http://img/1.jpg")
+    assert status == "new"
+    assert os.path.exists(store.object_path(first))
+    assert not os.path.exists(tmp_path / "1.jpg")
+
+    assert store.add_file(2, str(make_image(tmp_path / "2.jpg"))) == (first, "duplicate")
+    assert not os.path.exists(tmp_path / "2.jpg")
+
+    # A resized copy is only flagged: it keeps its own bytes
+    resized, status = store.add_file(3, str(make_image(tmp_path / "3.jpg", size=(180, 180), quality=60)))
+    assert status == "near_duplicate" and resized != first
+    assert store.near_duplicate_of[resized] == first
+
+    # A colourway has (nearly) the same grayscale hash but must never share the black item's image
+    red, status = store.add_file(4, str(make_image(tmp_path / "4.jpg", colour=(200, 20, 20))))
+    assert red not in (first, resized)
+    assert os.path.exists(store.object_path(red))
+
+    other, status = store.add_file(5, str(make_image(tmp_path / "5.jpg", shapes=((150, 10, 250, 90),))))
+    assert status == "new" and other not in (first, resized, red)
+
+    store.link(first, str(tmp_path / "image_2.jpg"))
+    assert os.path.samefile(tmp_path / "image_2.jpg", store.object_path(first))
+    assert store.stats()["objects"] == 4
+    assert store.stats()["duplicates"] == 1
+
+    # The index is reloaded from its journal
+    reopened = ImageStore(str(tmp_path / "store"))
+    assert reopened.ids == {"1": first, "2": first, "3": resized, "4": red, "5": other}
+    assert reopened.hash_for_url("http://img/1.jpg") == first
+    assert reopened.near_duplicate_of[resized] == first
+
+
+def test_near_duplicate_detection_can_be_disabled(tmp_path):
+    store = ImageStore(str(tmp_path / "store"), near_duplicate_distance=-1)
+    first, _ = store.add_file(1, str(make_image(tmp_path / "1.jpg")))
+    second, status = store.add_file(2, str(make_image(tmp_path / "2.jpg", size=(180, 180), quality=60)))
+    assert status == "new" and second != first
+    assert store.near_duplicate_of == {}
@@ -0,0 +1,90 @@
+import csv
+import gzip
+import io
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pandas as pd
+import pyarrow.parquet as pq
+import pytest
+
+from seed_export import SEED_COLUMNS, export_dataset_to_parquet, load_items_seed
+
+ITEMS = 25
+
+
+def dataset_csv(offset, limit):
+    """One page of a CSV export: a BOM, a gzip-able body, extra columns and no categories/2 column."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(["source/id", "medias/0/url", "medias/0/alt", "medias/1/url", "categories/0",
+                     "categories/1", "brand", "source/crawlUrl", "description"])
+    for i in range(offset, min(offset + limit, ITEMS)):
+        writer.writerow([i, f"https://img/{i}.jpg", f"Item, \"{i}\"", "", "men", "shoes",
+                         "" if i % 5 == 0 else f"Brand {i}", f"https://shop/{i}", "multi\nline"])
+    return ("﻿" + out.getvalue()).encode("utf-8")
+
+
+@pytest.fixture
+def apify_api():
+    requests_seen = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            query = {key: values[0] for key, values in parse_qs(urlsplit(self.path).query).items()}
+            requests_seen.append((urlsplit(self.path).path, query, self.headers.get("Authorization")))
+            body = gzip.compress(dataset_csv(int(query["offset"]), int(query["limit"])))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/csv")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", requests_seen
+    server.shutdown()
+
+
+def test_export_dataset_to_parquet(apify_api, tmp_path):
+    api_url, requests_seen = apify_api
+    path = str(tmp_path / "men.parquet")
+
+    rows = export_dataset_to_parquet("abc", path, token="secret", page_size=10, chunk_rows=4, api_url=api_url)
+
+    assert rows == ITEMS
+    # Pages of 10 until a short page
+    assert [query["offset"] for _, query, _ in requests_seen] == ["0", "10", "20"]
+    path_seen, query, auth = requests_seen[0]
+    assert path_seen == "/datasets/abc/items"
+    assert query["fields"] == "source,medias,categories,brand"
+    assert auth == "Bearer secret"
+
+    assert pq.read_schema(path).names == list(SEED_COLUMNS)
+    df = load_items_seed(path)
+    assert df["source/id"].tolist() == [str(i) for i in range(ITEMS)]
+    assert df.loc[3, "medias/0/alt"] == 'Item, "3"'
+    assert df["categories/2"].isna().all()
+    assert df["brand"].isna().sum() == 5
+    assert not (tmp_path / "men.parquet.part").exists()
+
+    urls = load_items_seed(path, columns=["source/id", "medias/0/url"])
+    assert list(urls.columns) == ["source/id", "medias/0/url"]
+
+
+def test_load_items_seed_reads_csv_seeds(tmp_path):
+    path = str(tmp_path / "men.csv")
+    pd.DataFrame({"source/id": [1, 2], "medias/0/url": ["a", "b"], "brand": ["x", "y"]}).to_csv(path, index=False)
+    assert list(load_items_seed(path, columns=["source/id", "medias/0/url"]).columns) == ["source/id", "medias/0/url"]
+
+    # Seeds downloaded as CSV before the switch to Parquet are still found
+    parquet_path = str(tmp_path / "men.parquet")
+    assert load_items_seed(parquet_path, columns=["source/id"])["source/id"].tolist() == [1, 2]
+    with pytest.raises(FileNotFoundError):
+        load_items_seed(str(tmp_path / "women.parquet"))
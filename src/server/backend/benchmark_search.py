@@ -0,0 +1,141 @@
+"""
+Load-test backend /search and compare deployments, e.g. the microservice
+stack against a backend started with SEARCH_MODE=fused:
+
+    python benchmark_search.py http://localhost:8000 http://localhost:8010 \
+        --requests 500 --concurrency 16
+
+Each request appends its number to one of the queries, so the backend's
+result cache and single-flight never answer it and the run measures the
+search path itself; --repeat-queries sends the fixed queries as they are to
+measure the cache instead. The cache hit and shared-search ratios of the run,
+from the backend's /metrics, are reported next to the latencies.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+DEFAULT_QUERIES = [
+    "black leather boots",
+    "floral summer dress",
+    "men's casual denim jacket",
+    "white running sneakers",
+    "elegant evening gown",
+    "wool winter coat",
+    "linen button-down shirt",
+    "gold hoop earrings",
+]
+
+
+def query_text(queries, i, unique):
+    query = queries[i % len(queries)]
+    return f"{query} {i}" if unique else query
+
+
+async def fetch_counters(client):
+    """Result cache hits/misses and single-flight calls/shared from /metrics (zeros when disabled)."""
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    metrics = response.json()
+    cache = metrics.get("result_cache") or {}
+    single_flight = metrics.get("single_flight") or {}
+    return {
+        "hits": cache.get("hits", 0),
+        "misses": cache.get("misses", 0),
+        "calls": single_flight.get("calls", 0),
+        "shared": single_flight.get("shared", 0),
+    }
+
+
+def ratio(numerator, denominator):
+    return numerator / denominator if denominator else 0.0
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_benchmark(url, queries, total_requests, concurrency, top_k, warmup=10, unique=True):
+    """
+    Send `total_requests` searches with `concurrency` in flight and summarise
+    latencies. With `unique`, no two requests send the same query text (see module docstring).
+    """
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+
+    async with httpx.AsyncClient(base_url=url, timeout=60,
+                                 limits=httpx.Limits(max_connections=concurrency)) as client:
+        for i in range(warmup):
+            await client.post("/search", json={"queryText": f"{query_text(queries, i, unique)} warmup",
+                                               "top_k": top_k})
+        before = await fetch_counters(client)
+
+        async def worker():
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    response = await client.post(
+                        "/search", json={"queryText": query_text(queries, i, unique), "top_k": top_k})
+                    response.raise_for_status()
+                except httpx.HTTPError:
+                    errors += 1
+                    continue
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        after = await fetch_counters(client)
+
+    counts = {key: after[key] - before[key] for key in after}
+    result = {
+        "url": url,
+        "requests": total_requests,
+        "errors": errors,
+        "cache_hit_ratio": ratio(counts["hits"], counts["hits"] + counts["misses"]),
+        "shared_ratio": ratio(counts["shared"], counts["calls"]),
+    }
+    if not latencies:
+        return result
+    return {
+        **result,
+        "throughput_rps": len(latencies) / elapsed,
+        "mean_ms": 1000 * statistics.mean(latencies),
+        "p50_ms": 1000 * percentile(latencies, 50),
+        "p95_ms": 1000 * percentile(latencies, 95),
+        "p99_ms": 1000 * percentile(latencies, 99),
+    }
+
+
+def print_summary(results):
+    columns = ["requests", "errors", "cache_hit_ratio", "shared_ratio", "throughput_rps", "mean_ms", "p50_ms",
+               "p95_ms", "p99_ms"]
+    print(f"{'url':<32}" + "".join(f"{column:>16}" for column in columns))
+    for result in results:
+        cells = [result.get(column, float("nan")) for column in columns]
+        print(f"{result['url']:<32}" + "".join(
+            f"{cell:>16.2f}" if isinstance(cell, float) else f"{cell:>16}" for cell in cells))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark backend /search latency")
+    parser.add_argument("urls", nargs="+", help="Backend base URLs to compare")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--repeat-queries", action="store_true",
+                        help="Send the fixed queries unchanged, so repeats can be served by the result cache")
+    args = parser.parse_args()
+
+    print_summary([
+        asyncio.run(run_benchmark(url, DEFAULT_QUERIES, args.requests, args.concurrency, args.top_k,
+                                  unique=not args.repeat_queries))
+        for url in args.urls
+    ])
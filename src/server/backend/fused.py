@@ -0,0 +1,71 @@
+import asyncio
+import importlib.util
+import os
+import sys
+from contextlib import AsyncExitStack
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_service_module(module_name, service_path):
+    """
+    Import a sibling service's main.py under `module_name`, with the service
+    directory on sys.path so its own helper modules resolve.
+    """
+    if module_name in sys.modules:
+        return sys.modules[module_name]
+    if service_path not in sys.path:
+        sys.path.append(service_path)
+    spec = importlib.util.spec_from_file_location(module_name, os.path.join(service_path, "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class FusedSearchEngine:
+    """
+    Runs the vector service and Pinecone service code inside the backend
+    process, so a query makes no network hops and the vector never goes
+    through JSON. Selected with SEARCH_MODE=fused.
+    """
+
+    def __init__(self, vector_service, pinecone_service):
+        self.vector_service = vector_service
+        self.pinecone_service = pinecone_service
+        self._exit_stack = AsyncExitStack()
+
+    @classmethod
+    def from_env(cls):
+        vector_service_path = os.getenv("VECTOR_SERVICE_PATH", os.path.join(SERVER_DIR, "vector-service"))
+        pinecone_service_path = os.getenv("PINECONE_SERVICE_PATH", os.path.join(SERVER_DIR, "pinecone-service"))
+        return cls(
+            load_service_module("vector_service_main", vector_service_path),
+            load_service_module("pinecone_service_main", pinecone_service_path),
+        )
+
+    async def start(self):
+        """Run both services' startup (cache restore, index resolution) as their own apps would."""
+        for service in (self.vector_service, self.pinecone_service):
+            await self._exit_stack.enter_async_context(service.lifespan(service.app))
+
+    async def close(self):
+        await self._exit_stack.aclose()
+
+    async def encode(self, query_text):
+        return await self.vector_service.embed_text(query_text)
+
+    async def search(self, query_vector, top_k, fields, filters=None):
+        options = self.pinecone_service.SearchOptions(top_k=top_k, fields=fields, **(filters or {}))
+        # Index queries are blocking client calls, so keep them off the event loop
+        index = await asyncio.to_thread(self.pinecone_service.get_index)
+        return await asyncio.to_thread(self.pinecone_service.run_search, query_vector, options, index)
+
+    async def index_version(self):
+        return await asyncio.to_thread(self.pinecone_service.index_version)
+
+    def stats(self):
+        return {
+            "batcher": self.vector_service.batcher.stats(),
+            "embedding_cache": self.vector_service.embedding_cache.stats(),
+        }
@@ -0,0 +1,122 @@
+import importlib.util
+import os
+import time
+
+import httpx
+
+# HTTP/2 is only negotiated when the optional h2 package is installed
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+
+class UpstreamMetrics:
+    """Request counters for a single upstream service."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.total_latency = 0.0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "avg_latency_ms": round(1000 * self.total_latency / self.requests, 3) if self.requests else 0.0,
+        }
+
+
+class UpstreamClientPool:
+    """
+    A single keep-alive httpx.AsyncClient shared by every request to the
+    vector and Pinecone services, with per-upstream timeouts and metrics.
+    """
+
+    def __init__(self, timeouts, max_connections=100, max_keepalive_connections=20,
+                 keepalive_expiry=30.0, connect_timeout=2.0, http2=True, transport=None):
+        self.timeouts = timeouts
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.connect_timeout = connect_timeout
+        self.http2 = http2 and HTTP2_AVAILABLE
+        self.transport = transport
+        self.metrics = {name: UpstreamMetrics() for name in timeouts}
+        self.client = None
+
+    @classmethod
+    def from_env(cls):
+        """Build the pool from HTTP_POOL_* and *_SERVICE_TIMEOUT environment variables."""
+        return cls(
+            timeouts={
+                "vector": float(os.getenv("VECTOR_SERVICE_TIMEOUT", "10")),
+                "pinecone": float(os.getenv("PINECONE_SERVICE_TIMEOUT", "10")),
+            },
+            max_connections=int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100")),
+            max_keepalive_connections=int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20")),
+            keepalive_expiry=float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30")),
+            connect_timeout=float(os.getenv("HTTP_POOL_CONNECT_TIMEOUT", "2")),
+            http2=os.getenv("HTTP_POOL_HTTP2", "true").lower() == "true",
+        )
+
+    async def start(self):
+        if self.client is None:
+            self.client = httpx.AsyncClient(
+                limits=self.limits, http2=self.http2, transport=self.transport)
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    async def post(self, upstream, url, **kwargs):
+        """POST to an upstream using its configured timeout, recording latency and errors."""
+        return await self.request("POST", upstream, url, **kwargs)
+
+    async def get(self, upstream, url, **kwargs):
+        return await self.request("GET", upstream, url, **kwargs)
+
+    async def request(self, method, upstream, url, **kwargs):
+        await self.start()
+        metrics = self.metrics[upstream]
+        metrics.requests += 1
+        metrics.in_flight += 1
+        metrics.peak_in_flight = max(metrics.peak_in_flight, metrics.in_flight)
+        started = time.perf_counter()
+        try:
+            return await self.client.request(
+                method,
+                url,
+                timeout=httpx.Timeout(self.timeouts[upstream], connect=self.connect_timeout),
+                **kwargs,
+            )
+        except httpx.HTTPError:
+            metrics.errors += 1
+            raise
+        finally:
+            metrics.in_flight -= 1
+            metrics.total_latency += time.perf_counter() - started
+
+    def connection_stats(self):
+        """Open/idle connection counts read from the underlying httpcore pool, when available."""
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        connections = list(getattr(pool, "connections", []))
+        idle = sum(1 for conn in connections if conn.is_idle())
+        return {
+            "open": len(connections),
+            "idle": idle,
+            "active": len(connections) - idle,
+            "max_connections": self.limits.max_connections,
+            "max_keepalive_connections": self.limits.max_keepalive_connections,
+        }
+
+    def stats(self):
+        return {
+            "http2": self.http2,
+            "connections": self.connection_stats(),
+            "upstreams": {name: metrics.as_dict() for name, metrics in self.metrics.items()},
+        }
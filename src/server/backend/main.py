@@ -1,10 +1,43 @@
 import httpx
+import orjson
 import os
-from fastapi import FastAPI, HTTPException
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from typing import List, Optional
+from http_pool import UpstreamClientPool
+from fused import FusedSearchEngine
+from result_cache import ResultCache, search_key
+from single_flight import SingleFlight
 
-app = FastAPI()
+# "microservice" (default) calls the vector and Pinecone services over HTTP;
+# "fused" runs their code in this process (see fused.py)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "microservice")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared upstream connection pool (or the fused engine) and the result cache for the lifetime of the app."""
+    app.state.upstream_pool = UpstreamClientPool.from_env()
+    app.state.result_cache = ResultCache.from_env()
+    app.state.single_flight = SingleFlight.from_env()
+    if SEARCH_MODE == "fused":
+        app.state.fused_engine = FusedSearchEngine.from_env()
+        await app.state.fused_engine.start()
+    else:
+        await app.state.upstream_pool.start()
+    yield
+    await app.state.upstream_pool.close()
+    if SEARCH_MODE == "fused":
+        await app.state.fused_engine.close()
+    if app.state.result_cache is not None:
+        await app.state.result_cache.close()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Enable CORS
 app.add_middleware(
@@ -21,76 +54,181 @@ APP_HOST = os.getenv("APP_HOST")
 PINECONE_SERVICE_HOST = os.getenv("PINECONE_SERVICE_HOST", "localhost")
 VECTOR_SERVICE_HOST = os.getenv("VECTOR_SERVICE_HOST", "localhost")
 
+# The only metadata fields the search results use; everything else is left out of the Pinecone service response
+RESULT_METADATA_FIELDS = [
+    "image_name", "brand", "gender", "item_type", "item_sub_type", "item_url", "image_url", "caption",
+]
+
+
+# Metadata fields searches can be filtered on; the filters are applied by the index itself
+FILTER_FIELDS = ("gender", "item_type", "item_sub_type", "brand")
+
+
+# Query vectors travel between the services as raw float32 bytes instead of JSON lists
+VECTOR_MEDIA_TYPE = "application/octet-stream"
+
+
 class SearchQuery(BaseModel):
     queryText: str
     top_k: int = 5
+    # Only return items whose field holds one of the listed values
+    gender: Optional[List[str]] = None
+    item_type: Optional[List[str]] = None
+    item_sub_type: Optional[List[str]] = None
+    brand: Optional[List[str]] = None
+
+    def filters(self):
+        return {field: getattr(self, field) for field in FILTER_FIELDS if getattr(self, field)}
+
+
+class RemoteSearchEngine:
+    """Runs the search pipeline over HTTP against the vector and Pinecone services."""
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    async def encode(self, query_text):
+        # Call the vector service to convert text into a vector, as raw little-endian float32 bytes
+        vector_service_url = f"http://{VECTOR_SERVICE_HOST}:8001/get_vector"
+        response = await self.pool.post(
+            "vector", vector_service_url, json={"text": query_text},
+            headers={"Accept": VECTOR_MEDIA_TYPE},
+        )
+        response.raise_for_status()
+        return response.content
+
+    async def search(self, query_vector, top_k, fields, filters=None):
+        # Call the Pinecone service for retrieving search results; the vector bytes are forwarded as-is,
+        # and each filter value becomes a repeated query parameter (?gender=women&gender=unisex)
+        pinecone_service_url = f"http://{PINECONE_SERVICE_HOST}:8002/search"
+        pinecone_response = await self.pool.post(
+            "pinecone",
+            pinecone_service_url,
+            content=query_vector,
+            params={
+                "top_k": top_k,
+                "include_values": "false",
+                "fields": ",".join(fields),
+                "dtype": "float32",
+                **(filters or {}),
+            },
+            headers={"Content-Type": VECTOR_MEDIA_TYPE},
+        )
+        pinecone_response.raise_for_status()
+        return orjson.loads(pinecone_response.content)
+
+    async def index_version(self):
+        response = await self.pool.get("pinecone", f"http://{PINECONE_SERVICE_HOST}:8002/index_version")
+        response.raise_for_status()
+        return orjson.loads(response.content)["version"]
+
+
+def get_upstream_pool(request: Request):
+    """Return the shared connection pool, creating it if the app lifespan has not run."""
+    if not hasattr(request.app.state, "upstream_pool"):
+        request.app.state.upstream_pool = UpstreamClientPool.from_env()
+    return request.app.state.upstream_pool
+
+
+def get_result_cache(request: Request):
+    """Return the shared result cache (None when RESULT_CACHE_BACKEND=off), creating it if the app lifespan has not run."""
+    if not hasattr(request.app.state, "result_cache"):
+        request.app.state.result_cache = ResultCache.from_env()
+    return request.app.state.result_cache
+
+
+def get_single_flight(request: Request):
+    """Return the shared in-flight search registry (None when SEARCH_SINGLE_FLIGHT=false)."""
+    if not hasattr(request.app.state, "single_flight"):
+        request.app.state.single_flight = SingleFlight.from_env()
+    return request.app.state.single_flight
+
+
+def get_search_engine(request: Request, pool=Depends(get_upstream_pool)):
+    """Return the in-process engine in fused mode, otherwise the HTTP engine over the shared pool."""
+    if SEARCH_MODE == "fused":
+        return request.app.state.fused_engine
+    return RemoteSearchEngine(pool)
+
+
+async def search_items(engine, query):
+    """Run the search pipeline and build the result items."""
+    query_vector = await engine.encode(query.queryText)
+    if not query_vector:
+        raise ValueError("No vector returned from vector service.")
+
+    # Retrieve the search results and build the items
+    search_results = await engine.search(query_vector, query.top_k, RESULT_METADATA_FIELDS, query.filters())
+    return [
+        {
+            "item_name": result["metadata"].get("image_name", "Unknown Name"),
+            "item_brand": result["metadata"].get("brand", "Unknown Name"),
+            "item_gender": result["metadata"].get("gender", "Unknown Name"),
+            "item_type": result["metadata"].get("item_type", "Unknown Name"),
+            "item_sub_type": result["metadata"].get("item_sub_type", "Unknown Name"),
+            "item_url": result["metadata"].get("item_url", "Unknown URL"),
+            "image_url": result["metadata"].get("image_url", "Unknown URL"),
+            "item_caption": result["metadata"].get("caption", "No caption available"),
+            "rank": result.get("rank", "N/A"),
+            "score": result.get("score", "N/A"),
+        }
+        for result in search_results if "metadata" in result
+    ]
+
 
 @app.post("/search")
-async def search(query: SearchQuery):
+async def search(query: SearchQuery, engine=Depends(get_search_engine), cache=Depends(get_result_cache),
+                 single_flight=Depends(get_single_flight)):
     """
     Handles search requests. 
-    Communicates with a vector service to retrieve query vectors and
-    with a Pinecone service for retrieving the top-k search results.
+    Retrieves the query vector from the vector service and the top-k
+    search results from the Pinecone service, over HTTP or in-process
+    depending on SEARCH_MODE. Metadata filters (gender, item_type,
+    item_sub_type, brand) are applied by the index, not on the results.
+    Results are cached per normalized query, top_k, filters and index version,
+    and concurrent identical searches share one upstream computation.
     """
     query_text = query.queryText
-    top_k = query.top_k
-
-    async with httpx.AsyncClient() as client:
-        try:
-            # Call the vector service to convert text into a vector
-            vector_service_url = f"http://{VECTOR_SERVICE_HOST}:8001/get_vector"
-            response = await client.post(vector_service_url, json={"text": query_text}, timeout=10)
-            response.raise_for_status()
-
-            # Parse the vector from the response
-            query_vector = response.json().get("vector")
-            if not query_vector:
-                raise ValueError("No vector returned from vector service.")
-
-            # Call the Pinecone service for retrieving search results
-            pinecone_service_url = f"http://{PINECONE_SERVICE_HOST}:8002/search"
-            pinecone_response = await client.post(
-                pinecone_service_url,
-                json={"vector": query_vector, "top_k": top_k},
-                timeout=10
-            )
-            pinecone_response.raise_for_status()
-
-            # Parse the search results
-            search_results = pinecone_response.json()
-            items = [
-                {
-                    "item_name": result["metadata"].get("image_name", "Unknown Name"),
-                    "item_brand": result["metadata"].get("brand", "Unknown Name"),
-                    "item_gender": result["metadata"].get("gender", "Unknown Name"),
-                    "item_type": result["metadata"].get("item_type", "Unknown Name"),
-                    "item_sub_type": result["metadata"].get("item_sub_type", "Unknown Name"),
-                    "item_url": result["metadata"].get("item_url", "Unknown URL"),
-                    "image_url": result["metadata"].get("image_url", "Unknown URL"),
-                    "item_caption": result["metadata"].get("caption", "No caption available"),
-                    "rank": result.get("rank", "N/A"),
-                    "score": result.get("score", "N/A"),
-                }
-                for result in search_results if "metadata" in result
-            ]
-
-            return {"description": f"Search results for '{query_text}'", "items": items}
-
-        except httpx.RequestError as req_exc:
-            raise HTTPException(
-                status_code=500, detail=f"Request error: {req_exc}")
-
-        except ValueError as val_exc:
-            raise HTTPException(
-                status_code=501, detail=f"Value error: {val_exc}")
-
-        except KeyError as key_exc:
-            raise HTTPException(
-                status_code=502, detail=f"Key error: {key_exc}")
-
-        except Exception as e:
-            raise HTTPException(
-                status_code=503, detail=f"Unexpected error: {e}")
+
+    try:
+        started = time.perf_counter()
+        index_version = cache_key = None
+        if cache is not None:
+            index_version = await cache.index_version(engine.index_version)
+            cache_key = cache.key(query_text, query.top_k, query.filters(), index_version)
+            items = await cache.get(cache_key)
+            if items is not None:
+                return {"description": f"Search results for '{query_text}'", "items": items}
+
+        async def compute():
+            items = await search_items(engine, query)
+            if cache is not None:
+                await cache.put(cache_key, items, time.perf_counter() - started)
+            return items
+
+        if single_flight is None:
+            items = await compute()
+        else:
+            flight_key = search_key(query_text, query.top_k, query.filters(), index_version)
+            items = await single_flight.do(flight_key, compute)
+
+        return {"description": f"Search results for '{query_text}'", "items": items}
+
+    except httpx.RequestError as req_exc:
+        raise HTTPException(
+            status_code=500, detail=f"Request error: {req_exc}")
+
+    except ValueError as val_exc:
+        raise HTTPException(
+            status_code=501, detail=f"Value error: {val_exc}")
+
+    except KeyError as key_exc:
+        raise HTTPException(
+            status_code=502, detail=f"Key error: {key_exc}")
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=503, detail=f"Unexpected error: {e}")
 
 
 @app.get("/health")
@@ -99,6 +237,24 @@ async def health():
     return {"status": "ok", "message": "Backend service is running"}
 
 
+@app.get("/metrics")
+async def metrics(request: Request, pool=Depends(get_upstream_pool), cache=Depends(get_result_cache),
+                  single_flight=Depends(get_single_flight)):
+    """
+    Connection pool utilisation, per-upstream request metrics, result cache
+    hit ratio and latency, and how many searches shared an in-flight one.
+    """
+    stats = {
+        "search_mode": SEARCH_MODE,
+        "upstream_pool": pool.stats(),
+        "result_cache": cache.stats() if cache is not None else None,
+        "single_flight": single_flight.stats() if single_flight is not None else None,
+    }
+    if SEARCH_MODE == "fused":
+        stats["fused_engine"] = request.app.state.fused_engine.stats()
+    return stats
+
+
 # Add this block to run the app with Uvicorn
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,173 @@
+import os
+import re
+import time
+from collections import OrderedDict
+
+import orjson
+
+
+def normalize_query(text):
+    """Lowercase and collapse whitespace, as the vector service does before embedding."""
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def search_key(query_text, top_k, filters, index_version=None):
+    """Identity of a search: queries differing only in case, spacing or filter order are the same."""
+    filters = {field: sorted(values) for field, values in sorted((filters or {}).items())}
+    return orjson.dumps([normalize_query(query_text), top_k, filters, index_version]).decode("utf-8")
+
+
+class InMemoryResultStore:
+    """
+    Bounded LRU store with per-entry expiry, implementing the subset of the
+    redis.asyncio client that ResultCache uses (get, set with `ex`, delete),
+    so it stands in for Redis when none is configured.
+    """
+
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at or None, value)
+        self.evictions = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at is not None and self.clock() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ex=None):
+        self._entries[key] = (self.clock() + ex if ex else None, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys):
+        return sum(self._entries.pop(key, None) is not None for key in keys)
+
+    async def aclose(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class ResultCache:
+    """
+    Cache of /search results keyed on (normalized query, top_k, filters, index
+    version), stored in an InMemoryResultStore or a Redis server.
+
+    The index version is part of the key, so results computed against an
+    older index are never served once the index is rebuilt; they age out of
+    the store. The version is re-read from the search engine at most every
+    `version_refresh_seconds`. Entries also expire after `ttl_seconds`.
+    """
+
+    def __init__(self, store, ttl_seconds=300, version_refresh_seconds=30, key_prefix="search:",
+                 clock=time.monotonic):
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.version_refresh_seconds = version_refresh_seconds
+        self.key_prefix = key_prefix
+        self.clock = clock
+        self.version = None
+        self._version_checked_at = None
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.hit_latency = 0.0
+        self.miss_latency = 0.0
+
+    @classmethod
+    def from_env(cls):
+        """
+        RESULT_CACHE_BACKEND "memory" (default), "redis" (REDIS_URL, needs the
+        redis package) or "off", which returns None.
+        """
+        backend = os.getenv("RESULT_CACHE_BACKEND", "memory")
+        if backend == "off":
+            return None
+        if backend == "redis":
+            import redis.asyncio as redis
+            store = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        elif backend == "memory":
+            store = InMemoryResultStore(max_entries=int(os.getenv("RESULT_CACHE_SIZE", "10000")))
+        else:
+            raise ValueError(f"Unknown RESULT_CACHE_BACKEND: {backend}")
+        return cls(
+            store,
+            ttl_seconds=float(os.getenv("RESULT_CACHE_TTL_SECONDS", "300")),
+            version_refresh_seconds=float(os.getenv("RESULT_CACHE_VERSION_REFRESH_SECONDS", "30")),
+        )
+
+    async def close(self):
+        await self.store.aclose()
+
+    async def index_version(self, fetch_version):
+        """
+        The current index version, re-read with `fetch_version()` once it is
+        older than version_refresh_seconds. A failed read keeps the last version.
+        """
+        now = self.clock()
+        if self._version_checked_at is None or now - self._version_checked_at >= self.version_refresh_seconds:
+            # Set first so concurrent requests do not all refresh at once
+            self._version_checked_at = now
+            try:
+                self.version = await fetch_version()
+            except Exception as e:
+                self.errors += 1
+                print(f"Could not read the index version, keeping {self.version}: {e}")
+        return self.version
+
+    def key(self, query_text, top_k, filters, index_version):
+        return self.key_prefix + search_key(query_text, top_k, filters, index_version)
+
+    async def get(self, key):
+        """Return the cached items, or None on a miss. Store errors count as misses."""
+        started = time.perf_counter()
+        try:
+            value = await self.store.get(key)
+        except Exception as e:
+            self.errors += 1
+            print(f"Result cache read failed: {e}")
+            value = None
+        if value is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.hit_latency += time.perf_counter() - started
+        return orjson.loads(value)
+
+    async def put(self, key, items, elapsed):
+        """Store the items of a miss, recording the `elapsed` seconds it took to compute them."""
+        self.miss_latency += elapsed
+        try:
+            # Redis expiries are whole seconds
+            await self.store.set(key, orjson.dumps(items), ex=max(1, int(self.ttl_seconds)))
+        except Exception as e:
+            self.errors += 1
+            print(f"Result cache write failed: {e}")
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            "backend": type(self.store).__name__,
+            "ttl_seconds": self.ttl_seconds,
+            "index_version": self.version,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "avg_hit_latency_ms": round(1000 * self.hit_latency / self.hits, 3) if self.hits else 0.0,
+            "avg_miss_latency_ms": round(1000 * self.miss_latency / self.misses, 3) if self.misses else 0.0,
+        }
+        if isinstance(self.store, InMemoryResultStore):
+            stats.update({"entries": len(self.store), "max_entries": self.store.max_entries,
+                          "evictions": self.store.evictions})
+        return stats
@@ -0,0 +1,61 @@
+import asyncio
+import os
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls with the same key: the first caller starts
+    the computation and every caller that arrives while it is in flight awaits
+    the same result (or exception) instead of starting its own.
+
+    The computation runs as its own task, so a caller that is cancelled (e.g.
+    the client disconnected) does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+        self.peak_waiters = 0
+        self._waiters = {}
+
+    @classmethod
+    def from_env(cls):
+        """None when SEARCH_SINGLE_FLIGHT=false."""
+        if os.getenv("SEARCH_SINGLE_FLIGHT", "true").lower() != "true":
+            return None
+        return cls()
+
+    async def do(self, key, compute):
+        """Return the result of `compute()`, shared with concurrent callers using the same `key`."""
+        self.calls += 1
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(compute())
+            self._calls[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.shared += 1
+        self._waiters[key] += 1
+        self.peak_waiters = max(self.peak_waiters, self._waiters[key])
+        return await asyncio.shield(task)
+
+    def _finish(self, key, task):
+        del self._calls[key]
+        del self._waiters[key]
+        # Retrieve the exception so it is not reported as unhandled when every caller was cancelled
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self):
+        return len(self._calls)
+
+    def stats(self):
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "shared_ratio": round(self.shared / self.calls, 4) if self.calls else 0.0,
+            "in_flight": self.in_flight(),
+            "peak_waiters": self.peak_waiters,
+        }
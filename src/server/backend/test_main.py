@@ -1,80 +1,90 @@
+import asyncio
+import struct
+import httpx
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import patch, AsyncMock
-from main import app, SearchQuery
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+import main
+from main import app, get_search_engine, get_upstream_pool
+from http_pool import UpstreamClientPool
+from fused import FusedSearchEngine
+from result_cache import InMemoryResultStore, ResultCache
+from single_flight import SingleFlight
 
 client = TestClient(app)
 
+PINECONE_RESULTS = [
+    {
+        "metadata": {
+            "image_name": "Test Item",
+            "brand": "Test Brand",
+            "gender": "Unisex",
+            "item_type": "Shirt",
+            "item_sub_type": "Casual",
+            "item_url": "https://example.com/item",
+            "image_url": "https://example.com/image.jpg",
+            "caption": "A stylish shirt"
+        },
+        "rank": 1,
+        "score": 0.95
+    }
+]
+
+
+def make_response(status_code, json_body):
+    return httpx.Response(status_code, json=json_body, request=httpx.Request("POST", "http://test"))
+
+
+def make_vector_response(values):
+    """Vector service reply in the binary (little-endian float32) encoding the backend requests."""
+    return httpx.Response(200, content=struct.pack(f"<{len(values)}f", *values),
+                          headers={"Content-Type": "application/octet-stream"},
+                          request=httpx.Request("POST", "http://test"))
+
+
+def make_version_response(version):
+    return httpx.Response(200, json={"version": version}, request=httpx.Request("GET", "http://test"))
 
-@pytest.fixture
-def mock_vector_service():
-    with patch("httpx.AsyncClient.post") as mock_post:
-        mock_post.side_effect = lambda url, **kwargs: (
-            AsyncMock(return_value=AsyncMock(
-                status_code=200,
-                json=AsyncMock(return_value={"vector": [0.1, 0.2, 0.3]}),
-            ))
-            if "get_vector" in url
-            else None
-        )
-        yield mock_post
+
+class MockPool:
+    def __init__(self):
+        self.post = AsyncMock()
+        self.get = AsyncMock(return_value=make_version_response("v1"))
+
+    def stats(self):
+        return {"upstreams": {}}
+
+
+@pytest.fixture(autouse=True)
+def result_cache(monkeypatch):
+    """Give every test an empty result cache."""
+    cache = ResultCache(InMemoryResultStore(max_entries=100))
+    monkeypatch.setattr(app.state, "result_cache", cache, raising=False)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def single_flight(monkeypatch):
+    flights = SingleFlight()
+    monkeypatch.setattr(app.state, "single_flight", flights, raising=False)
+    return flights
 
 
 @pytest.fixture
-def mock_pinecone_service():
-    with patch("httpx.AsyncClient.post") as mock_post:
-        mock_post.side_effect = lambda url, **kwargs: (
-            AsyncMock(return_value=AsyncMock(
-                status_code=200,
-                json=AsyncMock(return_value=[
-                    {
-                        "metadata": {
-                            "image_name": "Test Item",
-                            "brand": "Test Brand",
-                            "gender": "Unisex",
-                            "item_type": "Shirt",
-                            "item_sub_type": "Casual",
-                            "item_url": "https://example.com/item",
-                            "image_url": "https://example.com/image.jpg",
-                            "caption": "A stylish shirt"
-                        },
-                        "rank": 1,
-                        "score": 0.95
-                    }
-                ]),
-            ))
-            if "search" in url
-            else None
-        )
-        yield mock_post
-
-
-def test_search_success(mock_vector_service, mock_pinecone_service):
+def mock_pool():
+    pool = MockPool()
+    app.dependency_overrides[get_upstream_pool] = lambda: pool
+    yield pool
+    app.dependency_overrides.clear()
+
+
+def test_search_success(mock_pool):
     """Test successful search endpoint with mocked services."""
-    # Mock vector service response
-    vector_response = {"vector": [0.1, 0.2, 0.3]}
-    mock_vector_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=200, json=AsyncMock(return_value=vector_response)))]
-    print(mock_vector_service.side_effect)
-    # Mock Pinecone service response
-    pinecone_response = [
-        {
-            "metadata": {
-                "image_name": "Test Item",
-                "brand": "Test Brand",
-                "gender": "Unisex",
-                "item_type": "Shirt",
-                "item_sub_type": "Casual",
-                "item_url": "https://example.com/item",
-                "image_url": "https://example.com/image.jpg",
-                "caption": "A stylish shirt"
-            },
-            "rank": 1,
-            "score": 0.95
-        }
+    mock_pool.post.side_effect = [
+        make_vector_response([0.1, 0.2, 0.3]),
+        make_response(200, PINECONE_RESULTS),
     ]
-    mock_pinecone_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=200, json=AsyncMock(return_value=pinecone_response)))]
 
     # Request payload
     query = {
@@ -94,11 +104,45 @@ def test_search_success(mock_vector_service, mock_pinecone_service):
     assert data["items"][0]["item_brand"] == "Test Brand"
     assert data["items"][0]["item_url"] == "https://example.com/item"
 
+    # Both upstream calls go through the shared pool
+    upstreams = [call.args[0] for call in mock_pool.post.call_args_list]
+    assert upstreams == ["vector", "pinecone"]
+
+    # The vector is requested as raw float32 bytes and forwarded to the Pinecone service unchanged
+    vector_call, pinecone_call = mock_pool.post.call_args_list
+    assert vector_call.kwargs["headers"]["Accept"] == "application/octet-stream"
+    assert pinecone_call.kwargs["content"] == struct.pack("<3f", 0.1, 0.2, 0.3)
+    assert pinecone_call.kwargs["headers"]["Content-Type"] == "application/octet-stream"
+
+    # Only the metadata fields used above are requested, without vector values
+    params = pinecone_call.kwargs["params"]
+    assert params["top_k"] == 3
+    assert params["include_values"] == "false"
+    assert set(params["fields"].split(",")) == {
+        "image_name", "brand", "gender", "item_type", "item_sub_type", "item_url", "image_url", "caption"}
+
+
+def test_search_filters_forwarded(mock_pool):
+    """Test metadata filters are sent to the Pinecone service rather than applied to the results."""
+    mock_pool.post.side_effect = [
+        make_vector_response([0.1, 0.2, 0.3]),
+        make_response(200, PINECONE_RESULTS),
+    ]
+
+    query = {"queryText": "Find a casual shirt", "top_k": 3, "gender": ["women"], "brand": ["Test Brand", "Other"]}
+    response = client.post("/search", json=query)
+
+    assert response.status_code == 200
+    params = mock_pool.post.call_args_list[1].kwargs["params"]
+    assert params["gender"] == ["women"]
+    assert params["brand"] == ["Test Brand", "Other"]
+    assert "item_type" not in params
+    assert params["top_k"] == 3
+
 
-def test_search_vector_service_error(mock_vector_service):
+def test_search_vector_service_error(mock_pool):
     """Test vector service failure."""
-    mock_vector_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=500, text="Internal Server Error"))]
+    mock_pool.post.side_effect = httpx.ConnectError("Connection refused")
 
     query = {
         "queryText": "Find a casual shirt",
@@ -111,11 +155,9 @@ def test_search_vector_service_error(mock_vector_service):
     assert "Request error" in response.json()["detail"]
 
 
-def test_search_no_vector(mock_vector_service):
+def test_search_no_vector(mock_pool):
     """Test vector service returning no vector."""
-    vector_response = {"vector": None}
-    mock_vector_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=200, json=AsyncMock(return_value=vector_response)))]
+    mock_pool.post.side_effect = [make_vector_response([])]
 
     query = {
         "queryText": "Find a casual shirt",
@@ -128,14 +170,12 @@ def test_search_no_vector(mock_vector_service):
     assert "No vector returned from vector service" in response.json()["detail"]
 
 
-def test_search_pinecone_service_error(mock_vector_service, mock_pinecone_service):
+def test_search_pinecone_service_error(mock_pool):
     """Test Pinecone service failure."""
-    vector_response = {"vector": [0.1, 0.2, 0.3]}
-    mock_vector_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=200, json=AsyncMock(return_value=vector_response)))]
-
-    mock_pinecone_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=500, text="Internal Server Error"))]
+    mock_pool.post.side_effect = [
+        make_vector_response([0.1, 0.2, 0.3]),
+        httpx.ReadTimeout("Timed out"),
+    ]
 
     query = {
         "queryText": "Find a casual shirt",
@@ -161,14 +201,12 @@ def test_search_invalid_payload():
     assert "detail" in response.json()
 
 
-def test_search_empty_results(mock_vector_service, mock_pinecone_service):
+def test_search_empty_results(mock_pool):
     """Test empty results from Pinecone service."""
-    vector_response = {"vector": [0.1, 0.2, 0.3]}
-    mock_vector_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=200, json=AsyncMock(return_value=vector_response)))]
-
-    mock_pinecone_service.side_effect = [AsyncMock(return_value=AsyncMock(
-        status_code=200, json=AsyncMock(return_value=[])))]
+    mock_pool.post.side_effect = [
+        make_vector_response([0.1, 0.2, 0.3]),
+        make_response(200, []),
+    ]
 
     query = {
         "queryText": "Find a casual shirt",
@@ -180,3 +218,229 @@ def test_search_empty_results(mock_vector_service, mock_pinecone_service):
     assert response.status_code == 200
     data = response.json()
     assert len(data["items"]) == 0
+
+
+def test_lifespan_creates_shared_pool():
+    """Test the app lifespan opens one pool and exposes its metrics."""
+    with TestClient(app) as lifespan_client:
+        pool = app.state.upstream_pool
+        assert isinstance(pool, UpstreamClientPool)
+        assert pool.client is not None
+
+        response = lifespan_client.get("/metrics")
+        assert response.status_code == 200
+        assert set(response.json()["upstream_pool"]["upstreams"]) == {"vector", "pinecone"}
+    assert pool.client is None
+
+
+def test_upstream_pool_reuses_client_and_records_metrics():
+    """Test the pool reuses one client across requests and counts them per upstream."""
+    def handler(request):
+        if request.url.path == "/fail":
+            raise httpx.ConnectError("Connection refused", request=request)
+        return httpx.Response(200, json={"ok": True})
+
+    pool = UpstreamClientPool(
+        timeouts={"vector": 1.0, "pinecone": 2.0}, transport=httpx.MockTransport(handler))
+
+    async def run():
+        await pool.start()
+        client_before = pool.client
+        await pool.post("vector", "http://vector/get_vector", json={"text": "a"})
+        await pool.post("vector", "http://vector/get_vector", json={"text": "b"})
+        with pytest.raises(httpx.ConnectError):
+            await pool.post("pinecone", "http://pinecone/fail", json={})
+        assert pool.client is client_before
+        await pool.close()
+
+    asyncio.run(run())
+
+    stats = pool.stats()["upstreams"]
+    assert stats["vector"]["requests"] == 2
+    assert stats["vector"]["errors"] == 0
+    assert stats["vector"]["in_flight"] == 0
+    assert stats["pinecone"]["errors"] == 1
+
+
+def test_search_fused_mode(monkeypatch):
+    """Test fused mode calls the services' code in-process instead of over HTTP."""
+    async def embed_text(text):
+        return [0.1, 0.2, 0.3]
+
+    searches = []
+
+    def run_search(query_vector, options, index):
+        searches.append((query_vector, options, index))
+        return PINECONE_RESULTS
+
+    vector_service = SimpleNamespace(embed_text=embed_text)
+    pinecone_service = SimpleNamespace(
+        SearchOptions=lambda **kwargs: SimpleNamespace(**kwargs),
+        get_index=lambda: "index",
+        run_search=run_search,
+        index_version=lambda: "v1",
+    )
+    monkeypatch.setattr(main, "SEARCH_MODE", "fused")
+    monkeypatch.setattr(app.state, "fused_engine", FusedSearchEngine(vector_service, pinecone_service), raising=False)
+    pool = MockPool()
+    app.dependency_overrides[get_upstream_pool] = lambda: pool
+
+    try:
+        response = client.post("/search", json={"queryText": "Find a casual shirt", "top_k": 3})
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json()["items"][0]["item_name"] == "Test Item"
+    query_vector, options, index = searches[0]
+    assert query_vector == [0.1, 0.2, 0.3]
+    assert options.top_k == 3
+    assert not hasattr(options, "gender")
+    assert index == "index"
+    pool.post.assert_not_called()
+
+
+def test_search_result_cache(mock_pool, result_cache):
+    """Test repeated queries are served from the cache until the index version changes."""
+    mock_pool.post.side_effect = [
+        make_vector_response([0.1, 0.2, 0.3]),
+        make_response(200, PINECONE_RESULTS),
+    ] * 3
+
+    first = client.post("/search", json={"queryText": "Find a casual shirt", "top_k": 3})
+    # Case and whitespace are normalized away, as they are for the query embedding
+    second = client.post("/search", json={"queryText": "  find a CASUAL   shirt", "top_k": 3})
+    assert first.status_code == second.status_code == 200
+    assert second.json()["items"] == first.json()["items"]
+    assert second.json()["description"] == "Search results for '  find a CASUAL   shirt'"
+    assert mock_pool.post.call_count == 2
+
+    # A different top_k or filter is a different result set
+    client.post("/search", json={"queryText": "Find a casual shirt", "top_k": 3, "gender": ["women"]})
+    assert mock_pool.post.call_count == 4
+
+    # A rebuilt index changes the version, so the cached results are no longer used
+    result_cache.version_refresh_seconds = 0
+    mock_pool.get.return_value = make_version_response("v2")
+    client.post("/search", json={"queryText": "Find a casual shirt", "top_k": 3})
+    assert mock_pool.post.call_count == 6
+    assert mock_pool.get.call_args.args == ("pinecone", "http://localhost:8002/index_version")
+
+    stats = client.get("/metrics").json()["result_cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 3
+    assert stats["hit_ratio"] == 0.25
+    assert stats["index_version"] == "v2"
+    assert stats["entries"] == 3
+
+
+def test_result_cache_survives_version_errors(mock_pool, result_cache):
+    """Test the cache keeps the last known index version when it cannot be read."""
+    mock_pool.post.side_effect = [make_vector_response([0.1, 0.2, 0.3]), make_response(200, PINECONE_RESULTS)]
+    mock_pool.get.side_effect = httpx.ConnectError("Connection refused")
+
+    for _ in range(2):
+        response = client.post("/search", json={"queryText": "Find a casual shirt", "top_k": 3})
+        assert response.status_code == 200
+    assert mock_pool.post.call_count == 2
+    assert result_cache.errors == 1
+    assert result_cache.version is None
+
+
+def test_in_memory_result_store_expiry_and_eviction():
+    """Test the in-memory store expires entries and evicts the least recently used one."""
+    now = [0.0]
+    store = InMemoryResultStore(max_entries=2, clock=lambda: now[0])
+
+    async def run():
+        await store.set("a", b"1", ex=10)
+        await store.set("b", b"2")
+        assert await store.get("a") == b"1"
+        await store.set("c", b"3")
+        assert await store.get("b") is None
+        assert store.evictions == 1
+        now[0] = 11.0
+        assert await store.get("a") is None
+        assert await store.get("c") == b"3"
+        assert await store.delete("c", "missing") == 1
+
+    asyncio.run(run())
+
+
+class SlowEngine:
+    """Search engine whose upstream calls block until `release` is set."""
+
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.encodes = 0
+
+    async def encode(self, query_text):
+        self.encodes += 1
+        await self.release.wait()
+        return b"vector"
+
+    async def search(self, query_vector, top_k, fields, filters=None):
+        return PINECONE_RESULTS
+
+    async def index_version(self):
+        return "v1"
+
+
+def test_concurrent_identical_searches_share_one_computation(single_flight):
+    """Test concurrent identical searches make one set of upstream calls and all get the results."""
+    engine = SlowEngine()
+    app.dependency_overrides[get_search_engine] = lambda: engine
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as async_client:
+            requests = [
+                async_client.post("/search", json={"queryText": text, "top_k": 3})
+                for text in ["Find a casual shirt"] * 4 + ["FIND a casual shirt", "Another query"]
+            ]
+            tasks = [asyncio.ensure_future(request) for request in requests]
+            while single_flight.calls < len(tasks):
+                await asyncio.sleep(0.01)
+            engine.release.set()
+            return await asyncio.gather(*tasks)
+
+    try:
+        responses = asyncio.run(run())
+    finally:
+        app.dependency_overrides.clear()
+
+    assert all(response.status_code == 200 for response in responses)
+    assert all(response.json()["items"][0]["item_name"] == "Test Item" for response in responses)
+    assert engine.encodes == 2
+    assert single_flight.stats()["shared"] == 4
+    assert single_flight.in_flight() == 0
+
+
+def test_single_flight_shares_errors_and_survives_cancellation():
+    """Test waiters share a failure, and cancelling the first caller does not cancel the computation."""
+    flights = SingleFlight()
+
+    async def run():
+        release = asyncio.Event()
+        runs = []
+
+        async def compute(value):
+            runs.append(value)
+            await release.wait()
+            if value == "fail":
+                raise ValueError("upstream failed")
+            return value
+
+        leader = asyncio.ensure_future(flights.do("key", lambda: compute("ok")))
+        follower = asyncio.ensure_future(flights.do("key", lambda: compute("ok")))
+        failing = [asyncio.ensure_future(flights.do("bad", lambda: compute("fail"))) for _ in range(2)]
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        assert await follower == "ok"
+        results = await asyncio.gather(*failing, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert runs == ["ok", "fail"]
+
+    asyncio.run(run())
+    assert flights.in_flight() == 0
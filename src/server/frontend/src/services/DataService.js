@@ -14,11 +14,13 @@ const DataService = {
         // Any application initialization logic comes here
     },
     // Function to fetch fashion recommendations from API
-    GetFashionItems: async function (queryText = "trending fashion items") {
+    // `filters` optionally restricts results by metadata, e.g. { gender: ["women"], item_type: ["dress"] }
+    GetFashionItems: async function (queryText = "trending fashion items", filters = {}) {
         try {
             const response = await api.post('/search', {
                 queryText,
-                top_k: 6  // Default number of recommendations
+                top_k: 6,  // Default number of recommendations
+                ...filters
             });
             
             return {
@@ -0,0 +1,492 @@
+"""
+In-process vector index that can stand in for Pinecone.
+
+An index directory holds the same vectors and metadata that
+vectorized_db_init upserts to Pinecone:
+
+    vectors.npy      float32 (or float16) matrix, one row per item (memory-mapped at load)
+    ids.npy          item ids, aligned with the rows of vectors.npy
+    metadata.jsonl   one JSON metadata object per line, aligned with ids.npy
+    norms.npy        optional precomputed row norms
+    ivf.npz          optional inverted-file lists for approximate search
+    quantizer.npz    optional quantizer and codes.npy (see quantization.py)
+    filters/         optional packed bitmaps of the filterable metadata fields
+
+Both index types score with cosine similarity, like the Pinecone index
+created in vectorized_db_init, and answer `query()` with the same
+{"matches": [...]} shape as the Pinecone client. `query()` also takes the
+Pinecone metadata `filter` ($eq/$in on FILTER_FIELDS), resolved to a row mask
+from per-value bitmaps so only matching rows are scored.
+"""
+import argparse
+import json
+import os
+import threading
+
+import numpy as np
+
+from quantization import (
+    CODES_FILE,
+    QUANTIZER_FILE,
+    chunked_scores,
+    format_recall_report,
+    load_quantizer,
+    make_quantizer,
+    recall_report,
+    write_codes,
+)
+from vector_math import EPSILON, normalize_rows, top_k_indices
+
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+METADATA_FILE = "metadata.jsonl"
+NORMS_FILE = "norms.npy"
+IVF_FILE = "ivf.npz"
+FILTERS_DIR = "filters"
+# Export roots written by vectorized_db_init name their current version here
+LATEST_FILE = "LATEST"
+
+# Metadata fields that searches can filter on
+FILTER_FIELDS = ("gender", "item_type", "item_sub_type", "brand")
+
+
+def filter_values(field, condition):
+    """Values a Pinecone filter condition accepts: "v", {"$eq": "v"} or {"$in": ["v", ...]}."""
+    if not isinstance(condition, dict):
+        return [str(condition)]
+    if set(condition) == {"$eq"}:
+        return [str(condition["$eq"])]
+    if set(condition) == {"$in"}:
+        return [str(value) for value in condition["$in"]]
+    raise ValueError(f"Unsupported filter on {field}: {condition} (only $eq and $in are supported)")
+
+
+class FilterBitmaps:
+    """
+    One packed bitmap per value of each filterable metadata field, marking the
+    rows with that value. A metadata filter resolves to a row mask with a few
+    bitwise ORs (values of a field) and ANDs (across fields).
+    """
+
+    def __init__(self, count, values, bitmaps):
+        self.count = count
+        self.values = values  # field -> array of the field's distinct values
+        self.bitmaps = bitmaps  # field -> (len(values), ceil(count / 8)) uint8
+        self._positions = {field: {value: i for i, value in enumerate(field_values)}
+                           for field, field_values in values.items()}
+
+    @classmethod
+    def from_metadata(cls, metadata_lines, fields=FILTER_FIELDS):
+        count = len(metadata_lines)
+        rows = {field: {} for field in fields}
+        for row, line in enumerate(metadata_lines):
+            item = json.loads(line) if line else {}
+            for field in fields:
+                if item.get(field) is not None:
+                    rows[field].setdefault(str(item[field]), []).append(row)
+
+        values, bitmaps = {}, {}
+        for field, value_rows in rows.items():
+            values[field] = np.asarray(sorted(value_rows), dtype=str)
+            bitmaps[field] = np.zeros((len(value_rows), (count + 7) // 8), dtype=np.uint8)
+            for i, value in enumerate(values[field]):
+                mask = np.zeros(count, dtype=bool)
+                mask[value_rows[value]] = True
+                bitmaps[field][i] = np.packbits(mask)
+        return cls(count, values, bitmaps)
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        for field in self.values:
+            np.save(os.path.join(path, f"{field}.values.npy"), self.values[field])
+            np.save(os.path.join(path, f"{field}.bitmaps.npy"), self.bitmaps[field])
+
+    @classmethod
+    def load(cls, path, count):
+        values, bitmaps = {}, {}
+        for name in sorted(os.listdir(path)):
+            if name.endswith(".values.npy"):
+                field = name[:-len(".values.npy")]
+                values[field] = np.load(os.path.join(path, name))
+                bitmaps[field] = np.load(os.path.join(path, f"{field}.bitmaps.npy"), mmap_mode="r")
+        return cls(count, values, bitmaps)
+
+    def mask(self, metadata_filter):
+        """Boolean row mask of a Pinecone-style filter such as {"gender": {"$in": ["women"]}}."""
+        bits = None
+        for field, condition in metadata_filter.items():
+            if field not in self.values:
+                raise ValueError(f"Cannot filter on {field} (filterable fields: {', '.join(self.values)})")
+            positions = sorted({self._positions[field][value] for value in filter_values(field, condition)
+                                if value in self._positions[field]})
+            field_bits = (np.bitwise_or.reduce(self.bitmaps[field][positions], axis=0) if positions
+                          else np.zeros(self.bitmaps[field].shape[1], dtype=np.uint8))
+            bits = field_bits if bits is None else bits & field_bits
+        if bits is None:
+            return None
+        return np.unpackbits(bits, count=self.count).astype(bool)
+
+
+class ExactIndex:
+    """Brute-force cosine search over the full vector matrix."""
+
+    index_type = "exact"
+
+    def __init__(self, ids, vectors, metadata_lines, norms=None, filter_bitmaps=None):
+        self.ids = ids
+        self.vectors = vectors
+        self.metadata_lines = metadata_lines
+        if norms is None:
+            norms = np.linalg.norm(vectors, axis=1)
+        self.inv_norms = (1.0 / np.maximum(norms, EPSILON)).astype(np.float32)
+        self._filter_bitmaps = filter_bitmaps
+        self._filter_lock = threading.Lock()
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    def prepare_query(self, vector):
+        query = np.asarray(vector, dtype=np.float32).ravel()
+        if query.shape[0] != self.dimension:
+            raise ValueError(f"Query has dimension {query.shape[0]}, index has {self.dimension}")
+        return query / max(float(np.linalg.norm(query)), EPSILON)
+
+    def score(self, query, rows=None):
+        if rows is None:
+            return (self.vectors @ query) * self.inv_norms
+        return (self.vectors[rows] @ query) * self.inv_norms[rows]
+
+    @property
+    def filter_bitmaps(self):
+        """The filter bitmaps, built from the metadata on first use if the index directory has none."""
+        if self._filter_bitmaps is None:
+            with self._filter_lock:
+                if self._filter_bitmaps is None:
+                    self._filter_bitmaps = FilterBitmaps.from_metadata(self.metadata_lines)
+        return self._filter_bitmaps
+
+    def search(self, vector, top_k, mask=None):
+        """Return (rows, scores) of the `top_k` most similar items, among the rows in `mask` if given."""
+        query = self.prepare_query(vector)
+        if mask is None:
+            scores = self.score(query)
+            best = top_k_indices(scores, top_k)
+            return best, scores[best]
+        rows = np.flatnonzero(mask)
+        scores = self.score(query, rows)
+        best = top_k_indices(scores, top_k)
+        return rows[best], scores[best]
+
+    def metadata(self, row):
+        line = self.metadata_lines[row]
+        return json.loads(line) if line else {}
+
+    def query(self, vector, top_k, include_values=False, include_metadata=False, filter=None, **kwargs):
+        mask = self.filter_bitmaps.mask(filter) if filter else None
+        rows, scores = self.search(vector, top_k, mask)
+        matches = []
+        for row, score in zip(rows, scores):
+            match = {"id": str(self.ids[row]), "score": float(score)}
+            if include_values:
+                match["values"] = np.asarray(self.vectors[row], dtype=np.float32).tolist()
+            if include_metadata:
+                match["metadata"] = self.metadata(row)
+            matches.append(match)
+        return {"matches": matches}
+
+    def describe_index_stats(self):
+        return {
+            "dimension": self.dimension,
+            "total_vector_count": len(self),
+            "index_type": self.index_type,
+        }
+
+
+class IVFIndex(ExactIndex):
+    """
+    Approximate search: vectors are bucketed by their nearest k-means
+    centroid, and a query only scores the `nprobe` closest buckets.
+    """
+
+    index_type = "ivf"
+
+    def __init__(self, ids, vectors, metadata_lines, centroids, order, offsets, nprobe=8, norms=None,
+                 filter_bitmaps=None):
+        super().__init__(ids, vectors, metadata_lines, norms=norms, filter_bitmaps=filter_bitmaps)
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.nprobe = nprobe
+
+    def search(self, vector, top_k, mask=None):
+        query = self.prepare_query(vector)
+        lists = top_k_indices(self.centroids @ query, self.nprobe)
+        rows = np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+        if mask is not None:
+            rows = rows[mask[rows]]
+        if len(rows) < top_k:
+            # Too few (matching) items in the probed lists: score every matching item instead
+            return super().search(vector, top_k, mask)
+        # Sorted row ids keep reads from the memory-mapped matrix sequential
+        rows.sort()
+        scores = self.score(query, rows)
+        best = top_k_indices(scores, top_k)
+        return rows[best], scores[best]
+
+    def describe_index_stats(self):
+        stats = super().describe_index_stats()
+        stats.update({"nlist": len(self.centroids), "nprobe": self.nprobe})
+        return stats
+
+
+class QuantizedIndex(ExactIndex):
+    """
+    Scores every item against its compact fp16/int8/PQ codes, then re-ranks
+    the best `top_k * rerank_factor` candidates against the full-precision
+    vectors, which stay memory-mapped and are only read for those rows.
+    """
+
+    index_type = "quantized"
+
+    def __init__(self, ids, vectors, metadata_lines, quantizer, codes, rerank_factor=4, norms=None,
+                 filter_bitmaps=None):
+        super().__init__(ids, vectors, metadata_lines, norms=norms, filter_bitmaps=filter_bitmaps)
+        self.quantizer = quantizer
+        self.codes = codes
+        self.rerank_factor = rerank_factor
+
+    def search(self, vector, top_k, mask=None):
+        query = self.prepare_query(vector)
+        if mask is None:
+            rows = np.arange(len(self))
+            approx = chunked_scores(self.quantizer, query, self.codes)
+        else:
+            rows = np.flatnonzero(mask)
+            approx = chunked_scores(self.quantizer, query, self.codes[rows])
+        if self.rerank_factor < 1:
+            best = top_k_indices(approx, top_k)
+            return rows[best], approx[best]
+        candidates = rows[top_k_indices(approx, top_k * self.rerank_factor)]
+        # Sorted row ids keep reads from the memory-mapped matrix sequential
+        candidates.sort()
+        scores = self.score(query, candidates)
+        best = top_k_indices(scores, top_k)
+        return candidates[best], scores[best]
+
+    def describe_index_stats(self):
+        stats = super().describe_index_stats()
+        stats.update({"quantization": self.quantizer.kind, "rerank_factor": self.rerank_factor})
+        return stats
+
+
+def train_ivf(vectors, nlist, iterations=10, sample_size=100000, chunk_size=65536, seed=0):
+    """
+    Cluster the vectors with spherical k-means and return the inverted lists
+    as (centroids, order, offsets): rows of list i are order[offsets[i]:offsets[i + 1]].
+    """
+    rng = np.random.default_rng(seed)
+    count = vectors.shape[0]
+    nlist = min(nlist, count)
+    sample_rows = np.sort(rng.choice(count, min(sample_size, count), replace=False))
+    sample = normalize_rows(vectors[sample_rows])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = normalize_rows(sums[filled])
+
+    assignments = np.concatenate([
+        np.argmax(normalize_rows(vectors[start:start + chunk_size]) @ centroids.T, axis=1)
+        for start in range(0, count, chunk_size)
+    ])
+    order = np.argsort(assignments, kind="stable")
+    offsets = np.searchsorted(assignments[order], np.arange(nlist + 1))
+    return centroids.astype(np.float32), order.astype(np.int64), offsets.astype(np.int64)
+
+
+def build_local_index(path, ids, vectors, metadata):
+    """Write an exact index directory (with filter bitmaps) from aligned ids, vectors and metadata dicts."""
+    os.makedirs(path, exist_ok=True)
+    vectors = np.asarray(vectors)
+    # float16 matrices are kept as they are; anything else is stored as float32
+    vectors = np.ascontiguousarray(vectors, dtype=np.float16 if vectors.dtype == np.float16 else np.float32)
+    np.save(os.path.join(path, VECTORS_FILE), vectors)
+    np.save(os.path.join(path, IDS_FILE), np.asarray(ids, dtype=str))
+    np.save(os.path.join(path, NORMS_FILE), np.linalg.norm(vectors.astype(np.float32), axis=1))
+    with open(os.path.join(path, METADATA_FILE), "w") as f:
+        for item in metadata:
+            f.write(json.dumps(item) + "\n")
+    build_filters(path)
+
+
+def build_ivf(path, nlist=None, iterations=10):
+    """Precompute norms and inverted lists for an existing index directory."""
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    if nlist is None:
+        nlist = max(1, int(4 * np.sqrt(vectors.shape[0])))
+    np.save(os.path.join(path, NORMS_FILE), np.linalg.norm(vectors, axis=1).astype(np.float32))
+    centroids, order, offsets = train_ivf(vectors, nlist, iterations=iterations)
+    np.savez(os.path.join(path, IVF_FILE), centroids=centroids, order=order, offsets=offsets)
+    return len(centroids)
+
+
+def build_filters(path, fields=FILTER_FIELDS):
+    """Precompute the filter bitmaps of an existing index directory."""
+    with open(os.path.join(path, METADATA_FILE), "rb") as f:
+        bitmaps = FilterBitmaps.from_metadata(f.read().splitlines(), fields)
+    bitmaps.save(os.path.join(path, FILTERS_DIR))
+    return bitmaps
+
+
+def resolve_index_dir(path):
+    """
+    `path` may be an index directory or a vectorized_db_init export root,
+    whose LATEST file names the current version directory.
+    """
+    latest_path = os.path.join(path, LATEST_FILE)
+    if os.path.exists(latest_path):
+        with open(latest_path) as f:
+            return os.path.join(path, f.read().strip())
+    return path
+
+
+def build_quantized(path, kind, pq_subspaces=64):
+    """Quantize an existing index directory's vectors (writes quantizer.npz and codes.npy)."""
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    return write_codes(path, vectors, make_quantizer(kind, pq_subspaces=pq_subspaces))
+
+
+def load_local_index(path, index_type="auto", nprobe=8, exact_threshold=50000, rerank_factor=4):
+    """
+    Load an index directory (or the LATEST version of an export root),
+    memory-mapping the vector matrix.
+
+    index_type "auto" uses the IVF lists, or else the quantized codes, when
+    they exist and the catalog has more than `exact_threshold` items, and
+    brute force otherwise.
+    """
+    path = resolve_index_dir(path)
+    vectors = np.load(os.path.join(path, VECTORS_FILE), mmap_mode="r")
+    ids = np.load(os.path.join(path, IDS_FILE), mmap_mode="r")
+    with open(os.path.join(path, METADATA_FILE), "rb") as f:
+        # Metadata is only parsed for the rows a query returns
+        metadata_lines = f.read().splitlines()
+    if len(ids) != vectors.shape[0] or len(metadata_lines) != vectors.shape[0]:
+        raise ValueError(f"Index files in {path} are not aligned")
+
+    norms_path = os.path.join(path, NORMS_FILE)
+    norms = np.load(norms_path) if os.path.exists(norms_path) else None
+    filters_path = os.path.join(path, FILTERS_DIR)
+    # Without prebuilt bitmaps, the index builds them from the metadata on the first filtered query
+    filter_bitmaps = FilterBitmaps.load(filters_path, len(ids)) if os.path.isdir(filters_path) else None
+
+    ivf_path = os.path.join(path, IVF_FILE)
+    quantizer_path = os.path.join(path, QUANTIZER_FILE)
+    large = vectors.shape[0] > exact_threshold
+    use_ivf = index_type == "ivf" or (index_type == "auto" and os.path.exists(ivf_path) and large)
+    use_quantized = index_type == "quantized" or (
+        index_type == "auto" and not use_ivf and os.path.exists(quantizer_path) and large)
+    if use_quantized:
+        if not os.path.exists(quantizer_path):
+            raise FileNotFoundError(f"No quantized codes in {path}; run `python local_index.py quantize {path}`")
+        codes = np.load(os.path.join(path, CODES_FILE), mmap_mode="r")
+        return QuantizedIndex(ids, vectors, metadata_lines, load_quantizer(quantizer_path), codes,
+                              rerank_factor=rerank_factor, norms=norms, filter_bitmaps=filter_bitmaps)
+    if not use_ivf:
+        return ExactIndex(ids, vectors, metadata_lines, norms=norms, filter_bitmaps=filter_bitmaps)
+    if not os.path.exists(ivf_path):
+        raise FileNotFoundError(f"No IVF lists in {path}; run `python local_index.py build-ivf {path}`")
+    with np.load(ivf_path) as ivf:
+        return IVFIndex(ids, vectors, metadata_lines, ivf["centroids"], ivf["order"], ivf["offsets"],
+                        nprobe=nprobe, norms=norms, filter_bitmaps=filter_bitmaps)
+
+
+class LocalIndexProvider:
+    """Loads a local index directory once and hands it to every request."""
+
+    def __init__(self, path, index_type="auto", nprobe=8, exact_threshold=50000, rerank_factor=4):
+        self.path = path
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.exact_threshold = exact_threshold
+        self.rerank_factor = rerank_factor
+        self.version = None
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        # The export version directory and its vectors' mtime identify the data being served
+        path = resolve_index_dir(self.path)
+        self.version = f"{os.path.basename(os.path.normpath(path))}:{os.path.getmtime(os.path.join(path, VECTORS_FILE))}"
+        return load_local_index(path, self.index_type, nprobe=self.nprobe,
+                                exact_threshold=self.exact_threshold, rerank_factor=self.rerank_factor)
+
+    def get(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._load()
+        return self._index
+
+    def refresh(self):
+        """Reload the index directory, e.g. after a rebuild."""
+        with self._lock:
+            self._index = self._load()
+        return self._index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local vector index tools")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_ivf_parser = subparsers.add_parser("build-ivf", help="Add IVF lists to an index directory")
+    build_ivf_parser.add_argument("path")
+    build_ivf_parser.add_argument("--nlist", type=int, default=None)
+    build_ivf_parser.add_argument("--iterations", type=int, default=10)
+    filters_parser = subparsers.add_parser("build-filters", help="Add metadata filter bitmaps to an index directory")
+    filters_parser.add_argument("path")
+    quantize_parser = subparsers.add_parser("quantize", help="Add fp16/int8/PQ codes to an index directory")
+    quantize_parser.add_argument("path")
+    quantize_parser.add_argument("--kind", choices=["fp16", "int8", "pq"], default="pq")
+    quantize_parser.add_argument("--pq-subspaces", type=int, default=64)
+    report_parser = subparsers.add_parser("recall-report", help="Recall vs memory of each quantization")
+    report_parser.add_argument("path")
+    report_parser.add_argument("--queries", type=int, default=200)
+    report_parser.add_argument("--sample", type=int, default=50000, help="Items to evaluate on")
+    report_parser.add_argument("--top-k", type=int, default=10)
+    report_parser.add_argument("--rerank-factor", type=int, default=4)
+    report_parser.add_argument("--pq-subspaces", type=int, default=64)
+    args = parser.parse_args()
+
+    if args.command == "build-ivf":
+        path = resolve_index_dir(args.path)
+        nlist = build_ivf(path, nlist=args.nlist, iterations=args.iterations)
+        print(f"Built {nlist} IVF lists in {path}")
+    elif args.command == "build-filters":
+        path = resolve_index_dir(args.path)
+        bitmaps = build_filters(path)
+        for field, values in bitmaps.values.items():
+            print(f"Built {len(values)} {field} bitmaps in {path}")
+    elif args.command == "quantize":
+        path = resolve_index_dir(args.path)
+        quantizer = build_quantized(path, args.kind, pq_subspaces=args.pq_subspaces)
+        print(f"Wrote {quantizer.kind} codes to {path}")
+    elif args.command == "recall-report":
+        vectors = np.load(os.path.join(resolve_index_dir(args.path), VECTORS_FILE), mmap_mode="r")
+        rng = np.random.default_rng(0)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), min(args.sample, len(vectors)), replace=False))],
+                            dtype=np.float32)
+        # Queries are perturbed catalog vectors, like a text query landing near its items
+        queries = sample[rng.choice(len(sample), args.queries)]
+        queries = queries + rng.normal(scale=0.5 * float(np.std(sample)), size=queries.shape).astype(np.float32)
+        rows = recall_report(sample, queries, top_k=args.top_k, rerank_factor=args.rerank_factor,
+                             pq_subspaces=args.pq_subspaces)
+        print(format_recall_report(rows, top_k=args.top_k))
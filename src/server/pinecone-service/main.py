@@ -1,76 +1,287 @@
-from fastapi import FastAPI, HTTPException, Depends
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Depends, Request
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
+from typing import List, Optional
 import numpy as np
 import os
+import threading
 from pinecone import Pinecone
 from google.cloud import secretmanager
+from local_index import FILTER_FIELDS, LocalIndexProvider
+from vector_codec import VECTOR_DTYPES, BINARY_MEDIA_TYPE, decode_vector, decode_vector_b64
 
 # Load environment variables
 APP_HOST = os.getenv("APP_HOST")
 APP_PORT_PINECONE = int(os.getenv("APP_PORT_PINECONE"))
 PINECONE_SECRET_NAME = os.getenv("PINECONE_SECRET_NAME")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
+# "pinecone" (default) or "local" to serve from an in-process index directory
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR")
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "auto")  # auto, exact, ivf or quantized
+LOCAL_INDEX_NPROBE = int(os.getenv("LOCAL_INDEX_NPROBE", "8"))
+LOCAL_INDEX_EXACT_THRESHOLD = int(os.getenv("LOCAL_INDEX_EXACT_THRESHOLD", "50000"))
+# Quantized indexes re-rank top_k * this many candidates at full precision (0 disables re-ranking)
+LOCAL_INDEX_RERANK_FACTOR = int(os.getenv("LOCAL_INDEX_RERANK_FACTOR", "4"))
+
+# vectorized_db_init stores the version of each ingestion run as the metadata of this record,
+# in a namespace of its own so searches never see it
+INDEX_VERSION_NAMESPACE = "index-version"
+INDEX_VERSION_ID = "index_version"
+
+# HTTP statuses Pinecone returns when the API key is rejected
+AUTH_ERROR_STATUSES = (401, 403)
+
+
+class PineconeIndexProvider:
+    """
+    Resolves the Pinecone API key from Google Secret Manager and builds the
+    index handle once, then hands the same handle to every request.
+    """
+
+    def __init__(self, secret_name, index_name):
+        self.secret_name = secret_name
+        self.index_name = index_name
+        self._index = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Get secret
+        client = secretmanager.SecretManagerServiceClient()
+        response = client.access_secret_version(request={"name": self.secret_name})
+        secret_value = response.payload.data.decode("UTF-8")
+
+        # Initialize Pinecone client and return the index
+        pc = Pinecone(api_key=secret_value)
+        return pc.Index(self.index_name)
+
+    def get(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._index = self._connect()
+        return self._index
+
+    def refresh(self):
+        """Re-read the secret and rebuild the index handle, e.g. after the key was rotated."""
+        with self._lock:
+            self._index = self._connect()
+        return self._index
+
+
+if VECTOR_BACKEND == "local":
+    index_provider = LocalIndexProvider(
+        LOCAL_INDEX_DIR,
+        index_type=LOCAL_INDEX_TYPE,
+        nprobe=LOCAL_INDEX_NPROBE,
+        exact_threshold=LOCAL_INDEX_EXACT_THRESHOLD,
+        rerank_factor=LOCAL_INDEX_RERANK_FACTOR,
+    )
+else:
+    index_provider = PineconeIndexProvider(PINECONE_SECRET_NAME, PINECONE_INDEX_NAME)
 
-app = FastAPI()
 
 def get_index():
     """
-    Dynamically initialize and return the Pinecone index.
-    This function retrieves the Pinecone API key from Google Secret Manager
-    and uses it to connect to the Pinecone service.
+    Return the shared index handle: the Pinecone index, or the local index
+    when VECTOR_BACKEND=local. It is resolved on first use and cached afterwards.
     """
-    # Get secret
-    client = secretmanager.SecretManagerServiceClient()
-    response = client.access_secret_version(request={"name": PINECONE_SECRET_NAME})
-    secret_value = response.payload.data.decode("UTF-8")
+    return index_provider.get()
+
 
-    # Initialize Pinecone client and return the index
-    pc = Pinecone(api_key=secret_value)
-    return pc.Index(PINECONE_INDEX_NAME)
+def is_auth_error(exc):
+    return getattr(exc, "status", None) in AUTH_ERROR_STATUSES
+
+
+def describe_index_stats():
+    """Index stats, refreshing the cached credentials once if Pinecone rejects them."""
+    try:
+        return get_index().describe_index_stats()
+    except Exception as exc:
+        if not is_auth_error(exc):
+            raise
+        return index_provider.refresh().describe_index_stats()
+
+
+def fetch_version_record():
+    """The ingestion run's version record, refreshing the cached credentials once if Pinecone rejects them."""
+    kwargs = {"ids": [INDEX_VERSION_ID], "namespace": INDEX_VERSION_NAMESPACE}
+    try:
+        response = get_index().fetch(**kwargs)
+    except Exception as exc:
+        if not is_auth_error(exc):
+            raise
+        response = index_provider.refresh().fetch(**kwargs)
+    return response["vectors"].get(INDEX_VERSION_ID)
+
+
+def index_version():
+    """
+    A string that changes whenever the index is updated, so callers can tie
+    caches of search results to it: the served export version for a local
+    index, and the version the last ingestion run recorded for Pinecone.
+    """
+    if isinstance(index_provider, LocalIndexProvider):
+        index_provider.get()
+        return index_provider.version
+    record = fetch_version_record()
+    if record is None:
+        # Not ingested since runs started recording a version
+        return PINECONE_INDEX_NAME
+    return f"{PINECONE_INDEX_NAME}:{record['metadata']['version']}"
+
+
+def query_index(index, **kwargs):
+    """Query the index, refreshing the cached credentials once if Pinecone rejects them."""
+    try:
+        return index.query(**kwargs)
+    except Exception as exc:
+        if not is_auth_error(exc):
+            raise
+        return index_provider.refresh().query(**kwargs)
 
 
-class SearchRequest(BaseModel):
-    vector: list
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Resolve the index at startup so the first search does not pay for it."""
+    try:
+        get_index()
+    except Exception as e:
+        print(f"Index not available at startup, will retry on first request: {e}")
+    yield
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+
+
+class SearchOptions(BaseModel):
     top_k: int
+    # Response shaping: vectors are omitted unless asked for, and `fields`
+    # restricts the metadata keys returned (None returns all of them)
+    include_values: bool = False
+    include_metadata: bool = True
+    fields: Optional[List[str]] = None
+    # Metadata filters, pushed down into the index query: an item matches when,
+    # for every filter given, its field holds one of the listed values
+    gender: Optional[List[str]] = None
+    item_type: Optional[List[str]] = None
+    item_sub_type: Optional[List[str]] = None
+    brand: Optional[List[str]] = None
+
+    def metadata_filter(self):
+        """The filters as a Pinecone metadata filter, or None when there are none."""
+        conditions = {field: {"$in": getattr(self, field)} for field in FILTER_FIELDS if getattr(self, field)}
+        return conditions or None
+
+
+class SearchRequest(SearchOptions):
+    # The query vector, either as a JSON list of floats or as base64-encoded
+    # little-endian floats of `dtype` (float32 or float16)
+    vector: Optional[list] = None
+    vector_b64: Optional[str] = None
+    dtype: str = "float32"
+
+    def query_vector(self):
+        if self.dtype not in VECTOR_DTYPES:
+            raise ValueError(f"Unsupported dtype: {self.dtype}")
+        if self.vector_b64 is not None:
+            return decode_vector_b64(self.vector_b64, self.dtype)
+        if self.vector is None:
+            raise ValueError("Either vector or vector_b64 is required")
+        return np.array(self.vector, dtype=np.float32)
+
+
+async def parse_search_request(http_request: Request):
+    """
+    Return (query vector, SearchOptions) from either a JSON SearchRequest body
+    or a raw application/octet-stream vector body with the options in the
+    query string (?top_k=5&dtype=float32&fields=brand,gender&gender=women),
+    where filter fields may repeat to accept several values.
+    """
+    body = await http_request.body()
+    if not http_request.headers.get("content-type", "").startswith(BINARY_MEDIA_TYPE):
+        request = SearchRequest.model_validate_json(body)
+        return request.query_vector(), request
+
+    params = dict(http_request.query_params)
+    dtype = params.pop("dtype", "float32")
+    if dtype not in VECTOR_DTYPES:
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    if "fields" in params:
+        params["fields"] = [field for field in params["fields"].split(",") if field]
+    for field in FILTER_FIELDS:
+        if field in params:
+            params[field] = http_request.query_params.getlist(field)
+    return decode_vector(body, dtype), SearchOptions(**params)
+
+
+def format_match(rank, match, include_values, include_metadata, fields):
+    formatted = {"rank": rank, "id": match["id"], "score": match["score"]}
+    if include_metadata:
+        metadata = match.get("metadata") or {}
+        if fields is not None:
+            metadata = {key: metadata[key] for key in fields if key in metadata}
+        formatted["metadata"] = metadata
+    if include_values:
+        formatted["values"] = list(match.get("values") or [])
+    return formatted
+
+
+def run_search(query_vector, options: SearchOptions, index):
+    """Query the index and return the formatted matches as a list of dicts."""
+    results = query_index(
+        index,
+        vector=np.asarray(query_vector, dtype=np.float32).tolist(),
+        top_k=options.top_k,
+        include_values=options.include_values,
+        include_metadata=options.include_metadata,
+        filter=options.metadata_filter(),
+    )
+    matches = results.get("matches", [])
+
+    # Format the search results
+    return [
+        format_match(idx + 1, match, options.include_values, options.include_metadata, options.fields)
+        for idx, match in enumerate(matches)
+    ]
 
 
 @app.post("/search")
-async def search(request: SearchRequest, index=Depends(get_index)):
+async def search(http_request: Request, index=Depends(get_index)):
     """
-    Perform a vector-based search in the Pinecone index.
+    Perform a vector-based search in the Pinecone index (or the local index).
+    Accepts a JSON SearchRequest, or the raw query vector as application/octet-stream
+    (see parse_search_request). Returns rank, id, score and metadata per match.
     """
     try:
-        results = index.query(
-            vector=np.array(request.vector, dtype=np.float32).tolist(),
-            top_k=request.top_k,
-            include_values=True,
-            include_metadata=True,
-        )
-        matches = results.get("matches", [])
-
-        # Format the search results
-        formatted_matches = [
-            {
-                "rank": idx + 1,
-                "id": match["id"],
-                "score": match["score"],
-                "metadata": match.get("metadata", {}),
-            }
-            for idx, match in enumerate(matches)
-        ]
-        return formatted_matches
+        query_vector, options = await parse_search_request(http_request)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid search request: {str(e)}")
+
+    try:
+        # Serialized with orjson straight from the list
+        return ORJSONResponse(run_search(query_vector, options, index))
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error querying Pinecone: {str(e)}")
 
 
+@app.get("/index_version")
+async def get_index_version():
+    """Version of the index being searched; it changes whenever the index is rebuilt."""
+    try:
+        return {"version": index_version()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading index version: {str(e)}")
+
+
 @app.get("/health")
 async def health():
     """Health check endpoint."""
     try:
         # Simple test to check if the index is accessible
-        index = get_index()
-        index.describe_index_stats()  # Call a lightweight Pinecone API
+        describe_index_stats()  # Call a lightweight Pinecone API
         return {"status": "ok", "message": "Pinecone service is running"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Health check failed: {str(e)}")
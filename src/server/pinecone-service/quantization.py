@@ -0,0 +1,250 @@
+"""
+Vector quantizers for the catalog index: float16, scalar int8 with
+per-dimension scales, and product quantization (PQ).
+
+Quantizers work on L2-normalized vectors, so the inner product of a
+normalized query with a reconstructed vector approximates the cosine
+similarity the index ranks by. Approximate scores are meant to pick
+candidates that are then re-ranked against the full-precision vectors.
+
+pinecone-service searches the codes. vectorized_db_init writes them into the
+embedding export, using this module (and vector_math) from PYTHONPATH
+instead of keeping a copy.
+
+    quantizer.npz   quantizer kind and parameters (scales, codebooks)
+    codes.npy       one row of codes per vector, row-aligned with vectors.npy
+"""
+import os
+
+import numpy as np
+
+from vector_math import EPSILON, normalize_rows, top_k_indices
+
+QUANTIZER_FILE = "quantizer.npz"
+CODES_FILE = "codes.npy"
+
+
+class Float16Quantizer:
+    """Half precision: 2 bytes per dimension, near-lossless for CLIP embeddings."""
+
+    kind = "fp16"
+
+    def fit(self, vectors):
+        return self
+
+    def bytes_per_vector(self, dimension):
+        return 2 * dimension
+
+    def encode(self, vectors):
+        return normalize_rows(vectors).astype(np.float16)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def scores(self, query, codes):
+        return np.asarray(codes, dtype=np.float32) @ query
+
+    def params(self):
+        return {}
+
+
+class ScalarInt8Quantizer:
+    """One byte per dimension, with a per-dimension offset and scale fitted on the data."""
+
+    kind = "int8"
+
+    def __init__(self, offsets=None, scales=None):
+        self.offsets = offsets
+        self.scales = scales
+
+    def fit(self, vectors):
+        vectors = normalize_rows(vectors)
+        low, high = vectors.min(axis=0), vectors.max(axis=0)
+        self.offsets = low.astype(np.float32)
+        self.scales = (np.maximum(high - low, EPSILON) / 255).astype(np.float32)
+        return self
+
+    def bytes_per_vector(self, dimension):
+        return dimension
+
+    def encode(self, vectors):
+        levels = np.rint((normalize_rows(vectors) - self.offsets) / self.scales)
+        return np.clip(levels, 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32) * self.scales + self.offsets
+
+    def scores(self, query, codes):
+        # q . (c * s + o) == (q * s) . c + q . o, without reconstructing the vectors
+        return np.asarray(codes, dtype=np.float32) @ (query * self.scales) + float(query @ self.offsets)
+
+    def params(self):
+        return {"offsets": self.offsets, "scales": self.scales}
+
+
+class ProductQuantizer:
+    """
+    Splits vectors into `subspaces` chunks and stores, per chunk, the index of
+    the nearest of 256 k-means centroids: one byte per subspace.
+    """
+
+    kind = "pq"
+
+    def __init__(self, subspaces=64, codebooks=None, iterations=15, seed=0):
+        self.subspaces = subspaces if codebooks is None else codebooks.shape[0]
+        self.codebooks = codebooks  # (subspaces, 256, subspace dimension)
+        self.iterations = iterations
+        self.seed = seed
+
+    def _split(self, vectors):
+        count, dimension = vectors.shape
+        if dimension % self.subspaces:
+            raise ValueError(f"Dimension {dimension} is not divisible into {self.subspaces} subspaces")
+        return vectors.reshape(count, self.subspaces, dimension // self.subspaces)
+
+    def fit(self, vectors):
+        rng = np.random.default_rng(self.seed)
+        parts = self._split(normalize_rows(vectors))
+        centroids = min(256, parts.shape[0])
+        codebooks = []
+        for j in range(self.subspaces):
+            sample = parts[:, j, :]
+            codebook = sample[rng.choice(len(sample), centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignments = self._nearest(sample, codebook)
+                sums = np.zeros_like(codebook)
+                np.add.at(sums, assignments, sample)
+                counts = np.bincount(assignments, minlength=centroids)
+                # Empty clusters keep their previous centroid
+                filled = counts > 0
+                codebook[filled] = sums[filled] / counts[filled, None]
+            if centroids < 256:
+                codebook = np.concatenate([codebook, np.zeros((256 - centroids, codebook.shape[1]), np.float32)])
+            codebooks.append(codebook)
+        self.codebooks = np.stack(codebooks).astype(np.float32)
+        return self
+
+    @staticmethod
+    def _nearest(points, codebook):
+        # argmin ||p - c||^2 == argmax (p . c - ||c||^2 / 2)
+        return np.argmax(points @ codebook.T - 0.5 * np.sum(codebook ** 2, axis=1), axis=1)
+
+    def bytes_per_vector(self, dimension):
+        return self.subspaces
+
+    def encode(self, vectors):
+        parts = self._split(normalize_rows(vectors))
+        codes = np.empty((parts.shape[0], self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            codes[:, j] = self._nearest(parts[:, j, :], self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        codes = np.asarray(codes)
+        parts = self.codebooks[np.arange(self.subspaces), codes]
+        return parts.reshape(codes.shape[0], -1)
+
+    def scores(self, query, codes):
+        # Asymmetric distance: one lookup table of query . centroid per subspace
+        tables = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.subspaces, -1))
+        return tables[np.arange(self.subspaces), np.asarray(codes)].sum(axis=1)
+
+    def params(self):
+        return {"codebooks": self.codebooks}
+
+
+QUANTIZERS = {quantizer.kind: quantizer for quantizer in (Float16Quantizer, ScalarInt8Quantizer, ProductQuantizer)}
+
+
+def make_quantizer(kind, pq_subspaces=64):
+    if kind not in QUANTIZERS:
+        raise ValueError(f"Unknown quantization: {kind} (expected one of {', '.join(QUANTIZERS)})")
+    if kind == "pq":
+        return ProductQuantizer(subspaces=pq_subspaces)
+    return QUANTIZERS[kind]()
+
+
+def save_quantizer(path, quantizer):
+    np.savez(path, kind=quantizer.kind, **quantizer.params())
+
+
+def load_quantizer(path):
+    with np.load(path) as data:
+        params = {key: data[key] for key in data.files if key != "kind"}
+        return QUANTIZERS[str(data["kind"])](**params)
+
+
+def chunked_scores(quantizer, query, codes, chunk_rows=65536):
+    """Approximate scores of every row of `codes`, a chunk at a time so memory-mapped codes stay bounded."""
+    return np.concatenate([
+        quantizer.scores(query, codes[start:start + chunk_rows])
+        for start in range(0, len(codes), chunk_rows)
+    ]) if len(codes) else np.empty(0, dtype=np.float32)
+
+
+def write_codes(path, vectors, quantizer, sample_size=100000, chunk_rows=65536, seed=0):
+    """
+    Fit `quantizer` on a sample of `vectors` and write quantizer.npz and
+    codes.npy into the directory `path`. Returns the quantizer.
+    """
+    rng = np.random.default_rng(seed)
+    count = vectors.shape[0]
+    sample_rows = np.sort(rng.choice(count, min(sample_size, count), replace=False))
+    quantizer.fit(np.asarray(vectors[sample_rows], dtype=np.float32))
+
+    first = quantizer.encode(vectors[:1])
+    codes = np.lib.format.open_memmap(
+        os.path.join(path, CODES_FILE), mode="w+", dtype=first.dtype, shape=(count,) + first.shape[1:])
+    for start in range(0, count, chunk_rows):
+        codes[start:start + chunk_rows] = quantizer.encode(vectors[start:start + chunk_rows])
+    codes.flush()
+    del codes
+    save_quantizer(os.path.join(path, QUANTIZER_FILE), quantizer)
+    return quantizer
+
+
+def recall_report(vectors, queries, kinds=("fp16", "int8", "pq"), top_k=10, rerank_factor=4, pq_subspaces=64):
+    """
+    Measure recall@top_k of each quantization against exact cosine search,
+    with and without re-ranking top_k * rerank_factor candidates at full
+    precision. Returns one row per quantization (plus the float32 baseline).
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    normalized = normalize_rows(vectors)
+    queries = normalize_rows(queries)
+    dimension = vectors.shape[1]
+    truth = [set(top_k_indices(normalized @ query, top_k)) for query in queries]
+
+    rows = [{"quantization": "float32", "bytes_per_vector": 4 * dimension, "compression": 1.0,
+             "memory_mb": vectors.shape[0] * 4 * dimension / 2 ** 20, "recall": 1.0, "recall_reranked": 1.0}]
+    for kind in kinds:
+        quantizer = make_quantizer(kind, pq_subspaces=pq_subspaces).fit(vectors)
+        codes = quantizer.encode(vectors)
+        hits = reranked_hits = 0
+        for query, expected in zip(queries, truth):
+            approx = quantizer.scores(query, codes)
+            hits += len(expected & set(top_k_indices(approx, top_k)))
+            candidates = top_k_indices(approx, top_k * rerank_factor)
+            exact = normalized[candidates] @ query
+            reranked_hits += len(expected & set(candidates[top_k_indices(exact, top_k)]))
+        total = len(queries) * top_k
+        bytes_per_vector = quantizer.bytes_per_vector(dimension)
+        rows.append({
+            "quantization": kind,
+            "bytes_per_vector": bytes_per_vector,
+            "compression": 4 * dimension / bytes_per_vector,
+            "memory_mb": vectors.shape[0] * bytes_per_vector / 2 ** 20,
+            "recall": hits / total,
+            "recall_reranked": reranked_hits / total,
+        })
+    return rows
+
+
+def format_recall_report(rows, top_k=10):
+    columns = ["bytes_per_vector", "compression", "memory_mb", "recall", "recall_reranked"]
+    lines = [f"{'quantization':<14}" + "".join(f"{column:>18}" for column in columns)]
+    for row in rows:
+        lines.append(f"{row['quantization']:<14}" + "".join(
+            f"{row[column]:>18.3f}" if isinstance(row[column], float) else f"{row[column]:>18}" for column in columns))
+    lines.append(f"(recall@{top_k} against exact float32 cosine search)")
+    return "\n".join(lines)
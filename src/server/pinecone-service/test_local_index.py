@@ -0,0 +1,185 @@
+import shutil
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+import main
+from main import app
+from local_index import (
+    FILTERS_DIR,
+    ExactIndex,
+    IVFIndex,
+    LocalIndexProvider,
+    build_ivf,
+    build_local_index,
+    build_quantized,
+    load_local_index,
+)
+
+client = TestClient(app)
+
+DIM = 16
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    rng = np.random.default_rng(42)
+    vectors = rng.normal(size=(500, DIM)).astype(np.float32)
+    ids = [f"topic image_{i}.jpg" for i in range(len(vectors))]
+    metadata = [{"brand": f"Brand {i}", "gender": "women" if i % 2 else "men"} for i in range(len(vectors))]
+    path = str(tmp_path / "index")
+    build_local_index(path, ids, vectors, metadata)
+    return path, vectors
+
+
+def test_exact_index_matches_brute_force(index_dir):
+    path, vectors = index_dir
+    index = load_local_index(path, index_type="exact")
+    assert isinstance(index, ExactIndex)
+    assert isinstance(index.vectors, np.memmap)
+
+    query = vectors[7] + 0.01
+    normalized = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    expected = np.argsort(-(normalized @ (query / np.linalg.norm(query))))[:5]
+
+    results = index.query(vector=query.tolist(), top_k=5, include_metadata=True)
+    matches = results["matches"]
+    assert [match["id"] for match in matches] == [f"topic image_{i}.jpg" for i in expected]
+    assert matches[0]["metadata"] == {"brand": "Brand 7", "gender": "women"}
+    assert matches[0]["score"] == pytest.approx(1.0, abs=1e-3)
+    assert "values" not in matches[0]
+
+
+def test_ivf_index_finds_nearest_neighbour(index_dir):
+    path, vectors = index_dir
+    assert build_ivf(path, nlist=10) == 10
+    index = load_local_index(path, index_type="ivf", nprobe=3)
+    assert isinstance(index, IVFIndex)
+
+    for row in (0, 123, 499):
+        matches = index.query(vector=vectors[row].tolist(), top_k=3)["matches"]
+        assert matches[0]["id"] == f"topic image_{row}.jpg"
+
+
+def test_auto_index_type(index_dir):
+    path, _ = index_dir
+    build_ivf(path, nlist=10)
+    assert isinstance(load_local_index(path, exact_threshold=100), IVFIndex)
+    assert isinstance(load_local_index(path, exact_threshold=1000), ExactIndex)
+
+
+def test_dimension_mismatch(index_dir):
+    path, _ = index_dir
+    index = load_local_index(path)
+    with pytest.raises(ValueError):
+        index.query(vector=[0.1] * (DIM + 1), top_k=3)
+
+
+def test_search_endpoint_with_local_backend(index_dir, monkeypatch):
+    path, vectors = index_dir
+    monkeypatch.setattr(main, "index_provider", LocalIndexProvider(path))
+
+    response = client.post("/search", json={"vector": vectors[42].tolist(), "top_k": 3})
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data) == 3
+    assert data[0]["rank"] == 1
+    assert data[0]["id"] == "topic image_42.jpg"
+    assert data[0]["metadata"]["brand"] == "Brand 42"
+
+    health = client.get("/health")
+    assert health.status_code == 200
+
+
+def test_load_latest_export_version(tmp_path):
+    rng = np.random.default_rng(7)
+    vectors = rng.normal(size=(50, DIM)).astype(np.float32)
+    ids = [f"topic image_{i}.jpg" for i in range(len(vectors))]
+    metadata = [{"brand": f"Brand {i}"} for i in range(len(vectors))]
+    # An export root as written by vectorized_db_init: version directories plus a LATEST pointer
+    build_local_index(str(tmp_path / "v1"), ids[:10], vectors[:10], metadata[:10])
+    build_local_index(str(tmp_path / "v2"), ids, vectors.astype(np.float16), metadata)
+    (tmp_path / "LATEST").write_text("v2\n")
+
+    index = load_local_index(str(tmp_path))
+    assert len(index) == 50
+    matches = index.query(vector=vectors[31].tolist(), top_k=1)["matches"]
+    assert matches[0]["id"] == "topic image_31.jpg"
+    assert index.vectors.dtype == np.float16
+
+
+@pytest.mark.parametrize("index_type", ["exact", "ivf", "quantized"])
+def test_filtered_search(index_dir, index_type):
+    path, vectors = index_dir
+    build_ivf(path, nlist=10)
+    build_quantized(path, "int8")
+    index = load_local_index(path, index_type=index_type, nprobe=3)
+
+    # Row 7 is "women"; the best "men" items must exclude it and the other odd rows
+    query = vectors[7].tolist()
+    matches = index.query(vector=query, top_k=5, include_metadata=True,
+                          filter={"gender": {"$in": ["men"]}})["matches"]
+    assert len(matches) == 5
+    assert all(match["metadata"]["gender"] == "men" for match in matches)
+
+    matches = index.query(vector=query, top_k=5, include_metadata=True,
+                          filter={"gender": {"$eq": "women"}, "brand": {"$in": ["Brand 7", "Brand 8", "Brand 9"]}})
+    assert [match["id"] for match in matches["matches"]] == ["topic image_7.jpg", "topic image_9.jpg"]
+
+    assert index.query(vector=query, top_k=5, filter={"brand": "No Such Brand"})["matches"] == []
+
+
+def test_filter_bitmaps_prebuilt_or_lazy(index_dir):
+    path, vectors = index_dir
+    prebuilt = load_local_index(path)
+    assert prebuilt._filter_bitmaps is not None
+    assert list(prebuilt.filter_bitmaps.values["gender"]) == ["men", "women"]
+
+    shutil.rmtree(f"{path}/{FILTERS_DIR}")
+    lazy = load_local_index(path)
+    assert lazy._filter_bitmaps is None
+    metadata_filter = {"gender": {"$in": ["women"]}, "brand": {"$in": ["Brand 1", "Brand 2", "Brand 3"]}}
+    assert np.flatnonzero(lazy.filter_bitmaps.mask(metadata_filter)).tolist() == [1, 3]
+    assert np.array_equal(lazy.filter_bitmaps.mask(metadata_filter), prebuilt.filter_bitmaps.mask(metadata_filter))
+
+    with pytest.raises(ValueError):
+        lazy.query(vector=vectors[0].tolist(), top_k=3, filter={"colour": "red"})
+    with pytest.raises(ValueError):
+        lazy.query(vector=vectors[0].tolist(), top_k=3, filter={"gender": {"$ne": "men"}})
+
+
+def test_search_endpoint_filters_with_local_backend(index_dir, monkeypatch):
+    path, vectors = index_dir
+    monkeypatch.setattr(main, "index_provider", LocalIndexProvider(path))
+
+    response = client.post("/search", json={"vector": vectors[42].tolist(), "top_k": 3, "gender": ["women"]})
+    assert response.status_code == 200
+    assert [match["metadata"]["gender"] for match in response.json()] == ["women"] * 3
+
+    response = client.post(
+        "/search", content=vectors[42].astype("<f4").tobytes(),
+        params=[("top_k", 3), ("brand", "Brand 42"), ("brand", "Brand 43")],
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert [match["id"] for match in response.json()][0] == "topic image_42.jpg"
+    assert {match["metadata"]["brand"] for match in response.json()} == {"Brand 42", "Brand 43"}
+
+
+def test_index_version_follows_latest_export(tmp_path, monkeypatch):
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(20, DIM)).astype(np.float32)
+    ids = [f"topic image_{i}.jpg" for i in range(len(vectors))]
+    metadata = [{"brand": f"Brand {i}"} for i in range(len(vectors))]
+    build_local_index(str(tmp_path / "v1"), ids, vectors, metadata)
+    (tmp_path / "LATEST").write_text("v1\n")
+    monkeypatch.setattr(main, "index_provider", LocalIndexProvider(str(tmp_path)))
+
+    first = client.get("/index_version").json()["version"]
+    assert first.startswith("v1:")
+
+    build_local_index(str(tmp_path / "v2"), ids, vectors, metadata)
+    (tmp_path / "LATEST").write_text("v2\n")
+    # The served version only changes once the provider reloads the index
+    assert client.get("/index_version").json()["version"] == first
+    main.index_provider.refresh()
+    assert client.get("/index_version").json()["version"].startswith("v2:")
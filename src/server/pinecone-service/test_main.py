@@ -1,16 +1,29 @@
+import numpy as np
 import pytest
 from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
-from main import app, get_index
+from unittest.mock import MagicMock
+import main
+from main import app, PineconeIndexProvider
+from vector_codec import encode_vector_b64
 
 client = TestClient(app)
 
 
+class MockAuthError(Exception):
+    status = 401
+
+
 @pytest.fixture(autouse=True)
 def mock_external_services(monkeypatch):
     # Mock the SecretManagerServiceClient
+    secret_clients = []
+
+    def make_secret_client():
+        secret_clients.append(MockSecretManagerClient())
+        return secret_clients[-1]
+
     monkeypatch.setattr(
-        "main.secretmanager.SecretManagerServiceClient", lambda: MockSecretManagerClient()
+        "main.secretmanager.SecretManagerServiceClient", make_secret_client
     )
 
     # Mock the Pinecone Index
@@ -21,8 +34,17 @@ def mock_external_services(monkeypatch):
             {"id": "item2", "score": 0.89, "metadata": {"label": "label2"}},
         ]
     }
-    monkeypatch.setattr("main.get_index", lambda: mock_index)
-    
+    mock_pinecone = MagicMock()
+    mock_pinecone.return_value.Index.return_value = mock_index
+    monkeypatch.setattr("main.Pinecone", mock_pinecone)
+
+    # Start every test with an empty index handle cache
+    monkeypatch.setattr(
+        "main.index_provider",
+        PineconeIndexProvider(main.PINECONE_SECRET_NAME, main.PINECONE_INDEX_NAME),
+    )
+    return {"index": mock_index, "pinecone": mock_pinecone, "secret_clients": secret_clients}
+
 
 class MockSecretManagerClient:
     def access_secret_version(self, request):
@@ -54,13 +76,8 @@ def test_search_success(mock_external_services):
     assert data[1]["id"] == "item2"
 
 
-def test_search_internal_error(monkeypatch):
-    def mock_failing_index():
-        mock_index = MagicMock()
-        mock_index.query.side_effect = Exception("Mocked internal error")
-        return mock_index
-
-    monkeypatch.setattr("main.get_index", mock_failing_index)
+def test_search_internal_error(mock_external_services):
+    mock_external_services["index"].query.side_effect = Exception("Mocked internal error")
 
     payload = {
         "vector": [0.1] * 512,
@@ -69,3 +86,136 @@ def test_search_internal_error(monkeypatch):
     response = client.post("/search", json=payload)
     assert response.status_code == 500
     assert "Error querying Pinecone: Mocked internal error" in response.json()["detail"]
+
+
+def test_index_resolved_once(mock_external_services):
+    payload = {"vector": [0.1] * 512, "top_k": 2}
+    for _ in range(3):
+        assert client.post("/search", json=payload).status_code == 200
+    assert client.get("/health").status_code == 200
+
+    assert len(mock_external_services["secret_clients"]) == 1
+    mock_external_services["pinecone"].assert_called_once_with(api_key="mocked-api-key")
+    assert mock_external_services["index"].query.call_count == 3
+
+
+def test_search_refreshes_index_on_auth_error(mock_external_services):
+    stale_index = MagicMock()
+    stale_index.query.side_effect = MockAuthError("Unauthorized")
+    main.index_provider._index = stale_index
+
+    payload = {"vector": [0.1] * 512, "top_k": 2}
+    response = client.post("/search", json=payload)
+    assert response.status_code == 200
+    assert len(response.json()) == 2
+    assert main.index_provider.get() is mock_external_services["index"]
+    assert len(mock_external_services["secret_clients"]) == 1
+
+
+def test_search_omits_values_by_default(mock_external_services):
+    payload = {"vector": [0.1] * 512, "top_k": 2}
+    response = client.post("/search", json=payload)
+    assert response.status_code == 200
+    assert "values" not in response.json()[0]
+    assert mock_external_services["index"].query.call_args.kwargs["include_values"] is False
+
+
+def test_search_projection(mock_external_services):
+    mock_external_services["index"].query.return_value = {
+        "matches": [
+            {"id": "item1", "score": 0.95, "values": [0.5, 0.5],
+             "metadata": {"brand": "Brand A", "caption": "long caption", "gender": "women"}},
+        ]
+    }
+
+    payload = {"vector": [0.1] * 512, "top_k": 1, "fields": ["brand", "gender", "missing"]}
+    data = client.post("/search", json=payload).json()
+    assert data[0]["metadata"] == {"brand": "Brand A", "gender": "women"}
+
+    payload = {"vector": [0.1] * 512, "top_k": 1, "include_metadata": False, "include_values": True}
+    data = client.post("/search", json=payload).json()
+    assert data == [{"rank": 1, "id": "item1", "score": 0.95, "values": [0.5, 0.5]}]
+    assert mock_external_services["index"].query.call_args.kwargs["include_values"] is True
+
+
+def test_search_binary_vector(mock_external_services):
+    vector = np.linspace(-1, 1, 512, dtype=np.float32)
+    response = client.post(
+        "/search",
+        content=vector.astype("<f4").tobytes(),
+        params={"top_k": 2, "fields": "label", "include_values": "false"},
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    assert [match["id"] for match in response.json()] == ["item1", "item2"]
+    query_kwargs = mock_external_services["index"].query.call_args.kwargs
+    assert query_kwargs["vector"] == vector.tolist()
+    assert query_kwargs["top_k"] == 2
+
+    # float16 halves the payload at a small loss of precision
+    response = client.post(
+        "/search",
+        content=vector.astype("<f2").tobytes(),
+        params={"top_k": 2, "dtype": "float16"},
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    sent = mock_external_services["index"].query.call_args.kwargs["vector"]
+    assert np.allclose(sent, vector, atol=1e-3)
+
+
+def test_search_base64_vector(mock_external_services):
+    vector = np.full(512, 0.25, dtype=np.float32)
+    payload = {"vector_b64": encode_vector_b64(vector), "top_k": 2}
+    response = client.post("/search", json=payload)
+    assert response.status_code == 200
+    assert mock_external_services["index"].query.call_args.kwargs["vector"] == vector.tolist()
+
+
+def test_search_rejects_bad_vectors(mock_external_services):
+    assert client.post("/search", json={"top_k": 2}).status_code == 422
+    assert client.post("/search", json={"vector": [0.1], "top_k": 2, "dtype": "int8"}).status_code == 422
+    response = client.post(
+        "/search", content=b"\x00\x01\x02", params={"top_k": 2},
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 422
+    mock_external_services["index"].query.assert_not_called()
+
+
+def test_search_filters_pushed_down(mock_external_services):
+    payload = {"vector": [0.1] * 512, "top_k": 2, "gender": ["women"], "brand": ["Brand A", "Brand B"]}
+    assert client.post("/search", json=payload).status_code == 200
+    assert mock_external_services["index"].query.call_args.kwargs["filter"] == {
+        "gender": {"$in": ["women"]}, "brand": {"$in": ["Brand A", "Brand B"]}}
+
+    # Binary requests repeat the query parameter for each value
+    response = client.post(
+        "/search", content=np.zeros(512, dtype="<f4").tobytes(),
+        params=[("top_k", 2), ("item_type", "dress"), ("item_type", "skirt")],
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 200
+    query_kwargs = mock_external_services["index"].query.call_args.kwargs
+    assert query_kwargs["filter"] == {"item_type": {"$in": ["dress", "skirt"]}}
+    # Filtering happens in the index, so the same top_k is requested
+    assert query_kwargs["top_k"] == 2
+
+    assert client.post("/search", json={"vector": [0.1] * 512, "top_k": 2}).status_code == 200
+    assert mock_external_services["index"].query.call_args.kwargs["filter"] is None
+
+
+def test_index_version(mock_external_services):
+    mock_index = mock_external_services["index"]
+    mock_index.fetch.return_value = {
+        "vectors": {main.INDEX_VERSION_ID: {"id": main.INDEX_VERSION_ID, "metadata": {"version": "20241201-120000"}}}
+    }
+    response = client.get("/index_version")
+    assert response.status_code == 200
+    assert response.json() == {"version": f"{main.PINECONE_INDEX_NAME}:20241201-120000"}
+    assert mock_index.fetch.call_args.kwargs == {
+        "ids": [main.INDEX_VERSION_ID], "namespace": main.INDEX_VERSION_NAMESPACE}
+
+    # An index no run has recorded a version for yet
+    mock_index.fetch.return_value = {"vectors": {}}
+    assert client.get("/index_version").json() == {"version": main.PINECONE_INDEX_NAME}
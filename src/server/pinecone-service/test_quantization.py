@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from local_index import QuantizedIndex, build_local_index, build_quantized, load_local_index
+from vector_math import normalize_rows
+from quantization import (
+    ProductQuantizer,
+    ScalarInt8Quantizer,
+    load_quantizer,
+    make_quantizer,
+    recall_report,
+    save_quantizer,
+)
+
+DIM = 32
+
+
+@pytest.fixture
+def clustered_vectors():
+    # Clustered data, like CLIP embeddings of a catalog with many similar items
+    rng = np.random.default_rng(3)
+    centers = rng.normal(size=(20, DIM))
+    vectors = centers[rng.integers(0, 20, size=2000)] + 0.3 * rng.normal(size=(2000, DIM))
+    return vectors.astype(np.float32)
+
+
+@pytest.mark.parametrize("kind, max_error", [("fp16", 1e-3), ("int8", 2e-2), ("pq", 0.35)])
+def test_quantizer_round_trip(clustered_vectors, kind, max_error, tmp_path):
+    quantizer = make_quantizer(kind, pq_subspaces=8).fit(clustered_vectors)
+    codes = quantizer.encode(clustered_vectors)
+    assert codes.nbytes == len(clustered_vectors) * quantizer.bytes_per_vector(DIM)
+
+    normalized = normalize_rows(clustered_vectors)
+    error = np.abs(quantizer.decode(codes) - normalized).max(axis=1).mean()
+    assert error < max_error
+
+    # Scores computed on the codes match scores against the reconstructed vectors
+    query = normalized[5]
+    assert np.allclose(quantizer.scores(query, codes), quantizer.decode(codes) @ query, atol=1e-4)
+
+    save_quantizer(tmp_path / "quantizer.npz", quantizer)
+    loaded = load_quantizer(tmp_path / "quantizer.npz")
+    assert type(loaded) is type(quantizer)
+    assert np.array_equal(loaded.encode(clustered_vectors[:10]), codes[:10])
+
+
+def test_int8_and_pq_parameters(clustered_vectors):
+    int8 = ScalarInt8Quantizer().fit(clustered_vectors)
+    assert int8.scales.shape == (DIM,)
+    pq = ProductQuantizer(subspaces=8).fit(clustered_vectors)
+    assert pq.codebooks.shape == (8, 256, DIM // 8)
+    with pytest.raises(ValueError):
+        ProductQuantizer(subspaces=5).fit(clustered_vectors)
+
+
+def test_recall_report(clustered_vectors):
+    rng = np.random.default_rng(0)
+    queries = clustered_vectors[rng.choice(len(clustered_vectors), 50)] + 0.1 * rng.normal(size=(50, DIM))
+    rows = {row["quantization"]: row for row in recall_report(
+        clustered_vectors, queries, top_k=10, rerank_factor=4, pq_subspaces=16)}
+    assert rows["float32"]["recall"] == 1.0
+    assert rows["fp16"]["recall"] > 0.95
+    assert rows["int8"]["compression"] == 4.0
+    assert rows["pq"]["compression"] == 8.0
+    # Re-ranking recovers most of what PQ's coarse scores miss
+    assert rows["pq"]["recall_reranked"] > rows["pq"]["recall"]
+    assert rows["pq"]["recall_reranked"] > 0.9
+
+
+def test_quantized_index_search(clustered_vectors, tmp_path):
+    path = str(tmp_path / "index")
+    ids = [f"item_{i}" for i in range(len(clustered_vectors))]
+    build_local_index(path, ids, clustered_vectors, [{"row": i} for i in range(len(clustered_vectors))])
+    build_quantized(path, "pq", pq_subspaces=8)
+
+    index = load_local_index(path, index_type="quantized", rerank_factor=4)
+    assert isinstance(index, QuantizedIndex)
+    assert isinstance(index.codes, np.memmap)
+    assert index.describe_index_stats()["quantization"] == "pq"
+    assert isinstance(load_local_index(path, exact_threshold=100), QuantizedIndex)
+
+    exact = load_local_index(path, index_type="exact")
+    for row in (0, 777, 1999):
+        matches = index.query(vector=clustered_vectors[row].tolist(), top_k=5)["matches"]
+        expected = exact.query(vector=clustered_vectors[row].tolist(), top_k=5)["matches"]
+        assert matches[0]["id"] == f"item_{row}"
+        # Re-ranked scores are exact cosine similarities
+        assert matches[0]["score"] == pytest.approx(expected[0]["score"], abs=1e-5)
@@ -0,0 +1,22 @@
+"""
+Vector helpers shared by local_index and quantization. Kept free of service
+imports so vectorized_db_init can load it next to quantization.py.
+"""
+import numpy as np
+
+EPSILON = 1e-12
+
+
+def normalize_rows(matrix):
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.maximum(norms, EPSILON)
+
+
+def top_k_indices(scores, k):
+    """Indices of the k largest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
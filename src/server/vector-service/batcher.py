@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-text encode requests into one model call.
+
+    The first request opens a batch and waits up to `max_wait_ms` for others
+    to join; the batch is flushed early once it reaches `max_batch_size`.
+    Encoding runs on a dedicated worker thread so the event loop stays free.
+    """
+
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0, executor=None):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="encoder")
+        self._pending = []
+        self._pending_loop = None
+        self._timer = None
+        self._tasks = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, text):
+        """Queue `text` for the next batch and wait for its vector."""
+        loop = asyncio.get_running_loop()
+        if self._pending_loop is not None and self._pending_loop is not loop:
+            # Drop a batch stranded on an event loop that is no longer running
+            self._timer = None
+            self._pending, self._pending_loop = [], None
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self._pending_loop = loop
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    async def encode(self, texts):
+        """Encode a list of texts directly, in chunks of at most `max_batch_size`."""
+        loop = asyncio.get_running_loop()
+        vectors = []
+        for start in range(0, len(texts), self.max_batch_size):
+            chunk = texts[start:start + self.max_batch_size]
+            vectors.extend(await loop.run_in_executor(self.executor, self.encode_fn, chunk))
+            self.batches += 1
+            self.items += len(chunk)
+        return vectors
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, loop = self._pending, self._pending_loop
+        self._pending, self._pending_loop = [], None
+        if batch:
+            task = loop.create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        texts = [text for text, _ in batch]
+        try:
+            vectors = await asyncio.get_running_loop().run_in_executor(
+                self.executor, self.encode_fn, texts)
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": round(self.items / self.batches, 3) if self.batches else 0.0,
+        }
@@ -0,0 +1,121 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(text):
+    """
+    Lowercase and collapse whitespace. CLIP's tokenizer does the same, so
+    queries differing only in case or spacing share one embedding.
+    """
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of text embeddings keyed on (model name, normalized text).
+
+    Entries expire `ttl_seconds` after they were computed. When `path` is set
+    the cache can be saved to and restored from a .npz file across restarts.
+    """
+
+    def __init__(self, model_name, max_entries=10000, ttl_seconds=86400, path=None, clock=time.time):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.path = path
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (created_at, float32 vector)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, text):
+        return f"{self.model_name}\x00{normalize_query(text)}"
+
+    def get(self, text):
+        """Return the cached vector as a list of floats, or None on a miss."""
+        key = self.key(text)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.clock() - entry[0] > self.ttl_seconds:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1].tolist()
+
+    def put(self, text, vector, created_at=None):
+        key = self.key(text)
+        value = (self.clock() if created_at is None else created_at, np.asarray(vector, dtype=np.float32))
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        """Write unexpired entries to `path` atomically. Returns the number of entries saved."""
+        if not self.path:
+            return 0
+        now = self.clock()
+        with self._lock:
+            entries = [(key, created, vector) for key, (created, vector) in self._entries.items()
+                       if now - created <= self.ttl_seconds]
+        if not entries:
+            return 0
+        keys, created, vectors = zip(*entries)
+        tmp_path = f"{self.path}.tmp.npz"
+        np.savez(tmp_path, keys=np.array(keys), created=np.array(created, dtype=np.float64),
+                 vectors=np.stack(vectors))
+        os.replace(tmp_path, self.path)
+        return len(entries)
+
+    def load(self):
+        """Restore unexpired entries for this model from `path`. Returns the number of entries loaded."""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        prefix = f"{self.model_name}\x00"
+        now = self.clock()
+        loaded = 0
+        with np.load(self.path) as data:
+            # Entries were saved least-recently-used first, so inserting in order keeps LRU order
+            for key, created, vector in zip(data["keys"], data["created"], data["vectors"]):
+                key = str(key)
+                if key.startswith(prefix) and now - created <= self.ttl_seconds:
+                    with self._lock:
+                        self._entries[key] = (float(created), vector)
+                    loaded += 1
+        with self._lock:
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return loaded
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+        }
@@ -1,6 +1,12 @@
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Header, Response
 from pydantic import BaseModel
+from typing import List, Optional
 from transformers import CLIPProcessor, CLIPModel
+from batcher import MicroBatcher
+from embedding_cache import EmbeddingCache
+from vector_codec import VECTOR_DTYPES, BINARY_MEDIA_TYPE, encode_vector, encode_vector_b64
+import torch
 import os
 
 # Get environment variables directly from Docker
@@ -8,38 +14,127 @@ APP_HOST = os.getenv("APP_HOST")  # Default to 127.0.0.1
 APP_PORT_VECTOR = int(os.getenv("APP_PORT_VECTOR"))    # Default to 8001
 MODEL_NAME = os.getenv("MODEL_NAME")
 PROCESSOR_NAME = os.getenv("PROCESSOR_NAME")
+# Micro-batching knobs: largest batch per forward pass and how long the first request waits for company
+VECTOR_BATCH_MAX_SIZE = int(os.getenv("VECTOR_BATCH_MAX_SIZE", "32"))
+VECTOR_BATCH_MAX_WAIT_MS = float(os.getenv("VECTOR_BATCH_MAX_WAIT_MS", "5"))
+# Query embedding cache; set EMBEDDING_CACHE_PATH to keep it across restarts
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", "86400"))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Restore the embedding cache on startup and persist it on shutdown."""
+    embedding_cache.load()
+    yield
+    embedding_cache.save()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Load CLIP model and processor
 model = CLIPModel.from_pretrained(MODEL_NAME)
 processor = CLIPProcessor.from_pretrained(PROCESSOR_NAME)
 
 
+def encode_texts(texts):
+    """Run one CLIP text forward pass over `texts` and return one vector (list of floats) per text."""
+    inputs = processor(text=texts, return_tensors="pt", padding=True)
+    with torch.inference_mode():
+        outputs = model.get_text_features(**inputs)
+    return outputs.detach().numpy().reshape(len(texts), -1).tolist()
+
+
+batcher = MicroBatcher(
+    encode_texts,
+    max_batch_size=VECTOR_BATCH_MAX_SIZE,
+    max_wait_ms=VECTOR_BATCH_MAX_WAIT_MS,
+)
+
+embedding_cache = EmbeddingCache(
+    MODEL_NAME,
+    max_entries=EMBEDDING_CACHE_SIZE,
+    ttl_seconds=EMBEDDING_CACHE_TTL_SECONDS,
+    path=EMBEDDING_CACHE_PATH,
+)
+
+
 class VectorRequest(BaseModel):
     text: str
 
 
+class VectorsRequest(BaseModel):
+    texts: List[str]
+
+
+async def embed_text(text):
+    """
+    Return the embedding of `text` as a list of floats.
+    Repeated queries are served from the embedding cache; concurrent misses
+    are coalesced into a single CLIP forward pass.
+    """
+    vector = embedding_cache.get(text)
+    if vector is None:
+        vector = await batcher.submit(text)
+        embedding_cache.put(text, vector)
+    return vector
+
+
 @app.post("/get_vector")
-async def get_vector(request: VectorRequest):
+async def get_vector(request: VectorRequest, encoding: str = "json", dtype: str = "float32",
+                     accept: Optional[str] = Header(None)):
     """
     Endpoint to generate vector embeddings for a given text input.
     - Accepts a JSON request with a 'text' field.
-    - Returns a flattened vector representing the text.
+    - Returns a flattened vector representing the text: a JSON list by default,
+      raw little-endian bytes when the client accepts application/octet-stream,
+      or a base64 string ({"vector_b64", "dtype"}) with ?encoding=base64.
+    - `dtype` (float32 or float16) sets the precision of the binary encodings.
     """
+    if dtype not in VECTOR_DTYPES:
+        raise HTTPException(status_code=422, detail=f"Unsupported dtype: {dtype}")
     try:
-        # Preprocess the input text using the CLIP processor
-        inputs = processor(text=[request.text],
-                           return_tensors="pt", padding=True)
-        # Generate text features using the CLIP model
-        outputs = model.get_text_features(**inputs)
-        # Convert the output tensor to a flattened list
-        vector = outputs.detach().numpy().flatten().tolist()
-        return {"vector": vector}
+        vector = await embed_text(request.text)
     except Exception as e:
         raise HTTPException(
             status_code=500, detail=f"Error generating vector: {str(e)}")
 
+    if accept and BINARY_MEDIA_TYPE in accept:
+        return Response(content=encode_vector(vector, dtype), media_type=BINARY_MEDIA_TYPE,
+                        headers={"X-Vector-Dtype": dtype})
+    if encoding == "base64":
+        return {"vector_b64": encode_vector_b64(vector, dtype), "dtype": dtype}
+    return {"vector": vector}
+
+
+@app.post("/get_vectors")
+async def get_vectors(request: VectorsRequest):
+    """
+    Endpoint to generate vector embeddings for a list of texts.
+    - Accepts a JSON request with a 'texts' field.
+    - Returns one vector per text, in input order.
+    """
+    try:
+        vectors = [embedding_cache.get(text) for text in request.texts]
+        misses = list(dict.fromkeys(text for text, vector in zip(request.texts, vectors) if vector is None))
+        if misses:
+            encoded = dict(zip(misses, await batcher.encode(misses)))
+            for text, vector in encoded.items():
+                embedding_cache.put(text, vector)
+            vectors = [encoded[text] if vector is None else vector
+                       for text, vector in zip(request.texts, vectors)]
+        return {"vectors": vectors}
+    except Exception as e:
+        raise HTTPException(
+            status_code=500, detail=f"Error generating vectors: {str(e)}")
+
+
+@app.get("/metrics")
+async def metrics():
+    """Micro-batching and embedding cache statistics."""
+    return {"batcher": batcher.stats(), "embedding_cache": embedding_cache.stats()}
+
 
 @app.get("/health")
 async def health():
@@ -1,6 +1,10 @@
+import asyncio
 import pytest
 from fastapi.testclient import TestClient
 from main import app
+from batcher import MicroBatcher
+from embedding_cache import EmbeddingCache
+from vector_codec import decode_vector, decode_vector_b64
 import main
 import torch
 
@@ -21,6 +25,7 @@ class MockProcessor:
 def mock_clip_model(monkeypatch):
     monkeypatch.setattr(main, "model", MockModel())
     monkeypatch.setattr(main, "processor", MockProcessor())
+    main.embedding_cache.clear()
 
 
 def test_mock_setup():
@@ -71,3 +76,146 @@ def test_get_vector_internal_error():
     assert response.status_code == 500
     data = response.json()
     assert data["detail"].startswith("Error generating vector:")
+
+
+def test_get_vector_binary_encodings():
+    """
+    Test that /get_vector returns raw float32 bytes or base64 when asked, with the same values as JSON.
+    """
+    expected = client.post("/get_vector", json={"text": "Test input"}).json()["vector"]
+
+    response = client.post("/get_vector", json={"text": "Test input"},
+                           headers={"Accept": "application/octet-stream"})
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/octet-stream"
+    assert response.headers["x-vector-dtype"] == "float32"
+    assert decode_vector(response.content).tolist() == expected
+
+    response = client.post("/get_vector?encoding=base64&dtype=float16", json={"text": "Test input"})
+    data = response.json()
+    assert data["dtype"] == "float16"
+    assert decode_vector_b64(data["vector_b64"], "float16") == pytest.approx(expected, abs=1e-3)
+
+    response = client.post("/get_vector?dtype=int8", json={"text": "Test input"})
+    assert response.status_code == 422
+
+
+class MockBatchModel:
+    def get_text_features(self, input_ids):
+        return input_ids.float().repeat(1, 3)
+
+
+class MockBatchProcessor:
+    def __call__(self, text, return_tensors, padding):
+        return {"input_ids": torch.tensor([[len(t)] for t in text])}
+
+
+def test_get_vectors_success(monkeypatch):
+    """
+    Test that the /get_vectors endpoint returns one vector per text, in order.
+    """
+    monkeypatch.setattr(main, "model", MockBatchModel())
+    monkeypatch.setattr(main, "processor", MockBatchProcessor())
+
+    response = client.post("/get_vectors", json={"texts": ["a", "bbb", "cc"]})
+    assert response.status_code == 200
+    assert response.json()["vectors"] == [[1.0] * 3, [3.0] * 3, [2.0] * 3]
+
+
+def test_batcher_coalesces_concurrent_requests():
+    """
+    Test that concurrent submits share a single encoder call and get their own vectors back.
+    """
+    calls = []
+
+    def encode(texts):
+        calls.append(list(texts))
+        return [[float(len(t))] for t in texts]
+
+    batcher = MicroBatcher(encode, max_batch_size=8, max_wait_ms=50)
+
+    async def run():
+        return await asyncio.gather(*(batcher.submit("x" * n) for n in range(1, 6)))
+
+    results = asyncio.run(run())
+    assert results == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert len(calls) == 1
+    assert batcher.stats()["batches"] == 1
+
+
+def test_batcher_flushes_full_batches():
+    """
+    Test that a batch is flushed as soon as it reaches the maximum size.
+    """
+    calls = []
+
+    def encode(texts):
+        calls.append(len(texts))
+        return [[0.0] for _ in texts]
+
+    batcher = MicroBatcher(encode, max_batch_size=2, max_wait_ms=1000)
+
+    async def run():
+        return await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(str(n)) for n in range(4))), timeout=0.5)
+
+    asyncio.run(run())
+    assert calls == [2, 2]
+
+
+def test_get_vector_served_from_cache(monkeypatch):
+    """
+    Test that a repeated query, differing only in case and spacing, skips the model.
+    """
+    calls = []
+    original = main.model.get_text_features
+
+    def counting_get_text_features(**kwargs):
+        calls.append(kwargs)
+        return original(**kwargs)
+
+    monkeypatch.setattr(main.model, "get_text_features", counting_get_text_features)
+
+    first = client.post("/get_vector", json={"text": "Black leather  boots"})
+    second = client.post("/get_vector", json={"text": " black leather boots"})
+    assert first.json() == second.json()
+    assert len(calls) == 1
+
+    stats = client.get("/metrics").json()["embedding_cache"]
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def test_embedding_cache_ttl_and_lru():
+    """
+    Test that entries expire after the TTL and the least recently used entry is evicted first.
+    """
+    now = [1000.0]
+    cache = EmbeddingCache("model", max_entries=2, ttl_seconds=60, clock=lambda: now[0])
+    cache.put("a", [1.0])
+    cache.put("b", [2.0])
+    assert cache.get("a") == [1.0]
+    cache.put("c", [3.0])  # evicts "b", the least recently used
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
+
+    now[0] += 61
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+
+
+def test_embedding_cache_persistence(tmp_path):
+    """
+    Test that the cache survives a save/load round trip and ignores other models' entries.
+    """
+    path = str(tmp_path / "embeddings.npz")
+    cache = EmbeddingCache("model-a", path=path)
+    cache.put("red dress", [0.5, 0.25])
+    assert cache.save() == 1
+
+    restored = EmbeddingCache("model-a", path=path)
+    assert restored.load() == 1
+    assert restored.get("Red Dress") == [0.5, 0.25]
+
+    other_model = EmbeddingCache("model-b", path=path)
+    assert other_model.load() == 0
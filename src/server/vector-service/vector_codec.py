@@ -0,0 +1,25 @@
+import base64
+
+import numpy as np
+
+# Wire dtypes for vectors, always little-endian
+VECTOR_DTYPES = {"float32": "<f4", "float16": "<f2"}
+BINARY_MEDIA_TYPE = "application/octet-stream"
+
+
+def encode_vector(vector, dtype="float32"):
+    """Pack a vector into raw little-endian bytes."""
+    return np.asarray(vector, dtype=VECTOR_DTYPES[dtype]).tobytes()
+
+
+def decode_vector(data, dtype="float32"):
+    """Unpack raw little-endian bytes into a float32 array."""
+    return np.frombuffer(data, dtype=VECTOR_DTYPES[dtype]).astype(np.float32)
+
+
+def encode_vector_b64(vector, dtype="float32"):
+    return base64.b64encode(encode_vector(vector, dtype)).decode("ascii")
+
+
+def decode_vector_b64(data, dtype="float32"):
+    return decode_vector(base64.b64decode(data), dtype)
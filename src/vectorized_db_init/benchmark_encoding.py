@@ -0,0 +1,95 @@
+"""
+Compare image encoding throughput (images/sec) of:
+
+    threads  the original path: a 10-thread pool calling get_clip_vector once per image
+    batched  get_clip_image_vectors on fixed-size batches in this process
+    process  ProcessPoolImageEncoder with N worker processes fed through shared memory
+
+    python benchmark_encoding.py --images 512 --batch-size 32 --processes 2 4
+
+Images are synthetic JPEGs decoded the way get_image_data does, unless
+--image-dir points at a directory of real catalog images.
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+import numpy as np
+from PIL import Image
+
+from helper_functions import IMAGE_INPUT_SIZE, get_clip_image_vectors, get_clip_vector
+from process_encoder import ProcessPoolImageEncoder
+
+
+def load_images(count, image_dir=None, seed=0):
+    """Return `count` decoded RGB images, decoded at CLIP size like get_image_data."""
+    if image_dir:
+        paths = sorted(os.path.join(image_dir, name) for name in os.listdir(image_dir))
+        payloads = [open(path, "rb").read() for path in paths[:count]]
+    else:
+        rng = np.random.default_rng(seed)
+        payloads = []
+        for _ in range(min(count, 32)):
+            buffer = BytesIO()
+            pixels = rng.integers(0, 255, size=(600, 450, 3), dtype=np.uint8)
+            Image.fromarray(pixels).save(buffer, format="JPEG")
+            payloads.append(buffer.getvalue())
+    images = []
+    for i in range(count):
+        image = Image.open(BytesIO(payloads[i % len(payloads)]))
+        image.draft("RGB", (IMAGE_INPUT_SIZE, IMAGE_INPUT_SIZE))
+        images.append(image.convert("RGB"))
+    return images
+
+
+def batches(images, batch_size):
+    return [images[start:start + batch_size] for start in range(0, len(images), batch_size)]
+
+
+def bench_threads(images, workers=10):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda image: get_clip_vector(image, is_image=True), images))
+
+
+def bench_batched(images, batch_size):
+    for batch in batches(images, batch_size):
+        get_clip_image_vectors(batch)
+
+
+def bench_process(encoder, images, batch_size):
+    futures = [encoder.submit(batch) for batch in batches(images, batch_size)]
+    for future in futures:
+        future.result()
+
+
+def timed(label, run, count):
+    started = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - started
+    print(f"{label:<24}{count / elapsed:>12.1f} images/s{elapsed:>10.2f} s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CLIP image encoding strategies")
+    parser.add_argument("--images", type=int, default=256)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--processes", type=int, nargs="*", default=[2])
+    parser.add_argument("--torch-threads", type=int, default=None,
+                        help="Threads per worker process (default: cores / processes)")
+    parser.add_argument("--image-dir", default=None)
+    args = parser.parse_args()
+
+    images = load_images(args.images, args.image_dir)
+    # Warm up the in-process model
+    get_clip_image_vectors(images[:2])
+
+    timed("threads (10)", lambda: bench_threads(images), len(images))
+    timed(f"batched ({args.batch_size})", lambda: bench_batched(images, args.batch_size), len(images))
+    for processes in args.processes:
+        with ProcessPoolImageEncoder(num_workers=processes, torch_threads=args.torch_threads) as encoder:
+            # Start the workers and load their models outside the timed run
+            bench_process(encoder, images[:2 * processes], 1)
+            timed(f"process ({processes} x {encoder.torch_threads} threads)",
+                  lambda: bench_process(encoder, images, args.batch_size), len(images))
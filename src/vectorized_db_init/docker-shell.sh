@@ -10,6 +10,9 @@ export BASE_DIR=$(pwd)
 # Dynamically convert the relative path to an absolute path for the secrets directory
 export GOOGLE_CREDENTIALS_PATH=$(realpath "../../../secrets")
 export ENV_FILE_PATH=$(realpath "../server/.env") # Path to the .env file in the env folder
+# Mounted at /persistent, where the index manifest is kept between runs
+mkdir -p "../../../persistent-folder"
+export PERSISTENT_DIR=$(realpath "../../../persistent-folder")
 
 # Check if the credentials file exists in the directory
 if [ ! -f "$GOOGLE_CREDENTIALS_PATH/secret.json" ]; then
@@ -30,12 +33,13 @@ else
     CMD=""
 fi
 
-# Build the Docker image
-docker build -t $IMAGE_NAME -f Dockerfile .
+# Build the Docker image from src/, which also holds the modules shared with pinecone-service
+docker build -t $IMAGE_NAME -f Dockerfile ..
 
 # Run the Docker container
 docker run --rm --name "${IMAGE_NAME}-shell" -ti \
     --env-file "$ENV_FILE_PATH" \
     -v "$BASE_DIR":/app \
     -v "$GOOGLE_CREDENTIALS_PATH":/secrets \
+    -v "$PERSISTENT_DIR":/persistent \
     "$IMAGE_NAME" $CMD
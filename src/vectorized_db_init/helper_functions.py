@@ -1,4 +1,6 @@
 from transformers import CLIPProcessor, CLIPModel
+import numpy as np
+import torch
 import os
 
 MODEL_NAME = os.getenv("MODEL_NAME")
@@ -8,14 +10,28 @@ PROCESSOR_NAME = os.getenv("PROCESSOR_NAME")
 model = CLIPModel.from_pretrained(MODEL_NAME)
 processor = CLIPProcessor.from_pretrained(PROCESSOR_NAME)
 
+# Shortest image side CLIP resizes to before cropping; larger decodes are wasted work
+IMAGE_INPUT_SIZE = processor.image_processor.size.get("shortest_edge", 224)
+
 
 def get_clip_vector(input_data, is_image=False):
-    if is_image:
-        inputs = processor(images=input_data,
-                           return_tensors="pt", padding=True)
-        outputs = model.get_image_features(**inputs)
-    else:
-        inputs = processor(text=[input_data],
-                           return_tensors="pt", padding=True)
-        outputs = model.get_text_features(**inputs)
+    with torch.inference_mode():
+        if is_image:
+            inputs = processor(images=input_data,
+                               return_tensors="pt", padding=True)
+            outputs = model.get_image_features(**inputs)
+        else:
+            inputs = processor(text=[input_data],
+                               return_tensors="pt", padding=True)
+            outputs = model.get_text_features(**inputs)
     return outputs.detach().numpy().flatten()
+
+
+def get_clip_image_vectors(images):
+    """Encode a list of PIL images in one forward pass. Returns a (len(images), dim) float32 array."""
+    if not images:
+        return np.empty((0, model.config.projection_dim), dtype=np.float32)
+    with torch.inference_mode():
+        inputs = processor(images=images, return_tensors="pt")
+        outputs = model.get_image_features(**inputs)
+    return outputs.numpy().astype(np.float32, copy=False)
@@ -0,0 +1,207 @@
+"""
+Versioned on-disk export of the catalog embeddings.
+
+Each run writes a new version directory under the export root and then
+points the root's LATEST file at it:
+
+    <root>/LATEST                   name of the current version
+    <root>/<version>/vectors.npy    contiguous (count, dim) float32 or float16 matrix
+    <root>/<version>/ids.npy        record ids, row-aligned with vectors.npy
+    <root>/<version>/norms.npy      float32 row norms
+    <root>/<version>/metadata.parquet  Pinecone metadata fields, one row per record
+    <root>/<version>/metadata.jsonl    the same metadata, one JSON object per line
+    <root>/<version>/export.json    format version, model, dtype, dimension, count
+    <root>/<version>/quantizer.npz, codes.npy   optional fp16/int8/PQ codes (see quantization.py)
+
+Vectors are streamed to disk as records arrive, so the writer's memory does
+not grow with the catalog, and readers can memory-map the matrix without
+copying it. A version directory is also an index directory that
+pinecone-service serves with VECTOR_BACKEND=local.
+"""
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from quantization import make_quantizer, write_codes
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_DTYPES = ("float32", "float16")
+LATEST_FILE = "LATEST"
+INFO_FILE = "export.json"
+
+
+class LocalIndexWriter:
+    """
+    Collects the records upserted to Pinecone and writes them as a new
+    version of the embedding export at `path` (see module docstring).
+    """
+
+    def __init__(self, path, dtype="float32", version=None, model_name=None, quantization=None,
+                 pq_subspaces=64, chunk_rows=65536):
+        if dtype not in EXPORT_DTYPES:
+            raise ValueError(f"Unsupported export dtype: {dtype}")
+        # Validates the quantization kind up front rather than after a whole ingestion run
+        self.quantizer = make_quantizer(quantization, pq_subspaces=pq_subspaces) if quantization else None
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.version = version or time.strftime("%Y%m%d-%H%M%S")
+        self.model_name = model_name
+        self.chunk_rows = chunk_rows
+        self.ids = []
+        self.metadata = []
+        self.discarded_rows = set()
+        self.dimension = None
+        self._staging_dir = os.path.join(path, f".{self.version}.tmp")
+        self._raw_path = os.path.join(self._staging_dir, "vectors.raw")
+        self._raw_file = None
+        self._lock = threading.Lock()
+
+    def add(self, record_id, values, metadata):
+        vector = np.asarray(values, dtype=self.dtype).ravel()
+        with self._lock:
+            if self.dimension is None:
+                self.dimension = vector.shape[0]
+                os.makedirs(self._staging_dir, exist_ok=True)
+                self._raw_file = open(self._raw_path, "wb")
+            elif vector.shape[0] != self.dimension:
+                raise ValueError(f"Vector for {record_id} has dimension {vector.shape[0]}, expected {self.dimension}")
+            self._raw_file.write(vector.tobytes())
+            self.ids.append(record_id)
+            self.metadata.append(metadata)
+
+    def __len__(self):
+        return len(self.ids) - len(self.discarded_rows)
+
+    def discard(self, record_ids):
+        """
+        Leave the records added so far under `record_ids` out of the version,
+        e.g. those Pinecone did not accept. Records added later are kept.
+        """
+        record_ids = set(record_ids)
+        with self._lock:
+            self.discarded_rows.update(row for row, record_id in enumerate(self.ids) if record_id in record_ids)
+
+    def carry_over(self, keep_ids, version=None):
+        """
+        Add the records of a previous version (LATEST by default) whose ids are in
+        `keep_ids` and were not added in this run, so a run that only re-embedded
+        changed items still writes a complete version. Records of another model
+        are not carried over. Returns the number of records added.
+        """
+        try:
+            version_dir = resolve_export_version(self.path, version)
+            with open(os.path.join(version_dir, INFO_FILE)) as f:
+                info = json.load(f)
+        except FileNotFoundError:
+            return 0
+        if info.get("model") != self.model_name:
+            return 0
+        with self._lock:
+            added = {record_id for row, record_id in enumerate(self.ids) if row not in self.discarded_rows}
+        ids = np.load(os.path.join(version_dir, "ids.npy"))
+        vectors = np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r")
+        carried = 0
+        with open(os.path.join(version_dir, "metadata.jsonl")) as f:
+            for row, (record_id, line) in enumerate(zip(ids, f)):
+                record_id = str(record_id)
+                if record_id in added or record_id not in keep_ids:
+                    continue
+                self.add(record_id, vectors[row], json.loads(line))
+                carried += 1
+        return carried
+
+    def write(self):
+        """Write all collected records as a new version and make it LATEST. Returns the number of records written."""
+        with self._lock:
+            if not self.ids:
+                return 0
+            self._raw_file.close()
+            keep = np.array([row not in self.discarded_rows for row in range(len(self.ids))], dtype=bool)
+            ids = [record_id for record_id, kept in zip(self.ids, keep) if kept]
+            metadata = [item for item, kept in zip(self.metadata, keep) if kept]
+            count = len(ids)
+            if not count:
+                shutil.rmtree(self._staging_dir)
+                return 0
+            raw = np.memmap(self._raw_path, dtype=self.dtype, mode="r", shape=(len(self.ids), self.dimension))
+            vectors = np.lib.format.open_memmap(
+                os.path.join(self._staging_dir, "vectors.npy"), mode="w+", dtype=self.dtype,
+                shape=(count, self.dimension))
+            norms = np.empty(count, dtype=np.float32)
+            written = 0
+            for start in range(0, len(self.ids), self.chunk_rows):
+                chunk = raw[start:start + self.chunk_rows][keep[start:start + self.chunk_rows]]
+                vectors[written:written + len(chunk)] = chunk
+                norms[written:written + len(chunk)] = np.linalg.norm(chunk.astype(np.float32), axis=1)
+                written += len(chunk)
+            vectors.flush()
+            if self.quantizer is not None:
+                write_codes(self._staging_dir, vectors, self.quantizer, chunk_rows=self.chunk_rows)
+            del raw, vectors
+            os.remove(self._raw_path)
+
+            np.save(os.path.join(self._staging_dir, "ids.npy"), np.asarray(ids, dtype=str))
+            np.save(os.path.join(self._staging_dir, "norms.npy"), norms)
+            with open(os.path.join(self._staging_dir, "metadata.jsonl"), "w") as f:
+                for item in metadata:
+                    f.write(json.dumps(item, default=str) + "\n")
+            metadata_table = pd.DataFrame.from_records(metadata)
+            metadata_table.insert(0, "id", ids)
+            # CSV-derived fields can mix strings with numbers; store them as nullable strings
+            text_columns = [column for column, dtype in metadata_table.dtypes.items()
+                            if not pd.api.types.is_numeric_dtype(dtype)]
+            metadata_table = metadata_table.astype({column: "string" for column in text_columns})
+            metadata_table.to_parquet(os.path.join(self._staging_dir, "metadata.parquet"), index=False)
+            with open(os.path.join(self._staging_dir, INFO_FILE), "w") as f:
+                json.dump({
+                    "format_version": EXPORT_FORMAT_VERSION,
+                    "version": self.version,
+                    "model": self.model_name,
+                    "dtype": self.dtype.name,
+                    "dimension": self.dimension,
+                    "count": count,
+                    "quantization": self.quantizer.kind if self.quantizer is not None else None,
+                    "created_at": time.time(),
+                }, f, indent=2)
+
+            version_dir = os.path.join(self.path, self.version)
+            if os.path.exists(version_dir):
+                shutil.rmtree(version_dir)
+            os.replace(self._staging_dir, version_dir)
+            set_latest_version(self.path, self.version)
+            return count
+
+
+def set_latest_version(path, version):
+    tmp_path = os.path.join(path, f"{LATEST_FILE}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(version + "\n")
+    os.replace(tmp_path, os.path.join(path, LATEST_FILE))
+
+
+def resolve_export_version(path, version=None):
+    """Return the directory of `version`, or of the LATEST version, under the export root `path`."""
+    if version is None:
+        with open(os.path.join(path, LATEST_FILE)) as f:
+            version = f.read().strip()
+    return os.path.join(path, version)
+
+
+def load_embedding_export(path, version=None, columns=None):
+    """
+    Load an export version (LATEST by default) without copying the vectors.
+    Returns (ids, vectors, metadata, info): `vectors` is a read-only memory map,
+    `metadata` a DataFrame of the requested Parquet `columns` (all by default).
+    """
+    version_dir = resolve_export_version(path, version)
+    with open(os.path.join(version_dir, INFO_FILE)) as f:
+        info = json.load(f)
+    vectors = np.load(os.path.join(version_dir, "vectors.npy"), mmap_mode="r")
+    ids = np.load(os.path.join(version_dir, "ids.npy"), mmap_mode="r")
+    metadata = pd.read_parquet(os.path.join(version_dir, "metadata.parquet"), columns=columns)
+    return ids, vectors, metadata, info
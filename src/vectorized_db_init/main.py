@@ -1,14 +1,24 @@
-import re
+import numpy as np
 import pandas as pd
+import pyarrow.parquet as pq
 from io import BytesIO, StringIO
 from PIL import Image
 from tqdm import tqdm
+from collections import deque
 from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, nullcontext
+from google.api_core.exceptions import NotFound
 from google.cloud import storage, secretmanager
 from pinecone import Pinecone, ServerlessSpec
-from helper_functions import get_clip_vector
+from helper_functions import get_clip_image_vectors, IMAGE_INPUT_SIZE
+from local_index_export import LocalIndexWriter
+from upsert_writer import BatchedUpsertWriter
+from manifest import IndexManifest, item_content_hash
+from process_encoder import ProcessPoolImageEncoder
 import json
 import os 
+import threading
+import time
 
 # Initialize global constants
 PROJECT_ID = os.getenv("PROJECT_ID")
@@ -16,6 +26,44 @@ PINECONE_SECRET_NAME = os.getenv("PINECONE_SECRET_NAME")
 PINECONE_INDEX_NAME = os.getenv("PINECONE_INDEX_NAME")
 VECTOR_DIM_MODEL = os.getenv("VECTOR_DIM_MODEL")
 BASE_BUCKET = os.getenv("BASE_BUCKET")
+# When set, upserted vectors are also exported here as a new version (see local_index_export.py),
+# which pinecone-service's local backend can serve
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR")
+# float32, or float16 to halve the exported matrix
+EXPORT_DTYPE = os.getenv("EXPORT_DTYPE", "float32")
+# Optional compact codes written alongside the full-precision matrix: fp16, int8 or pq
+EXPORT_QUANTIZATION = os.getenv("EXPORT_QUANTIZATION") or None
+EXPORT_PQ_SUBSPACES = int(os.getenv("EXPORT_PQ_SUBSPACES", 64))
+# Manifest of already-embedded items; reruns only process new or changed items. It must outlive
+# the container, so it defaults to the persistent volume (see docker-shell.sh)
+INDEX_MANIFEST_PATH = os.getenv("INDEX_MANIFEST_PATH", "/persistent/index_manifest.jsonl")
+# Delete the vectors of items that disappeared from a topic since the last run
+PRUNE_DELETED_ITEMS = os.getenv("PRUNE_DELETED_ITEMS", "false").lower() == "true"
+# Images per CLIP forward pass when encoding a topic
+ENCODE_BATCH_SIZE = int(os.getenv("ENCODE_BATCH_SIZE", 32))
+# Global budgets when several topics are ingested at once (see ingest_topics);
+# upserts are bounded by the shared BatchedUpsertWriter's UPSERT_MAX_IN_FLIGHT
+MAX_CONCURRENT_TOPICS = int(os.getenv("MAX_CONCURRENT_TOPICS", 3))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 16))
+ENCODER_SLOTS = int(os.getenv("ENCODER_SLOTS", 1))
+# Embed each distinct image once: items whose image blobs have the same checksum (the scraper's
+# image store links every id of an image to the same bytes) reuse the first item's vector
+DEDUPE_IMAGES = os.getenv("DEDUPE_IMAGES", "true").lower() == "true"
+# Each run that changes the index records its version in this record, in a namespace of its own;
+# pinecone-service serves it as /index_version so the backend's result cache follows ingestion runs
+INDEX_VERSION_NAMESPACE = "index-version"
+INDEX_VERSION_ID = "index_version"
+
+# Pinecone metadata field -> metadata CSV column
+METADATA_COLUMNS = {
+    "image_name": "medias/0/alt",
+    "brand": "brand",
+    "gender": "categories/0",
+    "item_type": "categories/1",
+    "item_sub_type": "categories/2",
+    "image_url": "medias/0/url",
+    "item_url": "source/crawlUrl",
+}
 
 
 # Initialize global GCP storage client
@@ -44,6 +92,16 @@ def initialize_pinecone(index_name, vector_dim, api_key):
     return pc.Index(index_name)
 
 
+def record_index_version(pinecone_index, version, vector_dim):
+    """Store `version` as the metadata of the index version record (see INDEX_VERSION_NAMESPACE)."""
+    # Pinecone rejects all-zero vectors in a cosine index
+    values = [1.0] + [0.0] * (vector_dim - 1)
+    pinecone_index.upsert(
+        vectors=[{"id": INDEX_VERSION_ID, "values": values, "metadata": {"version": version}}],
+        namespace=INDEX_VERSION_NAMESPACE,
+    )
+
+
 def load_file_from_bucket(bucket_name, blob_name, file_type="json"):
     """Load a file from a GCP bucket."""
     bucket = storage_client.bucket(bucket_name)
@@ -66,103 +124,346 @@ def parse_metadata(metadata_text):
     return pd.read_csv(StringIO(metadata_text))
 
 
+def load_metadata_from_bucket(bucket_name, blob_name):
+    """
+    Load the metadata table under `blob_name` from a GCP bucket: the scraper's
+    Parquet seed if there is one, reading only the columns upserted to
+    Pinecone, otherwise the metadata CSV.
+    """
+    bucket = storage_client.bucket(bucket_name)
+    blobs = list(bucket.list_blobs(prefix=blob_name))
+    parquet_blob = next((blob for blob in blobs if blob.name.endswith(".parquet")), None)
+    if parquet_blob is None:
+        return parse_metadata(load_file_from_bucket(bucket_name, blob_name, file_type="csv"))
+
+    print(f"Reading file: {parquet_blob.name} from bucket: {bucket_name}")
+    source = BytesIO(parquet_blob.download_as_bytes())
+    available = pq.read_schema(source).names
+    columns = [column for column in ("source/id", *METADATA_COLUMNS.values()) if column in available]
+    return pd.read_parquet(source, columns=columns)
+
+
+def list_blob_hashes(bucket_name, prefix):
+    """Map blob name -> content checksum for every blob under `prefix`, from a single listing."""
+    bucket = storage_client.bucket(bucket_name)
+    return {
+        blob.name: blob.md5_hash or blob.crc32c or str(blob.generation)
+        for blob in bucket.list_blobs(prefix=prefix)
+    }
+
+
 def get_image_data(bucket_name, blob_path):
-    """Download image data from a GCP bucket."""
+    """
+    Download image data from a GCP bucket in a single request (a missing blob raises NotFound).
+    JPEGs are decoded at the smallest scale that still covers CLIP's input size.
+    """
     bucket = storage_client.bucket(bucket_name)
     image_blob = bucket.blob(blob_path)
-    if not image_blob.exists():
+    try:
+        image_bytes = image_blob.download_as_bytes()
+    except NotFound:
         raise FileNotFoundError(f"Image not found in bucket: {blob_path}")
-    return Image.open(BytesIO(image_blob.download_as_bytes())).convert("RGB")
+    image = Image.open(BytesIO(image_bytes))
+    image.draft("RGB", (IMAGE_INPUT_SIZE, IMAGE_INPUT_SIZE))
+    return image.convert("RGB")
 
 
 # Processing Functions
 
-def process_image_metadata(caption_entry, metadata_df, topic, data_name, image_bucket, pinecone_index):
-    """Process and upload an image and its metadata to Pinecone."""
-    image_name = caption_entry["image"]
-    caption = caption_entry["caption"]
+def build_metadata_index(metadata_df):
+    """
+    Index the metadata by integer "source/id", keeping only the columns upserted
+    to Pinecone (renamed to their Pinecone field names; missing columns become "").
+    Rows with duplicate ids keep the first occurrence.
+    """
+    fields = pd.DataFrame(
+        {field: metadata_df[column] if column in metadata_df else "" for field, column in METADATA_COLUMNS.items()},
+        index=metadata_df.index,
+    )
+    fields.index = pd.to_numeric(metadata_df["source/id"], errors="coerce")
+    fields = fields[fields.index.notna()]
+    duplicated = fields.index.duplicated(keep="first")
+    if duplicated.any():
+        print(f"Ignoring {duplicated.sum()} metadata rows with duplicate ids")
+        fields = fields[~duplicated]
+    fields.index = fields.index.astype("int64")
+    fields.index.name = "source/id"
+    return fields
+
+
+def join_captions_with_metadata(caption_data, metadata_index):
+    """
+    Match caption entries to their metadata in one vectorized join.
+    Returns a list of (caption_entry, metadata fields) pairs; entries without metadata are dropped.
+    """
+    if not caption_data:
+        return []
+    image_names = pd.Series([entry["image"] for entry in caption_data], dtype=str)
+    image_ids = pd.to_numeric(image_names.str.extract(r"(\d+)", expand=False), errors="coerce")
+    matched = image_ids.isin(metadata_index.index).to_numpy()
+
+    for image_name in image_names[~matched]:
+        print(f"No metadata found for image: {image_name}")
 
-    # Find metadata entry
-    image_id = int(re.search(r'\d+', image_name).group())
-    metadata_entry = metadata_df.loc[metadata_df["source/id"] == image_id]
+    rows = metadata_index.loc[image_ids[matched].astype("int64")].to_dict("records")
+    entries = [caption_data[position] for position in np.flatnonzero(matched)]
+    return list(zip(entries, rows))
 
-    if metadata_entry.empty:
-        print(f"No metadata found for image: {image_name}")
-        return None
 
-    # Extract metadata fields
+def build_record(caption_entry, metadata, topic):
+    """Build the record of a caption entry from its joined metadata fields, without "values"."""
+    # Prepare metadata for Pinecone
+    pinecone_metadata = dict(metadata, caption=caption_entry["caption"])
+
+    return {
+        "id": f"{topic} {caption_entry['image']}",
+        "metadata": pinecone_metadata
+    }
+
 
-    # Convert to a series for easy access
-    metadata_entry = metadata_entry.iloc[0]
-    brand = metadata_entry.get("brand", "")
-    image_url = metadata_entry.get("medias/0/url", "")
-    gender = metadata_entry.get("categories/0", "")
-    item_type = metadata_entry.get("categories/1", "")
-    item_sub_type = metadata_entry.get("categories/2", "")
-    item_url = metadata_entry.get("source/crawlUrl", "")
-    image_description = metadata_entry.get("medias/0/alt", "")
+def prepare_image_record(caption_entry, metadata, topic, data_name, image_bucket):
+    """
+    Download an image and build its record from the joined metadata fields.
+    Returns (record, image) where the record has no "values" yet, or None if the image is missing.
+    """
+    image_name = caption_entry["image"]
 
-    # Get image data and generate vector
+    # Get image data
     image_path = f"scrapped_data/{topic}/{data_name}{image_name}"
     try:
         image = get_image_data(image_bucket, image_path)
-        vector = get_clip_vector(image, is_image=True)
     except FileNotFoundError:
         print(f"Image not found: {image_name}")
         return None
 
-    # Prepare metadata for Pinecone
-    pinecone_metadata = {
-        "image_name": image_description,
-        "brand": brand,
-        "gender": gender,
-        "item_type": item_type,
-        "item_sub_type": item_sub_type,
-        "image_url": image_url,
-        "caption": caption,
-        "item_url": item_url
+    return build_record(caption_entry, metadata, topic), image
+
+
+def upload_record(record, vector, pinecone_index, local_writer=None):
+    """Upload a record with its vector to Pinecone (and the local index writer, if given)."""
+    record = {"id": record["id"], "values": vector.tolist(), "metadata": record["metadata"]}
+    pinecone_index.upsert([record])
+    if local_writer is not None:
+        local_writer.add(record["id"], record["values"], record["metadata"])
+
+
+def iter_prepared(prepare, entries, executor, max_pending):
+    """
+    Yield prepare(entry) for each entry, in order, running up to `max_pending`
+    calls ahead on `executor` so downloads overlap with the consumer's work
+    without buffering the whole topic in memory.
+    """
+    pending = deque()
+    for entry in entries:
+        pending.append(executor.submit(prepare, entry))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def group_duplicate_images(joined, image_hashes, image_prefix, topic):
+    """
+    Keep the first of the joined items sharing an image checksum (from `image_hashes`,
+    blob name -> checksum). Returns (unique items, {record id of a kept item: [its duplicate
+    (caption_entry, metadata) pairs]}). Items without a known checksum are always kept.
+    """
+    unique = []
+    duplicates = {}
+    first_by_hash = {}
+    for entry, metadata in joined:
+        image_hash = image_hashes.get(f"{image_prefix}{entry['image']}")
+        first = first_by_hash.setdefault(image_hash, entry) if image_hash is not None else entry
+        if first is entry:
+            unique.append((entry, metadata))
+        else:
+            duplicates.setdefault(f"{topic} {first['image']}", []).append((entry, metadata))
+    return unique, duplicates
+
+
+def select_changed_items(joined, topic, data_name, image_bucket, manifest, pinecone_index, prune=False,
+                         image_hashes=None):
+    """
+    Drop the items the manifest records as already upserted from identical content.
+    Returns (changed items, content hash per record id). With `prune`, vectors of
+    items the manifest knows for this topic but that no longer exist are deleted.
+    `image_hashes` is the listing of the topic's image blobs, when already made.
+    """
+    image_prefix = f"scrapped_data/{topic}/{data_name}"
+    if image_hashes is None:
+        image_hashes = list_blob_hashes(image_bucket, image_prefix)
+    content_hashes = {
+        f"{topic} {entry['image']}": item_content_hash(
+            entry, metadata, image_hashes.get(f"{image_prefix}{entry['image']}"))
+        for entry, metadata in joined
     }
-
-    # Upload to Pinecone
-    pinecone_index.upsert([
-        {
-            "id": f"{topic} {image_name}",
-            "values": vector.tolist(),
-            "metadata": pinecone_metadata
-        }
-    ])
-    return image_name
-
-
-def process_and_upload_topic_parallel(topic, base_bucket, pinecone_index, data_name, max_workers=10):
-    """Process and upload data for a specific topic in parallel."""
+    changed = [
+        (entry, metadata) for entry, metadata in joined
+        if not manifest.is_current(f"{topic} {entry['image']}", content_hashes[f"{topic} {entry['image']}"])
+    ]
+    print(f"{len(joined) - len(changed)} items unchanged since the last run for topic: {topic}")
+
+    if prune:
+        vanished = sorted(manifest.ids_with_prefix(f"{topic} ") - set(content_hashes))
+        if vanished:
+            pinecone_index.delete(ids=vanished)
+            manifest.remove(vanished)
+            print(f"Deleted {len(vanished)} vectors no longer in topic: {topic}")
+    return changed, content_hashes
+
+
+def process_and_upload_topic_parallel(topic, base_bucket, pinecone_index, data_name, max_workers=10,
+                                      local_writer=None, encode_batch_size=None, manifest=None,
+                                      prune=False, executor=None, encoder_slots=None, progress_position=None,
+                                      encoder=None, dedupe=None):
+    """
+    Process and upload data for a specific topic. Returns the number of items uploaded.
+    `max_workers` threads download images while the calling thread encodes
+    them with CLIP in batches of `encode_batch_size` and uploads the records.
+    With a `manifest`, items already upserted from the same content are skipped
+    and uploaded items are recorded in it (see manifest.IndexManifest).
+    `executor` and `encoder_slots` (a semaphore around each CLIP batch) let
+    concurrent topics share download threads and the model. With an `encoder`
+    (a process_encoder.ProcessPoolImageEncoder) CLIP runs in worker processes instead.
+    With `dedupe` (DEDUPE_IMAGES by default), items with identical image blobs
+    are downloaded and encoded once and upserted with the same vector.
+    """
     caption_path = f"captioned_data/{topic}/{data_name}"
     metadata_path = f"metadata/{topic}/{data_name}"
     image_bucket = base_bucket
+    encode_batch_size = encode_batch_size or ENCODE_BATCH_SIZE
+    dedupe = DEDUPE_IMAGES if dedupe is None else dedupe
 
     # Load captions and metadata
     caption_data = load_file_from_bucket(
         base_bucket, caption_path, file_type="json")
-    metadata_text = load_file_from_bucket(
-        base_bucket, metadata_path, file_type="csv")
-    metadata_df = parse_metadata(metadata_text)
+    metadata_df = load_metadata_from_bucket(base_bucket, metadata_path)
+
+    # Match every caption to its metadata up front, so only matched items are downloaded
+    joined = join_captions_with_metadata(caption_data, build_metadata_index(metadata_df))
+    image_prefix = f"scrapped_data/{topic}/{data_name}"
+    image_hashes = list_blob_hashes(image_bucket, image_prefix) if manifest is not None or dedupe else None
+    if manifest is not None:
+        joined, content_hashes = select_changed_items(
+            joined, topic, data_name, image_bucket, manifest, pinecone_index, prune=prune,
+            image_hashes=image_hashes)
+        # A BatchedUpsertWriter commits items once their batch is confirmed (see __main__)
+        commit_on_upload = not isinstance(pinecone_index, BatchedUpsertWriter)
+    duplicates = {}
+    if dedupe:
+        joined, duplicates = group_duplicate_images(joined, image_hashes, image_prefix, topic)
+        print(f"{sum(map(len, duplicates.values()))} items reuse the image of another item for topic: {topic}")
 
     uploaded_items = []
+    batch = []
+
+    def prepare_entry(joined_entry):
+        """Download the image for a single matched caption entry."""
+        caption_entry, metadata = joined_entry
+        return prepare_image_record(caption_entry, metadata, topic, data_name, image_bucket)
+
+    # Batches handed to `encoder` whose vectors have not been uploaded yet, oldest first
+    encoding = deque()
+
+    def upload_batch(batch, vectors):
+        for (record, _), vector in zip(batch, vectors):
+            # Duplicates of the image are uploaded with the same vector and their own metadata
+            records = [record] + [build_record(entry, metadata, topic)
+                                  for entry, metadata in duplicates.get(record["id"], ())]
+            for record in records:
+                if manifest is not None:
+                    manifest.stage(record["id"], content_hashes[record["id"]])
+                upload_record(record, vector, pinecone_index, local_writer)
+                if manifest is not None and commit_on_upload:
+                    manifest.commit([record["id"]])
+                uploaded_items.append(record["id"])
+
+    def upload_encoded(keep):
+        while len(encoding) > keep:
+            batch, vectors = encoding.popleft()
+            upload_batch(batch, vectors.result())
+
+    def encode_and_upload(batch):
+        images = [image for _, image in batch]
+        if encoder is None:
+            with encoder_slots or nullcontext():
+                vectors = get_clip_image_vectors(images)
+            upload_batch(batch, vectors)
+            return
+        # Keep up to max_in_flight batches encoding in the worker processes while downloads continue
+        encoding.append((batch, encoder.submit(images)))
+        upload_encoded(keep=encoder.max_in_flight - 1)
+
+    # Downloads run on the thread pool; a single encoder (this thread, or the encoder's
+    # worker processes) consumes full batches
+    with ExitStack() as stack:
+        if executor is None:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+        prepared_items = iter_prepared(
+            prepare_entry, joined, executor, max_pending=max_workers + 2 * encode_batch_size)
+        for prepared in tqdm(prepared_items, total=len(joined), desc=f"Processing {topic}",
+                             position=progress_position):
+            if prepared is None:
+                continue
+            batch.append(prepared)
+            if len(batch) == encode_batch_size:
+                encode_and_upload(batch)
+                batch = []
+        if batch:
+            encode_and_upload(batch)
+        upload_encoded(keep=0)
 
-    def process_entry(caption_entry):
-        """Process a single caption entry."""
-        return process_image_metadata(
-            caption_entry, metadata_df, topic, data_name, image_bucket, pinecone_index
-        )
-
-    # Parallelize processing with ThreadPoolExecutor
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(tqdm(executor.map(process_entry, caption_data), total=len(
-            caption_data), desc=f"Processing {topic}"))
-
-    # Collect successful uploads
-    uploaded_items = [item for item in results if item]
     print(f"Uploaded {len(uploaded_items)} items for topic: {topic}")
+    return len(uploaded_items)
+
+
+def ingest_topics(topics, base_bucket, pinecone_index, max_concurrent_topics=None, download_workers=None,
+                  encoder_slots=None, **topic_kwargs):
+    """
+    Ingest several (topic, data_name) pairs concurrently under global budgets:
+    at most `max_concurrent_topics` topics at a time, `download_workers` image
+    downloads shared by all of them and `encoder_slots` concurrent CLIP batches.
+    Returns one summary per topic (items, seconds, items_per_second, error).
+    """
+    max_concurrent_topics = max_concurrent_topics or MAX_CONCURRENT_TOPICS
+    download_workers = download_workers or DOWNLOAD_WORKERS
+    encoder_semaphore = threading.BoundedSemaphore(encoder_slots or ENCODER_SLOTS)
+
+    with ThreadPoolExecutor(max_workers=download_workers, thread_name_prefix="download") as download_executor, \
+            ThreadPoolExecutor(max_workers=max_concurrent_topics, thread_name_prefix="topic") as topic_executor:
+
+        def run_topic(position, topic, data_name):
+            started = time.perf_counter()
+            summary = {"topic": topic, "items": 0, "error": None}
+            try:
+                summary["items"] = process_and_upload_topic_parallel(
+                    topic, base_bucket, pinecone_index, data_name, max_workers=download_workers,
+                    executor=download_executor, encoder_slots=encoder_semaphore, progress_position=position,
+                    **topic_kwargs
+                )
+            except Exception as e:
+                # One failing topic should not stop the others
+                print(f"Topic {topic} failed: {e}")
+                summary["error"] = str(e)
+            summary["seconds"] = time.perf_counter() - started
+            summary["items_per_second"] = summary["items"] / summary["seconds"] if summary["seconds"] else 0.0
+            return summary
+
+        futures = [
+            topic_executor.submit(run_topic, position, topic, data_name)
+            for position, (topic, data_name) in enumerate(topics)
+        ]
+        return [future.result() for future in futures]
+
+
+def print_ingest_summary(summaries, elapsed):
+    """Print per-topic and overall ingestion throughput."""
+    print(f"{'topic':<24}{'items':>10}{'seconds':>10}{'items/s':>10}  error")
+    for summary in summaries:
+        print(f"{summary['topic']:<24}{summary['items']:>10}{summary['seconds']:>10.1f}"
+              f"{summary['items_per_second']:>10.1f}  {summary['error'] or ''}")
+    total_items = sum(summary["items"] for summary in summaries)
+    print(f"{'total':<24}{total_items:>10}{elapsed:>10.1f}{total_items / elapsed if elapsed else 0.0:>10.1f}")
 
 
 # Main Execution
@@ -171,13 +472,50 @@ if __name__ == "__main__":
     pinecone_api_key = get_pinecone_api_key(PINECONE_SECRET_NAME)
     pinecone_index = initialize_pinecone(
         PINECONE_INDEX_NAME, int(VECTOR_DIM_MODEL), pinecone_api_key)
+    # Names this run's local index version and the index version pinecone-service reports
+    run_version = time.strftime("%Y%m%d-%H%M%S")
+    manifest = IndexManifest(INDEX_MANIFEST_PATH, model_version=os.getenv("MODEL_NAME"))
+    print(f"Manifest {INDEX_MANIFEST_PATH} records {manifest.load()} indexed items")
+
+    # Records are buffered and upserted in concurrent batches instead of one request per image;
+    # the manifest records each batch once Pinecone accepts it, so a crashed run resumes from there
+    upsert_writer = BatchedUpsertWriter.from_env(pinecone_index, on_upserted=manifest.commit)
+
+    local_writer = LocalIndexWriter(
+        LOCAL_INDEX_DIR, dtype=EXPORT_DTYPE, version=run_version, model_name=os.getenv("MODEL_NAME"),
+        quantization=EXPORT_QUANTIZATION, pq_subspaces=EXPORT_PQ_SUBSPACES) if LOCAL_INDEX_DIR else None
+    # ENCODER_PROCESSES > 0 moves CLIP preprocessing and inference into worker processes
+    encoder = ProcessPoolImageEncoder.from_env()
 
     # Load topics from CSV
     data_buckets = pd.read_csv("data_buckets.csv")
-
-    for _, row in data_buckets.iterrows():
-        topic = row["bucket"]
-        data_name = row["name"]
-        print(f"Processing topic: {topic}")
-        process_and_upload_topic_parallel(
-            topic, BASE_BUCKET, pinecone_index, data_name)
+    topics = [(row["bucket"], row["name"]) for _, row in data_buckets.iterrows()]
+
+    # Topics run concurrently, sharing the download threads, the encoder and the upsert writer
+    started = time.perf_counter()
+    summaries = ingest_topics(
+        topics, BASE_BUCKET, upsert_writer, local_writer=local_writer,
+        manifest=manifest, prune=PRUNE_DELETED_ITEMS, encoder=encoder)
+    if encoder is not None:
+        encoder.close()
+    upsert_writer.flush()
+    print_ingest_summary(summaries, time.perf_counter() - started)
+    print(f"Upsert stats: {upsert_writer.stats()}")
+
+    upsert_writer.close()
+    manifest.compact()
+    if sum(summary["items"] for summary in summaries) or PRUNE_DELETED_ITEMS:
+        record_index_version(pinecone_index, run_version, int(VECTOR_DIM_MODEL))
+        print(f"Recorded index version {run_version}")
+    if upsert_writer.failed_ids:
+        print(f"{len(upsert_writer.failed_ids)} records failed to upsert; last error: {upsert_writer.last_error}")
+
+    if local_writer is not None:
+        # Pinecone keeps its previous vector (if any) for records it did not accept, and so does the
+        # export: their new vectors are dropped and the manifest, which never committed them, carries the old ones
+        local_writer.discard(upsert_writer.failed_ids)
+        # Items skipped as unchanged come from the previous version; pruned ones are no longer in the manifest
+        carried = local_writer.carry_over(manifest.ids_with_prefix(""))
+        print(f"Carried {carried} unchanged vectors over from the previous local index version")
+        written = local_writer.write()
+        print(f"Wrote {written} vectors to local index: {LOCAL_INDEX_DIR}/{local_writer.version}")
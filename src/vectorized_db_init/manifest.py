@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def item_content_hash(caption_entry, metadata, image_hash):
+    """
+    Hash everything a record is built from: the caption, the Pinecone metadata
+    fields and the image blob's checksum (so the image itself need not be downloaded).
+    """
+    payload = json.dumps(
+        {"caption": caption_entry.get("caption"), "metadata": metadata, "image": image_hash},
+        sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class IndexManifest:
+    """
+    Persisted record of the items already embedded and upserted, so reruns of
+    vectorized_db_init only process new or changed items.
+
+    The manifest is an append-only JSON lines journal: every confirmed upsert
+    appends {"id", "hash", "model", "embedded_at"} and every deletion appends
+    {"id", "deleted": true}, so a run that crashes mid-topic resumes after the
+    last confirmed batch. `compact()` rewrites the journal with one line per item.
+
+    Items are `stage()`d with their content hash before they are upserted and
+    `commit()`ted once the upsert is confirmed; only committed items are skipped.
+    """
+
+    def __init__(self, path, model_version, clock=time.time):
+        self.path = path
+        self.model_version = model_version
+        self.clock = clock
+        self.entries = {}
+        self._staged = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def load(self):
+        """Read the journal at `path`. Returns the number of items it records."""
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A crash can leave the last line half-written
+                        continue
+                    if entry.get("deleted"):
+                        self.entries.pop(entry["id"], None)
+                    else:
+                        self.entries[entry["id"]] = entry
+        return len(self.entries)
+
+    def is_current(self, item_id, content_hash):
+        """Whether `item_id` was upserted from the same content with the same model."""
+        entry = self.entries.get(item_id)
+        return entry is not None and entry["hash"] == content_hash and entry["model"] == self.model_version
+
+    def ids_with_prefix(self, prefix):
+        return {item_id for item_id in self.entries if item_id.startswith(prefix)}
+
+    def stage(self, item_id, content_hash):
+        with self._lock:
+            self._staged[item_id] = content_hash
+
+    def commit(self, item_ids):
+        """Record the staged items in `item_ids` as upserted."""
+        now = self.clock()
+        with self._lock:
+            lines = []
+            for item_id in item_ids:
+                content_hash = self._staged.pop(item_id, None)
+                if content_hash is None:
+                    continue
+                entry = {"id": item_id, "hash": content_hash, "model": self.model_version, "embedded_at": now}
+                self.entries[item_id] = entry
+                lines.append(json.dumps(entry))
+            self._append(lines)
+
+    def remove(self, item_ids):
+        with self._lock:
+            lines = []
+            for item_id in item_ids:
+                if self.entries.pop(item_id, None) is not None:
+                    lines.append(json.dumps({"id": item_id, "deleted": True}))
+            self._append(lines)
+
+    def _append(self, lines):
+        if not lines:
+            return
+        if self._file is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # Terminate a line left half-written by a crash before appending after it
+            needs_newline = False
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    needs_newline = f.read(1) != b"\n"
+            self._file = open(self.path, "a")
+            if needs_newline:
+                self._file.write("\n")
+        self._file.write("\n".join(lines) + "\n")
+        self._file.flush()
+
+    def compact(self):
+        """Rewrite the journal atomically with one line per current item."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,105 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+
+def _init_worker(torch_threads):
+    import torch
+    torch.set_num_threads(torch_threads)
+    # Importing helper_functions loads the CLIP model, once per worker process
+    import helper_functions  # noqa: F401
+
+
+def _encode_shared(shm_name, shapes):
+    """Worker: rebuild the batch's images from shared memory and encode them."""
+    from helper_functions import get_clip_image_vectors
+
+    # Workers share the parent's resource tracker, so attaching here does not take ownership;
+    # the parent unlinks the block once this batch completes
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        images, offset = [], 0
+        for shape in shapes:
+            pixels = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+            images.append(Image.fromarray(pixels.copy()))
+            offset += pixels.nbytes
+            del pixels
+    finally:
+        shm.close()
+    return get_clip_image_vectors(images)
+
+
+class ProcessPoolImageEncoder:
+    """
+    Encodes image batches in `num_workers` processes, each with its own copy of
+    the CLIP model and `torch_threads` intra-op threads, so preprocessing and
+    inference are not serialized on the ingesting process's GIL.
+
+    `submit(images)` copies the batch's pixels into a shared memory block (only
+    its name and the image shapes are pickled) and returns a future of the
+    (len(images), dim) vectors. At most `max_in_flight` batches are queued;
+    further submits block until one completes.
+    """
+
+    def __init__(self, num_workers=2, torch_threads=None, max_in_flight=None, mp_context="spawn"):
+        self.num_workers = num_workers
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // num_workers)
+        self.max_in_flight = max_in_flight or 2 * num_workers
+        self._slots = threading.BoundedSemaphore(self.max_in_flight)
+        self._executor = ProcessPoolExecutor(
+            max_workers=num_workers,
+            mp_context=multiprocessing.get_context(mp_context),
+            initializer=_init_worker,
+            initargs=(self.torch_threads,),
+        )
+
+    @classmethod
+    def from_env(cls):
+        """ENCODER_PROCESSES workers (None when unset or 0) with ENCODER_TORCH_THREADS threads each."""
+        num_workers = int(os.getenv("ENCODER_PROCESSES", 0))
+        if not num_workers:
+            return None
+        torch_threads = int(os.getenv("ENCODER_TORCH_THREADS", 0)) or None
+        return cls(num_workers=num_workers, torch_threads=torch_threads)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def submit(self, images):
+        arrays = [np.asarray(image.convert("RGB"), dtype=np.uint8) for image in images]
+        shm = shared_memory.SharedMemory(create=True, size=max(1, sum(array.nbytes for array in arrays)))
+        offset = 0
+        for array in arrays:
+            view = np.ndarray(array.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+            view[...] = array
+            offset += array.nbytes
+            del view
+
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(_encode_shared, shm.name, [array.shape for array in arrays])
+        except Exception:
+            self._release(shm)
+            raise
+        future.add_done_callback(lambda _: self._release(shm))
+        return future
+
+    def encode(self, images):
+        """Encode one batch and wait for the result, like get_clip_image_vectors."""
+        return self.submit(images).result()
+
+    def _release(self, shm):
+        shm.close()
+        shm.unlink()
+        self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=True)
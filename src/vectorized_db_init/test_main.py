@@ -1,20 +1,36 @@
-from unittest.mock import Mock
 import os
 import pytest
+import numpy as np
 import pandas as pd
 from unittest.mock import MagicMock, patch
-from io import BytesIO, StringIO
+from io import BytesIO
 from PIL import Image
+from google.api_core.exceptions import NotFound
 import json
+import re
+import threading
+import time
 from main import (
     get_pinecone_api_key,
     initialize_pinecone,
+    record_index_version,
+    INDEX_VERSION_ID,
+    INDEX_VERSION_NAMESPACE,
     load_file_from_bucket,
+    load_metadata_from_bucket,
     parse_metadata,
     get_image_data,
-    process_image_metadata,
-    process_and_upload_topic_parallel
+    build_metadata_index,
+    join_captions_with_metadata,
+    process_and_upload_topic_parallel,
+    ingest_topics
 )
+from local_index_export import LocalIndexWriter, load_embedding_export
+from upsert_writer import BatchedUpsertWriter
+from helper_functions import get_clip_vector, get_clip_image_vectors
+from manifest import IndexManifest
+from process_encoder import ProcessPoolImageEncoder
+from quantization import load_quantizer
 
 # Mock environment variables
 os.environ["PROJECT_ID"] = "fashion-ai"
@@ -33,7 +49,9 @@ MOCK_API_KEY = "mock_pinecone_key"
 
 @pytest.fixture
 def mock_storage_client():
-    with patch("main.storage.Client") as mock_client:
+    # main creates its storage client at import time, so patch that instance too
+    with patch("main.storage.Client") as mock_client, \
+            patch("main.storage_client", mock_client.return_value):
         yield mock_client
 
 
@@ -48,6 +66,38 @@ def mock_pinecone():
     with patch("main.Pinecone") as mock_pinecone:
         yield mock_pinecone
 
+
+def make_blob(name, text=None, md5_hash=None):
+    blob = MagicMock()
+    blob.name = name
+    blob.download_as_text.return_value = text
+    blob.md5_hash = md5_hash
+    return blob
+
+
+@pytest.fixture
+def topic_bucket(mock_storage_client):
+    """
+    Serve one topic from the mocked bucket: a captions JSON and a metadata CSV
+    for the items of `captions` ({item number: caption}), and an image blob
+    with each checksum of `image_md5` ({item number: md5}). Both are read on
+    every listing, so tests can change them between runs. Items in
+    `missing_metadata` get no metadata row.
+    """
+    def serve(captions, image_md5=None, missing_metadata=()):
+        def list_blobs(prefix):
+            if prefix.startswith("captioned_data"):
+                data = [{"image": f"{i}.jpg", "caption": caption} for i, caption in captions.items()]
+                return [make_blob(f"{prefix}captions.json", json.dumps(data))]
+            if prefix.startswith("metadata"):
+                text = "source/id,brand\n" + "\n".join(f"{i},Brand {i}" for i in captions if i not in missing_metadata)
+                return [make_blob(f"{prefix}metadata.csv", text)]
+            return [make_blob(f"{prefix}{i}.jpg", md5_hash=md5)
+                    for i, md5 in (image_md5 or {}).items() if i in captions]
+
+        mock_storage_client.return_value.bucket.return_value.list_blobs.side_effect = list_blobs
+    return serve
+
 # Test cases
 
 
@@ -70,6 +120,18 @@ def test_initialize_pinecone(mock_pinecone):
     assert index == mock_index
 
 
+def test_record_index_version():
+    """Test that the run's version is stored outside the namespace searches query."""
+    mock_index = MagicMock()
+    record_index_version(mock_index, "20241201-120000", VECTOR_DIM)
+    kwargs = mock_index.upsert.call_args.kwargs
+    assert kwargs["namespace"] == INDEX_VERSION_NAMESPACE
+    (record,) = kwargs["vectors"]
+    assert record["id"] == INDEX_VERSION_ID
+    assert record["metadata"] == {"version": "20241201-120000"}
+    assert len(record["values"]) == VECTOR_DIM and any(record["values"])
+
+
 def test_load_file_from_bucket(mock_storage_client):
     """Test loading a file from GCP bucket."""
     mock_blob = MagicMock()
@@ -83,6 +145,29 @@ def test_load_file_from_bucket(mock_storage_client):
     assert result == {"key": "value"}
 
 
+def test_load_metadata_from_bucket_prefers_parquet(mock_storage_client):
+    """Test that a Parquet seed is read with only the Pinecone metadata columns."""
+    seed = BytesIO()
+    pd.DataFrame({
+        "source/id": ["1", "2"], "brand": ["Brand 1", None], "categories/0": ["men", "men"],
+        "description": ["long text", "long text"],
+    }).to_parquet(seed, index=False)
+    mock_csv = MagicMock()
+    mock_csv.name = "metadata/topic/data/metadata.csv"
+    mock_parquet = MagicMock()
+    mock_parquet.name = "metadata/topic/data/metadata.parquet"
+    mock_parquet.download_as_bytes.return_value = seed.getvalue()
+    mock_storage_client.return_value.bucket.return_value.list_blobs.return_value = [mock_csv, mock_parquet]
+
+    metadata_df = load_metadata_from_bucket(BASE_BUCKET, "metadata/topic/data")
+    assert list(metadata_df.columns) == ["source/id", "brand", "categories/0"]
+    mock_csv.download_as_text.assert_not_called()
+
+    fields = build_metadata_index(metadata_df)
+    assert fields.loc[1, "brand"] == "Brand 1"
+    assert fields.loc[2, "gender"] == "men"
+
+
 def test_parse_metadata():
     """Test parsing metadata CSV."""
     csv_content = "source/id,brand,medias/0/url\n1,Brand A,https://example.com/image.jpg"
@@ -95,7 +180,6 @@ def test_parse_metadata():
 def test_get_image_data(mock_storage_client):
     """Test downloading image data from GCP bucket."""
     mock_blob = MagicMock()
-    mock_blob.exists.return_value = True  # Simulate the image exists in the bucket
     mock_blob.download_as_bytes.return_value = BytesIO(
         b"fake_image_data").getvalue()
     mock_bucket = MagicMock()
@@ -108,39 +192,17 @@ def test_get_image_data(mock_storage_client):
         assert result.mode == "RGB"
 
 
-def test_process_image_metadata(mock_pinecone):
-    """Test processing and uploading image metadata to Pinecone."""
-    caption_entry = {"image": "1.jpg", "caption": "A great image"}
-    metadata_df = pd.DataFrame([
-        {"source/id": 1, "brand": "Brand A",
-            "medias/0/url": "https://example.com/image.jpg"}
-    ])
-    mock_index = MagicMock()
-    mock_pinecone.return_value.Index.return_value = mock_index
-
-    with patch("main.get_image_data") as mock_get_image, \
-            patch("main.get_clip_vector") as mock_get_vector:
-        mock_get_image.return_value = Image.new("RGB", (100, 100))
-        mock_get_vector.return_value = Mock(
-            tolist=Mock(return_value=[0.1] * VECTOR_DIM))
-
-        result = process_image_metadata(
-            caption_entry, metadata_df, "test-topic", "test-data", BASE_BUCKET, mock_index
-        )
-        assert result == "1.jpg"
-        mock_index.upsert.assert_called_once()
-
-
 def test_process_and_upload_topic_parallel(mock_storage_client, mock_pinecone):
     """Test processing and uploading data for a topic in parallel."""
     caption_data = [{"image": "1.jpg", "caption": "A test caption"}]
     metadata_text = "source/id,brand,medias/0/url\n1,Brand A,https://example.com/image.jpg"
-    metadata_df = pd.read_csv(StringIO(metadata_text))
 
     mock_bucket = MagicMock()
     mock_blob_caption = MagicMock()
+    mock_blob_caption.name = "captioned_data/test-topic/test-data/captions.json"
     mock_blob_caption.download_as_text.return_value = json.dumps(caption_data)
     mock_blob_metadata = MagicMock()
+    mock_blob_metadata.name = "metadata/test-topic/test-data/metadata.csv"
     mock_blob_metadata.download_as_text.return_value = metadata_text
 
     mock_bucket.list_blobs.return_value = [
@@ -151,14 +213,478 @@ def test_process_and_upload_topic_parallel(mock_storage_client, mock_pinecone):
     mock_pinecone.return_value.Index.return_value = mock_index
 
     with patch("main.get_image_data") as mock_get_image, \
-            patch("main.get_clip_vector") as mock_get_vector:
+            patch("main.get_clip_image_vectors") as mock_get_vector:
         mock_get_image.return_value = Image.new("RGB", (100, 100))
-        mock_get_vector.return_value = [0.1] * VECTOR_DIM
+        mock_get_vector.side_effect = lambda images: np.full((len(images), VECTOR_DIM), 0.1)
 
         process_and_upload_topic_parallel(
             "test-topic", BASE_BUCKET, mock_index, "test-data", max_workers=1
         )
         mock_index.upsert.assert_called_once()
+        mock_get_vector.assert_called_once()
+
+
+def test_process_and_upload_topic_writes_local_index(topic_bucket, tmp_path):
+    """Test that uploaded records are also collected for the local index export."""
+    topic_bucket({1: "A great image"})
+    writer = LocalIndexWriter(str(tmp_path / "local_index"))
+
+    with patch("main.get_image_data") as mock_get_image, \
+            patch("main.get_clip_image_vectors") as mock_get_vector:
+        mock_get_image.return_value = Image.new("RGB", (100, 100))
+        mock_get_vector.side_effect = lambda images: np.full((len(images), VECTOR_DIM), 0.5)
+
+        process_and_upload_topic_parallel(
+            "test-topic", BASE_BUCKET, MagicMock(), "test-data", max_workers=1, local_writer=writer
+        )
+
+    assert writer.write() == 1
+    ids, vectors, metadata, info = load_embedding_export(str(tmp_path / "local_index"))
+    assert vectors.shape == (1, VECTOR_DIM)
+    assert ids.tolist() == ["test-topic 1.jpg"]
+    assert metadata.loc[0, "brand"] == "Brand 1"
+    with open(tmp_path / "local_index" / writer.version / "metadata.jsonl") as f:
+        assert json.loads(f.readline())["brand"] == "Brand 1"
+
+
+def make_record(i, dim=8):
+    return {"id": f"topic {i}.jpg", "values": [0.1] * dim, "metadata": {"brand": f"Brand {i}"}}
+
+
+def test_upsert_writer_batches_by_count_and_bytes():
+    """Test that records are upserted in batches bounded by count and payload size."""
+    mock_index = MagicMock()
+    with BatchedUpsertWriter(mock_index, batch_size=10, max_in_flight=2) as writer:
+        writer.upsert([make_record(i) for i in range(25)])
+    sizes = sorted(len(call.kwargs["vectors"]) for call in mock_index.upsert.call_args_list)
+    assert sizes == [5, 10, 10]
+    assert writer.stats()["upserted"] == 25
+    assert writer.stats()["batches"] == 3
 
+    mock_index = MagicMock()
+    record_bytes = len(json.dumps(make_record(0)))
+    with BatchedUpsertWriter(mock_index, batch_size=100, max_batch_bytes=3 * record_bytes) as writer:
+        for i in range(7):
+            writer.add(make_record(i))
+    sizes = sorted(len(call.kwargs["vectors"]) for call in mock_index.upsert.call_args_list)
+    assert sizes == [1, 3, 3]
+
+
+def test_upsert_writer_retries_with_backoff():
+    """Test that transient upsert errors are retried and permanent ones are reported."""
+    class UpsertError(Exception):
+        def __init__(self, status):
+            super().__init__(f"status {status}")
+            self.status = status
+
+    delays = []
+    mock_index = MagicMock()
+    mock_index.upsert.side_effect = [UpsertError(429), UpsertError(503), None, UpsertError(400)]
+    writer = BatchedUpsertWriter(mock_index, batch_size=2, max_in_flight=1, sleep=delays.append)
+    writer.upsert([make_record(i) for i in range(4)])
+    writer.close()
+
+    assert mock_index.upsert.call_count == 4
+    assert len(delays) == 2 and delays[0] < delays[1]
+    assert writer.stats()["upserted"] == 2
+    assert writer.stats()["retries"] == 2
+    assert writer.failed_ids == ["topic 2.jpg", "topic 3.jpg"]
+
+
+def test_process_and_upload_topic_parallel_with_writer(topic_bucket):
+    """Test that a topic is upserted in batches when processed through the writer."""
+    topic_bucket({i: "A test caption" for i in range(1, 6)})
+
+    mock_index = MagicMock()
+    with patch("main.get_image_data") as mock_get_image, \
+            patch("main.get_clip_image_vectors") as mock_get_vectors:
+        mock_get_image.return_value = Image.new("RGB", (100, 100))
+        mock_get_vectors.side_effect = lambda images: np.full((len(images), VECTOR_DIM), 0.1)
+
+        with BatchedUpsertWriter(mock_index, batch_size=2) as writer:
+            process_and_upload_topic_parallel(
+                "test-topic", BASE_BUCKET, writer, "test-data", max_workers=3
+            )
+
+    upserted = [record["id"] for call in mock_index.upsert.call_args_list for record in call.kwargs["vectors"]]
+    assert sorted(upserted) == [f"test-topic {i}.jpg" for i in range(1, 6)]
+    assert mock_index.upsert.call_count == 3
+
+
+def test_process_and_upload_topic_encodes_in_batches(topic_bucket):
+    """Test that downloaded images are encoded in fixed-size batches, in caption order."""
+    # Item 4 has no metadata and is skipped before encoding
+    topic_bucket({i: "A test caption" for i in range(1, 8)}, missing_metadata={4})
+
+    batch_sizes = []
+
+    def encode(images):
+        batch_sizes.append(len(images))
+        return np.array([[image.width] * VECTOR_DIM for image in images], dtype=np.float32)
+
+    mock_index = MagicMock()
+    with patch("main.get_image_data") as mock_get_image, \
+            patch("main.get_clip_image_vectors", side_effect=encode):
+        # Image width encodes the item number so vectors can be matched to records
+        mock_get_image.side_effect = lambda bucket, path: Image.new(
+            "RGB", (int(re.search(r"(\d+)\.jpg", path).group(1)), 10))
+
+        process_and_upload_topic_parallel(
+            "test-topic", BASE_BUCKET, mock_index, "test-data", max_workers=3, encode_batch_size=4
+        )
+
+    assert batch_sizes == [4, 2]
+    records = [call.args[0][0] for call in mock_index.upsert.call_args_list]
+    assert [record["id"] for record in records] == [f"test-topic {i}.jpg" for i in (1, 2, 3, 5, 6, 7)]
+    assert all(record["values"][0] == int(record["id"].split()[1][:-4]) for record in records)
+
+
+def test_get_clip_image_vectors_matches_single_encoding():
+    """Test that batch encoding returns one row per image, matching the single-image path."""
+    images = [Image.new("RGB", (64, 64), color) for color in ("red", "green", "blue")]
+    vectors = get_clip_image_vectors(images)
+    assert vectors.shape[0] == 3
+    assert vectors.dtype == np.float32
+    for image, vector in zip(images, vectors):
+        assert np.allclose(get_clip_vector(image, is_image=True), vector, atol=1e-4)
+    assert get_clip_image_vectors([]).shape == (0, vectors.shape[1])
+
+
+def test_join_captions_with_metadata():
+    """Test the id-indexed metadata join keeps caption order and drops unmatched entries."""
+    metadata_df = parse_metadata(
+        "source/id,brand,medias/0/url,categories/0,extra\n"
+        "3,Brand C,https://example.com/3.jpg,women,x\n"
+        "1,Brand A,https://example.com/1.jpg,men,x\n"
+        "1,Brand A duplicate,https://example.com/dup.jpg,men,x\n"
+        ",No id,https://example.com/none.jpg,men,x\n"
+    )
+    metadata_index = build_metadata_index(metadata_df)
+    assert metadata_index.index.is_unique
+    assert sorted(metadata_index.index) == [1, 3]
+    assert "extra" not in metadata_index.columns
+    assert metadata_index.loc[1, "brand"] == "Brand A"
+    # Columns missing from the CSV are filled with empty strings
+    assert metadata_index.loc[1, "item_url"] == ""
+
+    caption_data = [
+        {"image": "3.jpg", "caption": "third"},
+        {"image": "2.jpg", "caption": "no metadata"},
+        {"image": "cover.jpg", "caption": "no id"},
+        {"image": "image_1.jpg", "caption": "first"},
+    ]
+    joined = join_captions_with_metadata(caption_data, metadata_index)
+    assert [entry["caption"] for entry, _ in joined] == ["third", "first"]
+    assert joined[0][1]["brand"] == "Brand C"
+    assert joined[0][1]["gender"] == "women"
+    assert joined[1][1]["image_url"] == "https://example.com/1.jpg"
+    assert join_captions_with_metadata([], metadata_index) == []
+
+
+def test_get_image_data_missing_blob(mock_storage_client):
+    """Test that a missing image is detected from the download itself, without an exists() call."""
+    mock_blob = MagicMock()
+    mock_blob.download_as_bytes.side_effect = NotFound("No such object")
+    mock_storage_client.return_value.bucket.return_value.blob.return_value = mock_blob
+
+    with pytest.raises(FileNotFoundError):
+        get_image_data(BASE_BUCKET, "path/to/missing.jpg")
+    mock_blob.exists.assert_not_called()
+
+
+def test_get_image_data_reduced_decode(mock_storage_client):
+    """Test that large JPEGs are decoded at reduced size, but never below CLIP's input size."""
+    buffer = BytesIO()
+    Image.new("RGB", (2000, 1000), "red").save(buffer, format="JPEG")
+    mock_blob = MagicMock()
+    mock_blob.download_as_bytes.return_value = buffer.getvalue()
+    mock_storage_client.return_value.bucket.return_value.blob.return_value = mock_blob
+
+    image = get_image_data(BASE_BUCKET, "path/to/large.jpg")
+    assert image.mode == "RGB"
+    assert image.size == (500, 250)
+    mock_blob.download_as_bytes.assert_called_once()
+
+
+def test_index_manifest_journal(tmp_path):
+    """Test that only committed items are recorded, and that the journal survives reloads and torn writes."""
+    path = str(tmp_path / "manifest.jsonl")
+    manifest = IndexManifest(path, model_version="clip-a", clock=lambda: 100.0)
+    manifest.stage("topic 1.jpg", "hash-1")
+    manifest.stage("topic 2.jpg", "hash-2")
+    manifest.commit(["topic 1.jpg"])
+    manifest.close()
+
+    reloaded = IndexManifest(path, model_version="clip-a")
+    assert reloaded.load() == 1
+    assert reloaded.is_current("topic 1.jpg", "hash-1")
+    assert not reloaded.is_current("topic 1.jpg", "hash-changed")
+    assert not reloaded.is_current("topic 2.jpg", "hash-2")
+    assert reloaded.entries["topic 1.jpg"]["embedded_at"] == 100.0
+    # A different model invalidates every entry
+    other_model = IndexManifest(path, model_version="clip-b")
+    other_model.load()
+    assert not other_model.is_current("topic 1.jpg", "hash-1")
+
+    # Simulate a crash in the middle of writing a line
+    with open(path, "a") as f:
+        f.write('{"id": "topic 3.jpg", "ha')
+    reloaded = IndexManifest(path, model_version="clip-a")
+    assert reloaded.load() == 1
+    reloaded.stage("topic 3.jpg", "hash-3")
+    reloaded.commit(["topic 3.jpg"])
+    reloaded.remove(["topic 1.jpg"])
+    reloaded.close()
+
+    reloaded = IndexManifest(path, model_version="clip-a")
+    assert reloaded.load() == 1
+    assert reloaded.is_current("topic 3.jpg", "hash-3")
+    reloaded.compact()
+    with open(path) as f:
+        assert len(f.readlines()) == 1
+
+
+def test_process_and_upload_topic_incremental(topic_bucket, tmp_path):
+    """Test that reruns with a manifest only upsert new or changed items and prune vanished ones."""
+    captions = {i: f"caption {i}" for i in range(1, 5)}
+    image_md5 = {i: f"md5-{i}" for i in range(1, 5)}
+    topic_bucket(captions, image_md5)
+    manifest = IndexManifest(str(tmp_path / "manifest.jsonl"), model_version="clip")
+
+    def run():
+        mock_index = MagicMock()
+        with patch("main.get_image_data") as mock_get_image, \
+                patch("main.get_clip_image_vectors") as mock_get_vectors:
+            mock_get_image.return_value = Image.new("RGB", (100, 100))
+            mock_get_vectors.side_effect = lambda images: np.full((len(images), VECTOR_DIM), 0.1)
+            with BatchedUpsertWriter(mock_index, batch_size=2, on_upserted=manifest.commit) as writer:
+                process_and_upload_topic_parallel(
+                    "test-topic", BASE_BUCKET, writer, "test-data/", max_workers=2,
+                    manifest=manifest, prune=True
+                )
+        upserted = sorted(
+            record["id"] for call in mock_index.upsert.call_args_list for record in call.kwargs["vectors"])
+        deleted = [item_id for call in mock_index.delete.call_args_list for item_id in call.kwargs["ids"]]
+        return upserted, deleted, mock_get_image.call_count
+
+    assert run() == ([f"test-topic {i}.jpg" for i in range(1, 5)], [], 4)
+    assert len(manifest) == 4
+
+    # Nothing changed: nothing is downloaded, embedded or upserted
+    assert run() == ([], [], 0)
+
+    # A new caption, a replaced image, a new item and a removed item
+    captions[1] = "new caption 1"
+    image_md5[2] = "md5-2-replaced"
+    captions[5] = "caption 5"
+    image_md5[5] = "md5-5"
+    del captions[4]
+    assert run() == (["test-topic 1.jpg", "test-topic 2.jpg", "test-topic 5.jpg"], ["test-topic 4.jpg"], 3)
+    assert manifest.ids_with_prefix("test-topic ") == {f"test-topic {i}.jpg" for i in (1, 2, 3, 5)}
+
+
+def test_process_and_upload_topic_embeds_duplicate_images_once(topic_bucket):
+    """Test that items with identical image blobs are downloaded and encoded once and share the vector."""
+    image_md5 = {1: "md5-a", 2: "md5-b", 3: "md5-a", 4: "md5-a"}
+    topic_bucket({i: f"caption {i}" for i in image_md5}, image_md5)
+    mock_index = MagicMock()
+    with patch("main.get_image_data") as mock_get_image, \
+            patch("main.get_clip_image_vectors") as mock_get_vectors:
+        mock_get_image.return_value = Image.new("RGB", (100, 100))
+        mock_get_vectors.side_effect = lambda images: np.arange(len(images))[:, None] * np.ones((1, VECTOR_DIM))
+        uploaded = process_and_upload_topic_parallel(
+            "test-topic", BASE_BUCKET, mock_index, "test-data/", max_workers=2, dedupe=True)
+
+    assert uploaded == 4
+    assert sorted(call.args[1] for call in mock_get_image.call_args_list) == [
+        "scrapped_data/test-topic/test-data/1.jpg", "scrapped_data/test-topic/test-data/2.jpg"]
+    records = {record["id"]: record for call in mock_index.upsert.call_args_list for record in call.args[0]}
+    assert records["test-topic 3.jpg"]["values"] == records["test-topic 1.jpg"]["values"]
+    assert records["test-topic 4.jpg"]["values"] == records["test-topic 1.jpg"]["values"]
+    assert records["test-topic 2.jpg"]["values"] != records["test-topic 1.jpg"]["values"]
+    assert records["test-topic 4.jpg"]["metadata"]["brand"] == "Brand 4"
+    assert records["test-topic 4.jpg"]["metadata"]["caption"] == "caption 4"
+
+
+def test_ingest_topics_concurrently_under_budgets(mock_storage_client):
+    """Test that topics run concurrently, share the encoder budget and report per-topic throughput."""
+    def list_blobs(prefix):
+        topic = prefix.split("/")[1]
+        if topic == "broken-topic":
+            return []
+        blob = MagicMock()
+        if prefix.startswith("captioned_data"):
+            blob.name = f"{prefix}captions.json"
+            blob.download_as_text.return_value = json.dumps(
+                [{"image": f"{i}.jpg", "caption": f"{topic} {i}"} for i in range(1, 7)])
+        else:
+            blob.name = f"{prefix}metadata.csv"
+            blob.download_as_text.return_value = "source/id,brand\n" + "\n".join(f"{i},Brand" for i in range(1, 7))
+        return [blob]
+
+    mock_storage_client.return_value.bucket.return_value.list_blobs.side_effect = list_blobs
+
+    lock = threading.Lock()
+    active = {"encoders": 0, "max_encoders": 0, "topics": set()}
+
+    def encode(images):
+        with lock:
+            active["encoders"] += 1
+            active["max_encoders"] = max(active["max_encoders"], active["encoders"])
+            active["topics"].add(threading.current_thread().name)
+        time.sleep(0.01)
+        with lock:
+            active["encoders"] -= 1
+        return np.full((len(images), VECTOR_DIM), 0.1)
+
+    mock_index = MagicMock()
+    with patch("main.get_image_data") as mock_get_image, \
+            patch("main.get_clip_image_vectors", side_effect=encode):
+        mock_get_image.return_value = Image.new("RGB", (100, 100))
+        summaries = ingest_topics(
+            [("topic-a", "data/"), ("topic-b", "data/"), ("broken-topic", "data/")],
+            BASE_BUCKET, mock_index, max_concurrent_topics=3, download_workers=4, encoder_slots=1,
+            encode_batch_size=2,
+        )
 
-test_get_image_data(mock_storage_client)
+    assert [summary["topic"] for summary in summaries] == ["topic-a", "topic-b", "broken-topic"]
+    assert [summary["items"] for summary in summaries] == [6, 6, 0]
+    assert summaries[0]["error"] is None
+    assert "No json file found" in summaries[2]["error"]
+    assert summaries[0]["items_per_second"] > 0
+    # Both healthy topics encoded from their own thread, never more than one batch at a time
+    assert len(active["topics"]) == 2
+    assert active["max_encoders"] == 1
+    assert mock_index.upsert.call_count == 12
+
+
+def test_process_pool_encoder_matches_in_process_encoding(mock_storage_client):
+    """Test that worker-process encoding through shared memory matches in-process encoding."""
+    images = [Image.new("RGB", (40 + 10 * i, 30), (30 * i, 255 - 30 * i, 90)) for i in range(5)]
+    expected = get_clip_image_vectors(images)
+
+    with ProcessPoolImageEncoder(num_workers=2, torch_threads=1) as encoder:
+        futures = [encoder.submit(images[:3]), encoder.submit(images[3:])]
+        vectors = np.concatenate([future.result() for future in futures])
+        assert np.allclose(vectors, expected, atol=1e-4)
+
+        caption_data = [{"image": f"{i}.jpg", "caption": "A test caption"} for i in range(1, 6)]
+        mock_blob_caption = MagicMock()
+        mock_blob_caption.name = "captioned_data/test-topic/test-data/captions.json"
+        mock_blob_caption.download_as_text.return_value = json.dumps(caption_data)
+        mock_blob_metadata = MagicMock()
+        mock_blob_metadata.name = "metadata/test-topic/test-data/metadata.csv"
+        mock_blob_metadata.download_as_text.return_value = "source/id,brand\n" + "\n".join(
+            f"{i},Brand {i}" for i in range(1, 6))
+        mock_storage_client.return_value.bucket.return_value.list_blobs.return_value = [
+            mock_blob_caption, mock_blob_metadata]
+
+        mock_index = MagicMock()
+        with patch("main.get_image_data") as mock_get_image:
+            mock_get_image.side_effect = lambda bucket, path: images[int(re.search(r"(\d+)\.jpg", path).group(1)) - 1]
+            uploaded = process_and_upload_topic_parallel(
+                "test-topic", BASE_BUCKET, mock_index, "test-data", max_workers=2,
+                encode_batch_size=2, encoder=encoder
+            )
+
+    assert uploaded == 5
+    records = [call.args[0][0] for call in mock_index.upsert.call_args_list]
+    assert [record["id"] for record in records] == [f"test-topic {i}.jpg" for i in range(1, 6)]
+    assert np.allclose([record["values"] for record in records], expected, atol=1e-4)
+
+
+def test_embedding_export_versions(tmp_path):
+    """Test that each export is a new memory-mappable version with a Parquet metadata table."""
+    root = str(tmp_path / "export")
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(10, VECTOR_DIM)).astype(np.float32)
+    metadata = [{"brand": f"Brand {i}", "gender": "women" if i % 2 else float("nan"), "caption": i}
+                for i in range(10)]
+
+    writer = LocalIndexWriter(root, version="v1", model_name="clip", chunk_rows=3)
+    for i in range(10):
+        writer.add(f"topic {i}.jpg", vectors[i], metadata[i])
+    assert writer.write() == 10
+
+    ids, loaded, table, info = load_embedding_export(root)
+    assert isinstance(loaded, np.memmap)
+    assert np.array_equal(loaded, vectors)
+    assert ids[3] == "topic 3.jpg"
+    assert info["version"] == "v1"
+    assert info["dimension"] == VECTOR_DIM
+    assert info["count"] == 10
+    assert list(table.columns) == ["id", "brand", "gender", "caption"]
+    assert table["gender"].isna().sum() == 5
+    assert np.allclose(np.load(tmp_path / "export" / "v1" / "norms.npy"), np.linalg.norm(vectors, axis=1))
+
+    writer = LocalIndexWriter(root, dtype="float16", version="v2")
+    writer.add("topic 0.jpg", vectors[0], metadata[0])
+    assert writer.write() == 1
+
+    ids, loaded, table, info = load_embedding_export(root, columns=["id", "brand"])
+    assert loaded.dtype == np.float16
+    assert info["version"] == "v2"
+    assert list(table.columns) == ["id", "brand"]
+    # Earlier versions stay loadable
+    assert load_embedding_export(root, version="v1")[1].shape == (10, VECTOR_DIM)
+    assert not [name for name in os.listdir(root) if name.endswith(".tmp")]
+
+
+def test_embedding_export_carries_over_unchanged_items(tmp_path):
+    """
+    Test that a delta run's export keeps unchanged items, takes re-embedded ones and drops pruned
+    ones, and keeps the previous vector of an item whose new one Pinecone did not accept.
+    """
+    root = str(tmp_path / "export")
+    vectors = np.random.default_rng(0).normal(size=(4, VECTOR_DIM)).astype(np.float32)
+    writer = LocalIndexWriter(root, version="v1", model_name="clip")
+    for i in range(3):
+        writer.add(f"topic {i}.jpg", vectors[i], {"brand": f"Brand {i}"})
+    writer.write()
+
+    # Item 1 changed, item 2 was pruned from the manifest, item 3 is new and item 0's upsert failed
+    writer = LocalIndexWriter(root, version="v2", model_name="clip")
+    writer.add("topic 0.jpg", vectors[3], {"brand": "Failed brand"})
+    writer.add("topic 1.jpg", vectors[3], {"brand": "New brand"})
+    writer.add("topic 3.jpg", vectors[3], {"brand": "Brand 3"})
+    writer.discard(["topic 0.jpg"])
+    assert len(writer) == 2
+    assert writer.carry_over({"topic 0.jpg", "topic 1.jpg", "topic 3.jpg"}) == 1
+    assert writer.write() == 3
+
+    ids, loaded, table, info = load_embedding_export(root)
+    assert info["version"] == "v2"
+    rows = dict(zip(ids, range(len(ids))))
+    assert sorted(rows) == ["topic 0.jpg", "topic 1.jpg", "topic 3.jpg"]
+    assert np.array_equal(loaded[rows["topic 0.jpg"]], vectors[0])
+    assert np.array_equal(loaded[rows["topic 1.jpg"]], vectors[3])
+    assert table.set_index("id").loc["topic 0.jpg", "brand"] == "Brand 0"
+
+    # Vectors of another model are never mixed into a version
+    writer = LocalIndexWriter(root, version="v3", model_name="other")
+    assert writer.carry_over(set(ids)) == 0
+    assert LocalIndexWriter(str(tmp_path / "empty")).carry_over({"topic 0.jpg"}) == 0
+
+
+def test_embedding_export_with_quantization(tmp_path):
+    """Test that an export can carry PQ codes that pinecone-service searches with re-ranking."""
+    root = str(tmp_path / "export")
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(300, VECTOR_DIM)).astype(np.float32)
+
+    writer = LocalIndexWriter(root, version="v1", quantization="pq", pq_subspaces=16)
+    for i, vector in enumerate(vectors):
+        writer.add(f"topic {i}.jpg", vector, {"brand": f"Brand {i}"})
+    writer.write()
+
+    version_dir = tmp_path / "export" / "v1"
+    codes = np.load(version_dir / "codes.npy")
+    assert codes.shape == (300, 16)
+    assert codes.dtype == np.uint8
+    assert load_embedding_export(root)[3]["quantization"] == "pq"
+
+    quantizer = load_quantizer(str(version_dir / "quantizer.npz"))
+    assert np.array_equal(quantizer.encode(vectors[:5]), codes[:5])
+
+    with pytest.raises(ValueError):
+        LocalIndexWriter(root, quantization="int4")
@@ -0,0 +1,182 @@
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Pinecone rejects upsert requests over 2MB and recommends batches of about 100 vectors
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_MAX_BATCH_BYTES = 2 * 1024 * 1024
+# Pinecone deletes at most 1000 ids per request
+DELETE_BATCH_SIZE = 1000
+# HTTP statuses worth retrying; errors without a status (connection resets, timeouts) are retried too
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+def record_size(record):
+    """Approximate serialized size of an upsert record in bytes."""
+    return len(json.dumps(record, default=str))
+
+
+def is_retryable(error):
+    status = getattr(error, "status", None) or getattr(error, "status_code", None)
+    return status is None or status in RETRYABLE_STATUSES
+
+
+class BatchedUpsertWriter:
+    """
+    Buffers records and upserts them to a Pinecone index in batches.
+
+    A batch is sent when it reaches `batch_size` records or `max_batch_bytes`
+    of payload. Up to `max_in_flight` batches are upserted concurrently;
+    `upsert()` blocks once that many are pending, so the producers can never
+    run ahead of Pinecone. Failed batches are retried with exponential backoff
+    and jitter, and the records of batches that still fail are counted in
+    `failed_ids`.
+
+    `upsert(vectors)` and `delete(ids)` have the same shape as the `Index`
+    methods, so the writer can stand in for the index wherever records are
+    produced. `on_upserted`, if given, is called with the ids of every batch
+    once Pinecone has accepted it.
+    """
+
+    def __init__(self, index, batch_size=DEFAULT_BATCH_SIZE, max_batch_bytes=DEFAULT_MAX_BATCH_BYTES,
+                 max_in_flight=4, max_retries=5, backoff_seconds=0.5, max_backoff_seconds=30.0,
+                 on_upserted=None, sleep=time.sleep, clock=time.monotonic):
+        self.index = index
+        self.on_upserted = on_upserted
+        self.batch_size = batch_size
+        self.max_batch_bytes = max_batch_bytes
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.sleep = sleep
+        self.clock = clock
+
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="upsert")
+        self._pending = set()
+
+        self.started_at = None
+        self.upserted = 0
+        self.batches = 0
+        self.retries = 0
+        self.failed_ids = []
+        self.last_error = None
+
+    @classmethod
+    def from_env(cls, index, on_upserted=None):
+        return cls(
+            index,
+            on_upserted=on_upserted,
+            batch_size=int(os.getenv("UPSERT_BATCH_SIZE", DEFAULT_BATCH_SIZE)),
+            max_batch_bytes=int(os.getenv("UPSERT_MAX_BATCH_BYTES", DEFAULT_MAX_BATCH_BYTES)),
+            max_in_flight=int(os.getenv("UPSERT_MAX_IN_FLIGHT", 4)),
+            max_retries=int(os.getenv("UPSERT_MAX_RETRIES", 5)),
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add(self, record):
+        """Buffer one {"id", "values", "metadata"} record, sending the batch once it is full."""
+        size = record_size(record)
+        with self._lock:
+            if self.started_at is None:
+                self.started_at = self.clock()
+            batch = None
+            if self._buffer and self._buffer_bytes + size > self.max_batch_bytes:
+                batch = self._take_buffer()
+            self._buffer.append(record)
+            self._buffer_bytes += size
+            if batch is None and len(self._buffer) >= self.batch_size:
+                batch = self._take_buffer()
+        if batch:
+            self._submit(batch)
+
+    def upsert(self, vectors):
+        for record in vectors:
+            self.add(record)
+
+    def flush(self):
+        """Send the buffered records and wait for every in-flight batch to finish."""
+        with self._lock:
+            batch = self._take_buffer()
+        if batch:
+            self._submit(batch)
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            for future in pending:
+                future.result()
+
+    def delete(self, ids):
+        """Delete vectors by id, after flushing so a buffered upsert cannot re-add them."""
+        self.flush()
+        for start in range(0, len(ids), DELETE_BATCH_SIZE):
+            self.index.delete(ids=ids[start:start + DELETE_BATCH_SIZE])
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+
+    def _take_buffer(self):
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        return batch
+
+    def _submit(self, batch):
+        # Blocks the producer while `max_in_flight` batches are already pending
+        self._slots.acquire()
+        future = self._executor.submit(self._send, batch)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        self._slots.release()
+
+    def _send(self, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.index.upsert(vectors=batch)
+                break
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    print(f"Upsert of {len(batch)} records failed: {e}")
+                    with self._lock:
+                        self.failed_ids.extend(record["id"] for record in batch)
+                        self.last_error = str(e)
+                    return
+                with self._lock:
+                    self.retries += 1
+                delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt)
+                self.sleep(delay * random.uniform(0.5, 1.0))
+        with self._lock:
+            self.upserted += len(batch)
+            self.batches += 1
+        if self.on_upserted is not None:
+            self.on_upserted([record["id"] for record in batch])
+
+    def stats(self):
+        elapsed = self.clock() - self.started_at if self.started_at is not None else 0.0
+        return {
+            "upserted": self.upserted,
+            "batches": self.batches,
+            "retries": self.retries,
+            "failed": len(self.failed_ids),
+            "buffered": len(self._buffer),
+            "in_flight": len(self._pending),
+            "upserts_per_second": round(self.upserted / elapsed, 1) if elapsed > 0 else 0.0,
+        }